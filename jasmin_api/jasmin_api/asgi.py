@@ -0,0 +1,18 @@
+"""
+ASGI config for jasmin_api project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+to be run by any ASGI server, e.g. ``uvicorn jasmin_api.asgi:application``.
+Reads are then served by the async views of rest_api.views.asynchronous.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "jasmin_api.settings")
+
+application = get_asgi_application()
@@ -14,6 +14,57 @@ TELNET_PORT = 8990
 TELNET_USERNAME = 'jcliadmin'
 TELNET_PW = 'jclipwd'  # no alternative storing as plain text
 TELNET_TIMEOUT = 10  # reasonable value for intranet.
+#'telnet' spawns the telnet client, 'socket' talks to jcli over plain TCP,
+#'replay' serves the transcript in JCLI_REPLAY_FILE
+TELNET_TRANSPORT = 'telnet'
+#Set to a directory to record every jcli session there as a transcript
+JCLI_RECORD_DIR = None
+JCLI_REPLAY_FILE = None
+#Jasmin nodes, by name: keys host, port, username, password and http_url,
+#each defaulting to the TELNET_* settings and JASMIN_HTTP_URL. Requests
+#pick one with an /api/backends/<name>/ prefix or the BACKEND_HEADER header
+JASMIN_BACKENDS = {'default': {}}
+DEFAULT_BACKEND = 'default'
+BACKEND_HEADER = 'X-Jasmin-Backend'
+#Idle jcli sessions kept per backend for later requests, 0 to close every
+#session after its request; sessions idle for longer are closed. Released
+#sessions are reused after JCLI_POOL_SETTLE seconds, once late output is read
+JCLI_POOL_SIZE = 8
+JCLI_POOL_MAX_IDLE = 60
+JCLI_POOL_SETTLE = 0.01
+#Most jcli sessions open to one backend at once, by all the worker processes
+#of run_cherrypy.py together, idle pooled ones included; 0 for no cap.
+#Requests wait up to TELNET_TIMEOUT seconds for a session, then get a 503
+JCLI_MAX_SESSIONS = 0
+#Backends queried at once by the cluster endpoints
+CLUSTER_CONCURRENCY = 8
+#Under ASGI (jasmin_api.asgi) reads are served by async views, see
+#rest_api.views.asynchronous; None to leave them to the viewsets. Each
+#process then uses, and keeps idle, at most ASYNC_JCLI_SESSIONS jcli
+#sessions per backend
+ASGI_URLCONF = 'jasmin_api.urls_async'
+ASYNC_JCLI_SESSIONS = 50
+#run_cherrypy.py, see ./run_cherrypy.py --help to override these: address,
+#worker processes (0 for one per CPU) and threads in each, listen backlog,
+#seconds a connection may stay idle, and HTTP/1.1 keep-alive with at most
+#SERVER_KEEP_ALIVE_CONNECTIONS idle connections kept open per worker
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 8000
+SERVER_WORKERS = 1
+SERVER_THREADS = 10
+SERVER_SOCKET_QUEUE_SIZE = 5
+SERVER_SOCKET_TIMEOUT = 10
+SERVER_KEEP_ALIVE = True
+SERVER_KEEP_ALIVE_CONNECTIONS = 10
+#With several workers, they share their metrics and readiness through files
+#in WORKERS_DIR, a temporary directory by default
+WORKERS_DIR = None
+#Before reporting ready at /readyz, each run_cherrypy.py worker logs in
+#WARMUP_SESSIONS jcli sessions to every backend (JCLI_POOL_SIZE at most, and
+#dropped after JCLI_POOL_MAX_IDLE seconds unused), and with WARMUP_PRELOAD the
+#first worker refreshes the mirror from jcli
+WARMUP_SESSIONS = 2
+WARMUP_PRELOAD = True
 
 
 REST_FRAMEWORK = {
@@ -24,6 +75,10 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 ################################################################################
@@ -34,6 +89,67 @@ REST_FRAMEWORK = {
 STANDARD_PROMPT = 'jcli : '  # There should be no need to change this
 INTERACTIVE_PROMPT ='> '  # Prompt for interactive commands
 
+#Add a debug_timing block with per command jcli timings to JSON responses
+SERVER_TIMING_DEBUG = False
+
+#With PROFILING_ENABLED, superusers can profile a request by sending an
+#X-Profile header. The last PROFILE_RING_SIZE cProfile dumps are kept in
+#PROFILE_DIR
+PROFILING_ENABLED = False
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_RING_SIZE = 20
+
+#Largest page a list endpoint returns for ?limit=
+MAX_PAGE_SIZE = 1000
+
+#Encode JSON responses with orjson, when it is installed
+FAST_JSON = True
+
+#Compress responses of COMPRESSION_MIN_SIZE bytes or more with brotli (when
+#the brotli package is installed) or gzip, as the client accepts
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+
+#Users, groups, filters, routes and connectors are mirrored in the database.
+#Reads are served from a mirrored table refreshed less than MIRROR_MAX_AGE
+#seconds ago, from jcli otherwise (which refreshes it). run_cherrypy.py
+#refreshes the mirror every MIRROR_SYNC_INTERVAL seconds, 0 to not do it
+MIRROR_ENABLED = True
+MIRROR_MAX_AGE = 60
+MIRROR_SYNC_INTERVAL = 30
+#Changes to mirrored objects are kept for ?since= requests, up to this many
+MIRROR_CHANGELOG_SIZE = 100000
+#Refuse deleting groups, SMPP connectors and filters still used by users,
+#filters or routes, as recorded in the mirror
+DELETE_CHECKS = True
+
+#The first run_cherrypy.py worker samples jcli stats every STATS_INTERVAL
+#seconds, 0 to not do it, keeping the last STATS_RING_SIZE samples of every
+#user and SMPP connector in the database. Per object stats commands are run for STATS_DETAIL_BATCH
+#users and connectors per sample, in turn
+STATS_INTERVAL = 10
+STATS_RING_SIZE = 720
+STATS_DETAIL_BATCH = 10
+
+#POST /api/messages forwards messages to Jasmin's HTTP API /send at
+#JASMIN_HTTP_URL, over at most SUBMIT_CONCURRENCY keep-alive connections
+#at a time, waiting SUBMIT_TIMEOUT seconds for each
+JASMIN_HTTP_URL = 'http://127.0.0.1:1401'
+SUBMIT_CONCURRENCY = 10
+SUBMIT_TIMEOUT = 10
+SUBMIT_MAX_BATCH = 1000
+
+#HTTP client connector base URLs are probed PROBE_CONCURRENCY at a time,
+#waiting PROBE_TIMEOUT seconds, or PROBE_TIMEOUTS[host], for an answer.
+#Results are reused for PROBE_TTL seconds; the first run_cherrypy.py worker
+#probes every connector every PROBE_INTERVAL seconds, 0 to not do it
+PROBE_TIMEOUT = 3
+PROBE_TIMEOUTS = {}
+PROBE_TTL = 60
+PROBE_INTERVAL = 60
+PROBE_CONCURRENCY = 200
+
 #This should be OK for REST API - we are not generating URLs
 #see https://www.djangoproject.com/weblog/2013/feb/19/security/#s-issue-host-header-poisoning
 ALLOWED_HOSTS = ['*']
@@ -47,6 +163,11 @@ SPECTACULAR_SETTINGS = {
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
 }
+#/api/schema/ generates the schema on first use and keeps it in memory, see
+#rest_api.schema. When set, SCHEMA_FILE is read instead, and written on first
+#use if missing: generate it when building a release with
+#./manage.py spectacular --file <SCHEMA_FILE>, or delete it on upgrade
+SCHEMA_FILE = None
 
 
 # Application definition
@@ -64,6 +185,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rest_api.middleware.ProfilingMiddleware',
+    'rest_api.middleware.MetricsMiddleware',
+    'rest_api.middleware.CompressionMiddleware',
+    'rest_api.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -103,6 +228,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'jasmin_api.wsgi.application'
+ASGI_APPLICATION = 'jasmin_api.asgi.application'
 
 
 # Database
@@ -115,6 +241,8 @@ DATABASES = {
     }
 }
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
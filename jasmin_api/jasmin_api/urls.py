@@ -1,10 +1,11 @@
 from django.urls import include, path
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
 from rest_framework.routers import DefaultRouter
 
 from rest_api.views import (
-    GroupViewSet, UserViewSet, MORouterViewSet, SMPPCCMViewSet, HTTPCCMViewSet, MTRouterViewSet, FiltersViewSet
+    GroupViewSet, UserViewSet, MORouterViewSet, SMPPCCMViewSet, HTTPCCMViewSet, MTRouterViewSet, FiltersViewSet,
+    UserStatsViewSet, SMPPCStatsViewSet, MessagesViewSet, ClusterViewSet, metrics, ProfileListView, ProfileDownloadView,
+    schema, swagger_ui, redoc, healthz, readyz
 )
 
 router = DefaultRouter(trailing_slash=False)
@@ -15,10 +16,19 @@ router.register(r'mtrouters', MTRouterViewSet, basename='mtrouters')
 router.register(r'smppsconns', SMPPCCMViewSet, basename='smppcons')
 router.register(r'httpsconns', HTTPCCMViewSet, basename='httpcons')
 router.register(r'filters', FiltersViewSet, basename='filters')
+router.register(r'stats/users', UserStatsViewSet, basename='userstats')
+router.register(r'stats/smppcs', SMPPCStatsViewSet, basename='smppcstats')
+router.register(r'messages', MessagesViewSet, basename='messages')
+router.register(r'cluster', ClusterViewSet, basename='cluster')
 
 urlpatterns = [
     path('api/', include(router.urls)),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('metrics', metrics, name='metrics'),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
+    path('profiles/', ProfileListView.as_view(), name='profiles'),
+    path('profiles/<str:name>', ProfileDownloadView.as_view(), name='profile-download'),
+    path('api/schema/', schema, name='schema'),
+    path('docs/', swagger_ui, name='swagger-ui'),
+    path('redoc/', redoc, name='redoc'),
 ]
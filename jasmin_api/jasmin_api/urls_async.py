@@ -0,0 +1,12 @@
+"""URLconf of the /api/ requests of the ASGI application
+
+Every API request goes to the async dispatcher, which serves the reads it
+has async views for and hands the rest to the viewsets of jasmin_api.urls.
+"""
+from django.urls import re_path
+
+from rest_api.views.asynchronous import dispatch
+
+from .urls import urlpatterns
+
+urlpatterns = [re_path(r'^api/', dispatch)] + urlpatterns
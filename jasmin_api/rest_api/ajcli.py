@@ -0,0 +1,247 @@
+"""jcli sessions on asyncio, for the async views of the ASGI application
+
+An AsyncSession speaks to jcli over TCP, answering its telnet negotiation
+as the 'socket' transport does (see rest_api.telnet), so that it serves
+TELNET_TRANSPORT = 'telnet' and 'socket' alike, and waits for its prompts
+without holding a thread. Each
+event loop keeps its own AsyncSessionPool per backend: at most
+ASYNC_JCLI_SESSIONS sessions are in use at once, further requests wait for
+one, and as many idle ones are kept for JCLI_POOL_MAX_IDLE seconds (none
+when JCLI_POOL_SIZE is 0). Commands are always read up to the prompt, so
+released sessions need no settling.
+
+Recorded and replayed transcripts go through pexpect: enabled() is False
+while JCLI_RECORD_DIR or TELNET_TRANSPORT = 'replay' is set, and the async
+views then leave every request to the viewsets.
+"""
+import asyncio
+import contextlib
+import time
+import weakref
+
+from django.conf import settings
+
+from .exceptions import (TelnetUnexpectedResponse, TelnetConnectionTimeout,
+                         TelnetConnectionRefused, TelnetLoginFailed)
+from .jcli import command_family
+from . import budget, health, metrics, timing
+from .telnet import Negotiation
+
+#Largest reply read, listings of many users or routes included
+READ_LIMIT = 64 * 1024 * 1024
+#bytes read from the socket at once
+CHUNK_SIZE = 64 * 1024
+
+
+def enabled():
+    return (not getattr(settings, 'JCLI_RECORD_DIR', None)
+            and getattr(settings, 'TELNET_TRANSPORT', 'telnet') != 'replay')
+
+
+class AsyncSession:
+    "A jcli session logged in and sitting at the standard prompt"
+
+    def __init__(self, reader, writer, slot):
+        self.reader = reader
+        self.writer = writer
+        self.slot = slot
+        self.released = None
+        self.negotiation = Negotiation()
+        #data read past the last prompt
+        self.buffer = bytearray()
+
+    async def _read_until(self, text):
+        data = await asyncio.wait_for(
+            self._read_to(text.encode('utf-8')), settings.TELNET_TIMEOUT)
+        return data.decode('utf-8', 'replace')
+
+    async def _read_to(self, separator):
+        """Data up to and including separator, telnet commands stripped out
+        and answered on the way"""
+        start = 0
+        while True:
+            end = self.buffer.find(separator, start)
+            if end != -1:
+                end += len(separator)
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return data
+            if len(self.buffer) > READ_LIMIT:
+                raise asyncio.LimitOverrunError(
+                    'Separator not found within READ_LIMIT', len(self.buffer))
+            chunk = await self.reader.read(CHUNK_SIZE)
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(self.buffer), None)
+            data, reply = self.negotiation.feed(chunk)
+            if reply:
+                self.writer.write(reply)
+            start = max(0, len(self.buffer) - len(separator) + 1)
+            self.buffer += data
+
+    def _send(self, line):
+        self.writer.write((line + '\n').encode('utf-8'))
+
+    async def command(self, line):
+        """Run a command and return what jcli answered before the prompt,
+        echoed command included, as pexpect's before would hold"""
+        self._send(line)
+        start = time.perf_counter()
+        try:
+            reply = await self._read_until(settings.STANDARD_PROMPT)
+        except asyncio.TimeoutError:
+            metrics.JCLI_ERRORS.inc(stage='command', kind='timeout')
+            raise TelnetConnectionTimeout
+        except asyncio.IncompleteReadError:
+            metrics.JCLI_ERRORS.inc(stage='command', kind='eof')
+            raise TelnetUnexpectedResponse
+        finally:
+            family = command_family(line)
+            elapsed = time.perf_counter() - start
+            metrics.JCLI_COMMAND_SECONDS.observe(elapsed, command=family)
+            timing.record_round_trip(family, elapsed)
+        reply = reply[:-len(settings.STANDARD_PROMPT)].replace('\r', '')
+        return reply[:-1] if reply.endswith('\n') else reply
+
+    async def lines(self, command):
+        """Table lines of a listing command, as rest_api.tools.list_lines
+        returns them"""
+        return (await self.command(command)).split('\n')[2:-1]
+
+    def usable(self):
+        return not (self.reader.at_eof() or self.writer.is_closing())
+
+    def close(self):
+        try:
+            self._send('quit')
+        except (OSError, RuntimeError):
+            pass
+        finally:
+            self.writer.close()
+            self.slot.release()
+            metrics.JCLI_SESSIONS_OPEN.dec()
+
+
+async def connect(backend):
+    """Open a session to the jcli of backend and log in, once it has a slot
+    of the backend's JCLI_MAX_SESSIONS"""
+    slot = await budget.atake(backend)
+    try:
+        session = await _login(backend, slot)
+    except BaseException as e:
+        slot.release()
+        health.failed(backend.name, e)
+        raise
+    health.contacted(backend.name)
+    return session
+
+
+async def _login(backend, slot):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(backend.host, backend.port, limit=READ_LIMIT),
+            settings.TELNET_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.JCLI_ERRORS.inc(stage='connect', kind='timeout')
+        raise TelnetConnectionTimeout
+    except OSError:
+        metrics.JCLI_ERRORS.inc(stage='connect', kind='refused')
+        raise TelnetConnectionRefused
+    session = AsyncSession(reader, writer, slot)
+    stage = 'connect'
+    try:
+        await session._read_until('Username: ')
+        connected = time.perf_counter()
+        metrics.JCLI_CONNECT_SECONDS.observe(connected - start)
+        timing.record('spawn', connected - start)
+        stage = 'login'
+        session._send(backend.username)
+        await session._read_until('Password: ')
+        session._send(backend.password)
+        await session._read_until(settings.STANDARD_PROMPT)
+    except asyncio.TimeoutError:
+        writer.close()
+        metrics.JCLI_ERRORS.inc(stage=stage, kind='timeout')
+        raise TelnetConnectionTimeout
+    except asyncio.IncompleteReadError:
+        writer.close()
+        metrics.JCLI_ERRORS.inc(stage=stage, kind='eof')
+        raise TelnetLoginFailed if stage == 'login' else TelnetUnexpectedResponse
+    logged_in = time.perf_counter()
+    metrics.JCLI_LOGIN_SECONDS.observe(logged_in - connected)
+    timing.record('login', logged_in - connected)
+    metrics.JCLI_SESSIONS_OPENED.inc()
+    metrics.JCLI_SESSIONS_OPEN.inc()
+    return session
+
+
+class AsyncSessionPool:
+    "Sessions of a backend on one event loop"
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.idle = []
+        self.slots = asyncio.Semaphore(settings.ASYNC_JCLI_SESSIONS)
+
+    async def acquire(self):
+        "An idle session still open, else a new one, once a slot is free"
+        await self.slots.acquire()
+        try:
+            deadline = time.monotonic() - settings.JCLI_POOL_MAX_IDLE
+            while self.idle:
+                session = self.idle.pop()
+                if session.released >= deadline and session.usable():
+                    return session
+                session.close()
+            return await connect(self.backend)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, session, reuse=True):
+        "Keep a session at the standard prompt for later, else close it"
+        self.slots.release()
+        if reuse:
+            health.contacted(self.backend.name)
+        if (reuse and session.usable() and settings.JCLI_POOL_SIZE > 0
+                and len(self.idle) < settings.ASYNC_JCLI_SESSIONS):
+            session.released = time.monotonic()
+            self.idle.append(session)
+        else:
+            session.close()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
+#{event loop: {Backend: AsyncSessionPool}}
+_pools = weakref.WeakKeyDictionary()
+
+
+def pool(backend):
+    "Session pool of backend on the running event loop"
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    if backend not in pools:
+        pools[backend] = AsyncSessionPool(backend)
+    return pools[backend]
+
+
+@contextlib.asynccontextmanager
+async def session(backend):
+    """A pooled session of backend for the duration of the block. It is
+    only reused when the block raised nothing"""
+    backend_pool = pool(backend)
+    jcli = await backend_pool.acquire()
+    try:
+        yield jcli
+    except BaseException:
+        backend_pool.release(jcli, False)
+        raise
+    backend_pool.release(jcli)
+
+
+def close():
+    "Close the idle sessions of the running event loop"
+    for backend_pool in _pools.pop(asyncio.get_running_loop(), {}).values():
+        backend_pool.close()
@@ -0,0 +1,295 @@
+"""Jasmin nodes this API manages, and a pool of jcli sessions to each
+
+JASMIN_BACKENDS names the nodes; keys a backend leaves out default to the
+TELNET_* settings and JASMIN_HTTP_URL. A request works on the backend named
+by its /api/backends/<name>/ path prefix or BACKEND_HEADER header, else on
+DEFAULT_BACKEND; TelnetConnectionMiddleware makes it the current backend of
+the thread for the request. The database mirror only follows
+DEFAULT_BACKEND.
+
+fan_out() runs a read on every backend at once, for the cluster endpoints.
+"""
+import contextlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pexpect
+from django.conf import settings
+from pexpect.socket_pexpect import SocketSpawn
+from rest_framework.exceptions import APIException
+
+from . import health
+from .exceptions import ObjectNotFoundError
+from .jcli import connect, disconnect
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """Idle jcli sessions of a backend, at most JCLI_POOL_SIZE of them,
+    reused for JCLI_POOL_MAX_IDLE seconds. Sessions are only ever used by
+    one thread at a time.
+
+    Released sessions are only reused JCLI_POOL_SETTLE seconds later, once
+    the settler thread read and dropped any output that came late, such as
+    the extra prompt of the 'persist\\n' the viewsets send."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.closed = False
+
+    @staticmethod
+    def enabled():
+        "Recorded and replayed transcripts need a session per request"
+        return (settings.JCLI_POOL_SIZE > 0
+                and not getattr(settings, 'JCLI_RECORD_DIR', None)
+                and getattr(settings, 'TELNET_TRANSPORT', 'telnet') != 'replay')
+
+    def acquire(self):
+        "An idle session still open, else a new one"
+        deadline = time.monotonic() - settings.JCLI_POOL_MAX_IDLE
+        while True:
+            try:
+                telnet, released = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if released >= deadline and _drain(telnet):
+                self._count(1)
+                return telnet
+            disconnect(telnet)
+        telnet = connect(self.backend)
+        self._count(1)
+        return telnet
+
+    def release(self, telnet, reuse=True, request=None, response=None):
+        """Give a session back. It is kept when reuse is set (it must then be
+        at the standard prompt) and the pool is enabled, closed otherwise"""
+        self._count(-1)
+        if reuse:
+            health.contacted(self.backend.name)
+        if reuse and self.enabled():
+            _settle(self, telnet)
+        else:
+            disconnect(telnet, request, response)
+
+    def warm(self, count):
+        """Log in up to count sessions at once and keep them idle, so that
+        the next requests need not log in. Returns how many sessions are
+        idle; the first error is raised once the other sessions are kept"""
+        count = min(count, settings.JCLI_POOL_SIZE - self.idle.qsize())
+        if not self.enabled() or count <= 0:
+            return self.idle.qsize()
+        error = None
+        with ThreadPoolExecutor(count, thread_name_prefix='jcli-warm') as executor:
+            futures = [executor.submit(connect, self.backend) for _ in range(count)]
+            for future in futures:
+                try:
+                    self.idle.put((future.result(), time.monotonic()))
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            raise error
+        return self.idle.qsize()
+
+    def _settled(self, telnet):
+        if (not self.closed and self.idle.qsize() < settings.JCLI_POOL_SIZE
+                and _drain(telnet)):
+            self.idle.put((telnet, time.monotonic()))
+        else:
+            disconnect(telnet)
+
+    def _count(self, change):
+        with self.lock:
+            self.in_use += change
+
+    def close(self):
+        "Close the idle sessions, and those settling once they settled"
+        self.closed = True
+        while True:
+            try:
+                telnet, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            disconnect(telnet)
+
+
+def _drain(telnet):
+    """Drop whatever a pooled session has left to read. False when it is
+    closed"""
+    spawn = telnet._telnet
+    try:
+        while True:
+            try:
+                spawn.read_nonblocking(65536, 0)
+            except (pexpect.TIMEOUT, BlockingIOError):
+                break
+        if not isinstance(spawn, SocketSpawn) and not spawn.isalive():
+            return False
+    except (pexpect.EOF, OSError, ValueError):
+        return False
+    spawn.buffer = spawn.string_type()
+    return True
+
+
+#(due, pool, telnet) of released sessions, in the order they are due
+_settling = queue.Queue()
+_settler = None
+_settler_lock = threading.Lock()
+
+
+def _settle(pool, telnet):
+    global _settler
+    with _settler_lock:
+        if _settler is None:
+            _settler = threading.Thread(
+                target=_settle_loop, name='jcli-settle', daemon=True)
+            _settler.start()
+    _settling.put((time.monotonic() + settings.JCLI_POOL_SETTLE, pool, telnet))
+
+
+def _settle_loop():
+    while True:
+        due, pool, telnet = _settling.get()
+        try:
+            time.sleep(max(due - time.monotonic(), 0))
+            pool._settled(telnet)
+        except Exception:
+            logger.exception('Settling a jcli session failed')
+        finally:
+            _settling.task_done()
+
+
+class Backend:
+    "A Jasmin node: where its jcli and HTTP API are, and its session pool"
+
+    def __init__(self, name, host, port, username, password, http_url):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.http_url = http_url
+        self.pool = SessionPool(self)
+
+
+_lock = threading.Lock()
+#(configuration, {name: Backend})
+_registry = None
+_local = threading.local()
+
+
+def _configuration():
+    defaults = (settings.TELNET_HOST, settings.TELNET_PORT,
+                settings.TELNET_USERNAME, settings.TELNET_PW,
+                settings.JASMIN_HTTP_URL)
+    return tuple(sorted(
+        (name, tuple(config.get(k, d) for k, d in zip(
+            ('host', 'port', 'username', 'password', 'http_url'), defaults)))
+        for name, config in settings.JASMIN_BACKENDS.items()))
+
+
+def registry():
+    """{name: Backend}, rebuilt (closing the old pools) when the settings
+    they come from change"""
+    global _registry
+    configuration = _configuration()
+    with _lock:
+        if _registry is None or _registry[0] != configuration:
+            if _registry is not None:
+                for backend in _registry[1].values():
+                    backend.pool.close()
+            _registry = configuration, {
+                name: Backend(name, *values) for name, values in configuration}
+        return _registry[1]
+
+
+def close():
+    """Close the idle sessions of every backend, once released ones settled.
+    The next request starts new pools"""
+    global _registry
+    _settling.join()
+    with _lock:
+        if _registry is not None:
+            for backend in _registry[1].values():
+                backend.pool.close()
+        _registry = None
+
+
+def get(name):
+    backend = registry().get(name)
+    if backend is None:
+        raise ObjectNotFoundError('Unknown backend: %s' % name)
+    return backend
+
+
+def current():
+    "The backend the current request works on, DEFAULT_BACKEND outside one"
+    return get(getattr(_local, 'name', None) or settings.DEFAULT_BACKEND)
+
+
+def is_default():
+    return (getattr(_local, 'name', None) or settings.DEFAULT_BACKEND) == \
+        settings.DEFAULT_BACKEND
+
+
+@contextlib.contextmanager
+def using(name):
+    "Make name the current backend of the thread"
+    previous = getattr(_local, 'name', None)
+    _local.name = name
+    try:
+        yield get(name)
+    finally:
+        _local.name = previous
+
+
+def activate(name):
+    _local.name = name
+
+
+def deactivate():
+    _local.name = None
+
+
+def run(backend, function):
+    """function(telnet) over a pooled session of backend, made the current
+    backend meanwhile"""
+    with using(backend.name):
+        telnet = backend.pool.acquire()
+        try:
+            result = function(telnet)
+        except BaseException:
+            backend.pool.release(telnet, False)
+            raise
+        backend.pool.release(telnet)
+        return result
+
+
+def fan_out(function, names=None):
+    """function(telnet) run on every backend, or those named, with
+    CLUSTER_CONCURRENCY of them at once. Returns ({name: result},
+    {name: error}) of the backends that answered and of those that failed"""
+    everyone = [get(n) for n in sorted(registry() if names is None else names)]
+    results, errors = {}, {}
+    with ThreadPoolExecutor(
+            max(min(len(everyone), settings.CLUSTER_CONCURRENCY), 1),
+            thread_name_prefix='fan-out') as executor:
+        futures = [(b.name, executor.submit(run, b, function)) for b in everyone]
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except APIException as e:
+                errors[name] = str(e.detail)
+            except pexpect.TIMEOUT:
+                errors[name] = 'jcli timed out'
+            except pexpect.EOF:
+                errors[name] = 'jcli closed the connection'
+            except OSError as e:
+                errors[name] = str(e) or e.__class__.__name__
+    return results, errors
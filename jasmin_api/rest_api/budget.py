@@ -0,0 +1,133 @@
+"""Cap on the jcli sessions open to each backend, JCLI_MAX_SESSIONS, shared
+by every worker process of run_cherrypy.py
+
+The runner calls setup() before forking its workers, so that they all take
+slots from the same POSIX semaphores. A session holds its slot from before
+connecting until it is closed, idle pooled sessions included. Without
+setup() the semaphores are created on first use and only cap the process.
+
+A worker that dies cannot give its slots back. Each worker counts those it
+holds in shared memory, under the index worker() gives it, and the runner
+reclaim()s them before starting another worker in its place.
+"""
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from django.conf import settings
+
+from .exceptions import TooManySessions
+from . import metrics
+
+_lock = threading.Lock()
+#{(backend name, cap): semaphore}
+_semaphores = {}
+#backend names, in the order of a worker's counts in _held
+_names = []
+#slots held, a row of one count per backend for each worker, see setup()
+_held = None
+#index of this worker, None when not counting
+_worker = None
+
+
+def setup(workers=1):
+    """Create the semaphores of every backend, and the counts of slots held
+    by each of workers, for processes forked later"""
+    global _names, _held
+    _names = sorted(settings.JASMIN_BACKENDS)
+    for name in _names:
+        _semaphore(name)
+    #each count is only written by its worker, or once it died
+    _held = multiprocessing.RawArray('i', workers * len(_names))
+
+
+def worker(index):
+    "Count the slots this process takes as held by worker index"
+    global _worker
+    _worker = index
+
+
+def _count(name, change):
+    if _held is None or _worker is None or name not in _names:
+        return
+    with _lock:
+        _held[_worker * len(_names) + _names.index(name)] += change
+
+
+def reclaim(index):
+    """Give back the slots worker index held when it died, returns how
+    many"""
+    reclaimed = 0
+    for position, name in enumerate(_names):
+        cell = index * len(_names) + position
+        semaphore = _semaphore(name)
+        for _ in range(_held[cell]):
+            try:
+                semaphore.release()
+            except ValueError:
+                #it died between giving one back and counting it
+                break
+            reclaimed += 1
+        _held[cell] = 0
+    return reclaimed
+
+
+def _semaphore(name):
+    "Semaphore of backend name, None when sessions are not capped"
+    cap = settings.JCLI_MAX_SESSIONS
+    if not cap:
+        return None
+    with _lock:
+        if (name, cap) not in _semaphores:
+            _semaphores[name, cap] = multiprocessing.BoundedSemaphore(cap)
+        return _semaphores[name, cap]
+
+
+class Slot:
+    "A session's share of the budget, given back once by release()"
+
+    def __init__(self, semaphore, name=None):
+        self._semaphore = semaphore
+        self._name = name
+        if semaphore is not None:
+            _count(name, 1)
+
+    def release(self):
+        semaphore, self._semaphore = self._semaphore, None
+        if semaphore is not None:
+            _count(self._name, -1)
+            semaphore.release()
+
+
+def _exhausted(backend):
+    metrics.JCLI_ERRORS.inc(stage='connect', kind='budget')
+    return TooManySessions(
+        'All %d jcli sessions to %s are in use' % (
+            settings.JCLI_MAX_SESSIONS, backend.name))
+
+
+def take(backend, timeout=None):
+    """A Slot for a new session to backend, waiting up to timeout seconds
+    (TELNET_TIMEOUT by default) for one. Raises TooManySessions"""
+    semaphore = _semaphore(backend.name)
+    if semaphore is None:
+        return Slot(None)
+    if timeout is None:
+        timeout = settings.TELNET_TIMEOUT
+    if not semaphore.acquire(timeout > 0, timeout if timeout > 0 else None):
+        raise _exhausted(backend)
+    return Slot(semaphore, backend.name)
+
+
+async def atake(backend):
+    "take() for the event loop, polling rather than blocking it"
+    semaphore = _semaphore(backend.name)
+    if semaphore is None:
+        return Slot(None)
+    deadline = time.monotonic() + settings.TELNET_TIMEOUT
+    while not semaphore.acquire(False):
+        if time.monotonic() >= deadline:
+            raise _exhausted(backend)
+        await asyncio.sleep(0.01)
+    return Slot(semaphore, backend.name)
@@ -8,6 +8,10 @@ class TelnetConnectionTimeout(APIException):
     status_code = 500
     default_detail = 'Connection to jcli timed out'
 
+class TelnetConnectionRefused(APIException):
+    status_code = 500
+    default_detail = 'Could not connect to jcli'
+
 class TelnetLoginFailed(APIException):
     status_code = 403
     default_detail = 'Jasmin login failed'
@@ -43,3 +47,15 @@ class ActionFailed(APIException):
 class ObjectNotFoundError(APIException):
     status_code = 404
     default_detail = 'Object not found'
+
+class ChangesExpired(APIException):
+    status_code = 410
+    default_detail = 'Changes since this version are no longer kept'
+
+class ObjectInUse(APIException):
+    status_code = 409
+    default_detail = 'Object is used by others'
+
+class TooManySessions(APIException):
+    status_code = 503
+    default_detail = 'All jcli sessions Jasmin accepts are in use'
@@ -0,0 +1,95 @@
+"""A stand-in for Jasmin's HTTP API, for tests and benchmarks
+
+FakeHTTPApiServer answers /send as Jasmin does: Success "<message id>" for
+a known user with to and content set, Error "..." with a 4xx status
+otherwise. It speaks HTTP/1.1 with keep-alive, and counts the connections
+it accepted and the messages it took. With drop set, it takes that many
+messages without answering, closing their connection instead.
+"""
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class SendHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    #headers and body are written separately, do not wait for acks between
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        if self.server.idle_timeout:
+            self.connection.settimeout(self.server.idle_timeout)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send(dict(parse_qsl(urlsplit(self.path).query)))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        self.send(dict(parse_qsl(body)))
+
+    def send(self, params):
+        server = self.server
+        if urlsplit(self.path).path != '/send':
+            return self.reply(404, 'Error "Not found"')
+        if server.users.get(params.get('username')) != params.get('password'):
+            return self.reply(403, 'Error "Authentication failure for username:%s"' % (
+                params.get('username')))
+        for key in ('to', 'content'):
+            if key not in params:
+                return self.reply(
+                    400, 'Error "Mandatory argument [%s] is not found."' % key)
+        message_id = str(uuid.uuid4())
+        with server.lock:
+            server.messages.append(dict(params, id=message_id))
+            drop, server.drop = server.drop > 0, max(server.drop - 1, 0)
+        if drop:
+            self.close_connection = True
+            return
+        self.reply(200, 'Success "%s"' % message_id)
+
+    def reply(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeHTTPApiServer(ThreadingHTTPServer):
+    """Threaded fake Jasmin HTTP API on host:port, port 0 picks a free one.
+    users maps usernames to passwords."""
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, users=None):
+        super().__init__((host, port), SendHandler)
+        self.users = users or {'foo': 'bar'}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        #messages to take and then close the connection without answering
+        self.drop = 0
+        #seconds after which idle connections are closed, None to keep them
+        self.idle_timeout = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,796 @@
+"""A stand-in for Jasmin's jcli telnet console, for tests and benchmarks
+
+FakeJcliServer listens on TCP and emulates the parts of jcli this API uses:
+the Username:/Password: login, with the telnet echo negotiation around the
+password, the standard and interactive prompts and the -l, -s, -a, -u, -r
+(plus enable/disable, start/stop and flush) commands of every module and
+the stats command, with output laid out as jcli lays it out. Data is
+generated from object counts and every command can be delayed to mimic a slow node.
+
+Point the API at it with TELNET_TRANSPORT = 'socket' or run it standalone
+with ./manage.py fakejcli.
+"""
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+
+from . import telnet
+
+STANDARD_PROMPT = 'jcli : '
+INTERACTIVE_PROMPT = '> '
+
+#Filter type: (parameter key, repr template, routes)
+FILTER_TYPES = OrderedDict([
+    ('TransparentFilter', (None, '<T>', 'MO MT')),
+    ('ConnectorFilter', ('cid', '<C (cid=%s)>', 'MO')),
+    ('UserFilter', ('uid', '<U (uid=%s)>', 'MT')),
+    ('GroupFilter', ('gid', '<G (gid=%s)>', 'MT')),
+    ('SourceAddrFilter', ('source_addr', '<SA (src_addr=%s)>', 'MO MT')),
+    ('DestinationAddrFilter', ('destination_addr', '<DA (dst_addr=%s)>', 'MO MT')),
+    ('ShortMessageFilter', ('short_message', '<SM (msg=%s)>', 'MO MT')),
+    ('DateIntervalFilter', ('dateInterval', '<DI (%s)>', 'MO MT')),
+    ('TimeIntervalFilter', ('timeInterval', '<TI (%s)>', 'MO MT')),
+    ('TagFilter', ('tag', '<TG (tag=%s)>', 'MO MT')),
+    ('EvalPyFilter', ('pyCode', '<Ev (pyCode=%s ..)>', 'MO MT')),
+])
+
+MT_ROUTE_TYPES = ('DefaultRoute', 'StaticMTRoute', 'RandomRoundrobinMTRoute')
+MO_ROUTE_TYPES = ('DefaultRoute', 'StaticMORoute', 'RandomRoundrobinMORoute')
+
+USER_CREDENTIALS = (
+    ('mt_messaging_cred', 'defaultvalue', 'src_addr', 'None'),
+    ('mt_messaging_cred', 'quota', 'balance', 'ND'),
+    ('mt_messaging_cred', 'quota', 'early_percent', 'ND'),
+    ('mt_messaging_cred', 'quota', 'sms_count', 'ND'),
+    ('mt_messaging_cred', 'quota', 'http_throughput', 'ND'),
+    ('mt_messaging_cred', 'quota', 'smpps_throughput', 'ND'),
+    ('mt_messaging_cred', 'valuefilter', 'content', '.*'),
+    ('mt_messaging_cred', 'valuefilter', 'src_addr', '.*'),
+    ('mt_messaging_cred', 'valuefilter', 'dst_addr', '.*'),
+    ('mt_messaging_cred', 'valuefilter', 'priority', '^[0-3]$'),
+    ('mt_messaging_cred', 'valuefilter', 'validity_period', r'^\d+$'),
+    ('mt_messaging_cred', 'authorization', 'http_send', 'True'),
+    ('mt_messaging_cred', 'authorization', 'http_dlr_method', 'True'),
+    ('mt_messaging_cred', 'authorization', 'http_balance', 'True'),
+    ('mt_messaging_cred', 'authorization', 'http_rate', 'True'),
+    ('mt_messaging_cred', 'authorization', 'http_bulk', 'False'),
+    ('mt_messaging_cred', 'authorization', 'smpps_send', 'True'),
+    ('mt_messaging_cred', 'authorization', 'http_long_content', 'True'),
+    ('mt_messaging_cred', 'authorization', 'set_dlr_level', 'True'),
+    ('mt_messaging_cred', 'authorization', 'set_source_address', 'True'),
+    ('mt_messaging_cred', 'authorization', 'set_priority', 'True'),
+    ('mt_messaging_cred', 'authorization', 'set_validity_period', 'True'),
+    ('mt_messaging_cred', 'authorization', 'set_hex_content', 'True'),
+    ('mt_messaging_cred', 'authorization', 'set_schedule_delivery_time', 'True'),
+    ('smpps_cred', 'quota', 'max_bindings', 'ND'),
+    ('smpps_cred', 'authorization', 'bind', 'True'),
+)
+
+SMPPCC_DEFAULTS = OrderedDict([
+    ('host', '127.0.0.1'), ('port', '2775'), ('username', 'smppclient'),
+    ('password', 'password'), ('systype', ''), ('bind', 'transceiver'),
+    ('bind_to', '30'), ('trx_to', '300'), ('res_to', '120'),
+    ('pdu_red_to', '10'), ('con_loss_retry', 'yes'), ('con_loss_delay', '10'),
+    ('con_fail_retry', 'yes'), ('con_fail_delay', '10'),
+    ('src_addr', 'None'), ('src_ton', '2'), ('src_npi', '1'),
+    ('dst_ton', '1'), ('dst_npi', '1'), ('bind_ton', '0'), ('bind_npi', '1'),
+    ('validity', 'None'), ('priority', '0'), ('requeue_delay', '120'),
+    ('addr_range', 'None'), ('systemid', 'smppclient'), ('dlr_expiry', '86400'),
+    ('submit_throughput', '1'), ('proto_id', 'None'), ('coding', '0'),
+    ('elink_interval', '30'), ('def_msg_id', '0'), ('ripf', '0'),
+    ('loglevel', '20'),
+])
+
+#stats --user items, (type, item, initial value)
+USER_STATS = (
+    ('SMPP Server', 'bind_count', 0), ('SMPP Server', 'unbind_count', 0),
+    ('SMPP Server', 'submit_sm_request_count', 0),
+    ('SMPP Server', 'submit_sm_count', 0),
+    ('SMPP Server', 'throttling_error_count', 0),
+    ('SMPP Server', 'other_submit_error_count', 0),
+    ('SMPP Server', 'elink_count', 0), ('SMPP Server', 'deliver_sm_count', 0),
+    ('SMPP Server', 'data_sm_count', 0),
+    ('SMPP Server', 'qos_last_submit_sm_at', 'ND'),
+    ('SMPP Server', 'last_activity_at', 'ND'),
+    ('SMPP Server', 'bound_connections_count', None),
+    ('HTTP Api', 'connects_count', 0), ('HTTP Api', 'last_activity_at', 'ND'),
+    ('HTTP Api', 'submit_sm_request_count', 0),
+    ('HTTP Api', 'balance_request_count', 0),
+    ('HTTP Api', 'rate_request_count', 0),
+    ('HTTP Api', 'qos_last_submit_sm_at', 'ND'),
+)
+
+#stats --smppc items and initial values
+SMPPC_STATS = (
+    ('connected_at', 'ND'), ('bound_at', 'ND'), ('disconnected_at', 'ND'),
+    ('connected_count', 0), ('bound_count', 0), ('disconnected_count', 0),
+    ('submit_sm_request_count', 0), ('submit_sm_count', 0),
+    ('deliver_sm_count', 0), ('data_sm_count', 0), ('elink_count', 0),
+    ('throttling_error_count', 0), ('other_submit_error_count', 0),
+    ('interceptor_count', 0), ('interceptor_error_count', 0),
+    ('last_received_pdu_at', 'ND'), ('last_sent_pdu_at', 'ND'),
+    ('last_received_elink_at', 'ND'), ('last_sent_elink_at', 'ND'),
+    ('last_seqNum_at', 'ND'), ('last_seqNum', 'ND'),
+)
+
+#module: (object name in messages, id key, interactive keys)
+ADD_HEADERS = {
+    'user': 'Adding a new User: (ok: save, ko: exit)',
+    'group': 'Adding a new Group: (ok: save, ko: exit)',
+    'filter': 'Adding a new Filter: (ok: save, ko: exit)',
+    'mtrouter': 'Adding a new MT Route: (ok: save, ko: exit)',
+    'morouter': 'Adding a new MO Route: (ok: save, ko: exit)',
+    'smppccm': 'Adding a new connector: (ok: save, ko: exit)',
+    'httpccm': 'Adding a new Httpcc: (ok: save, ko: exit)',
+}
+
+
+class FakeJasmin:
+    """Configuration held by the fake jcli, generated from object counts
+
+    All sessions of a FakeJcliServer share one FakeJasmin; access goes
+    through lock.
+    """
+
+    def __init__(self, users=10, groups=3, filters=10, mtroutes=5,
+                 moroutes=5, smppccs=3, httpccs=3):
+        self.lock = threading.RLock()
+        #persist commands received
+        self.persists = 0
+        self.groups = OrderedDict(
+            ('g%d' % i, {'enabled': True}) for i in range(max(groups, 1)))
+        gids = list(self.groups)
+        self.users = OrderedDict()
+        for i in range(users):
+            uid = 'u%d' % i
+            self.users[uid] = self.new_user(uid, gids[i % len(gids)], 'user%d' % i)
+        self.smppccs = OrderedDict()
+        for i in range(smppccs):
+            cid = 'smppc%d' % i
+            self.smppccs[cid] = self.new_smppcc(cid)
+        self.httpccs = OrderedDict()
+        for i in range(httpccs):
+            cid = 'http%d' % i
+            self.httpccs[cid] = {
+                'cid': cid, 'url': 'http://127.0.0.1:8080/mo/%d' % i,
+                'method': 'GET' if i % 2 else 'POST'}
+        self.filters = OrderedDict()
+        generated = (
+            ('UserFilter', lambda i: 'u%d' % (i % max(users, 1))),
+            ('GroupFilter', lambda i: gids[i % len(gids)]),
+            ('DestinationAddrFilter', lambda i: '^27%d' % (60 + i % 40)),
+            ('SourceAddrFilter', lambda i: '^%d' % (1000 + i)),
+            ('ConnectorFilter', lambda i: 'smppc%d' % (i % max(smppccs, 1))),
+            ('TagFilter', lambda i: '%d' % i),
+            ('TransparentFilter', lambda i: None),
+        )
+        for i in range(filters):
+            ftype, param = generated[i % len(generated)]
+            fid = 'f%d' % i
+            self.filters[fid] = {'fid': fid, 'type': ftype, 'parameter': param(i)}
+        mt_filters = [f for f, d in self.filters.items()
+                      if 'MT' in FILTER_TYPES[d['type']][2]]
+        mo_filters = [f for f, d in self.filters.items()
+                      if 'MO' in FILTER_TYPES[d['type']][2]]
+        self.mtroutes = OrderedDict()
+        self.moroutes = OrderedDict()
+        smppc_ids = list(self.smppccs) or ['smppc0']
+        http_ids = list(self.httpccs) or ['http0']
+        for i in range(mtroutes):
+            if i == 0 or not mt_filters:
+                route = {'type': 'DefaultRoute', 'filters': [],
+                         'connectors': ['smppc(%s)' % smppc_ids[0]]}
+            else:
+                route = {'type': 'StaticMTRoute',
+                         'filters': [mt_filters[i % len(mt_filters)]],
+                         'connectors': ['smppc(%s)' % smppc_ids[i % len(smppc_ids)]]}
+            route['rate'] = '0' if i == 0 else '%.2f' % (i / 10.0)
+            self.mtroutes[i * 10] = route
+        for i in range(moroutes):
+            if i == 0 or not mo_filters:
+                route = {'type': 'DefaultRoute', 'filters': [],
+                         'connectors': ['http(%s)' % http_ids[0]]}
+            else:
+                route = {'type': 'StaticMORoute',
+                         'filters': [mo_filters[i % len(mo_filters)]],
+                         'connectors': ['http(%s)' % http_ids[i % len(http_ids)]]}
+            self.moroutes[i * 10] = route
+        self.stats = {}
+
+    @staticmethod
+    def new_user(uid, gid, username):
+        user = OrderedDict([('uid', uid), ('gid', gid), ('username', username)])
+        user['enabled'] = True
+        user['credentials'] = OrderedDict(
+            ((s, k, n), v) for s, k, n, v in USER_CREDENTIALS)
+        return user
+
+    @staticmethod
+    def new_smppcc(cid):
+        connector = OrderedDict([('cid', cid)])
+        connector.update(SMPPCC_DEFAULTS)
+        connector['logfile'] = '/var/log/jasmin/default-%s.log' % cid
+        connector['service'] = 'stopped'
+        connector['session'] = 'None'
+        connector['starts'] = 0
+        connector['stops'] = 0
+        return connector
+
+    def user_stats(self, uid):
+        """Stats of a user, keyed (type, item), created on first use. Tests
+        and benchmarks change them to simulate traffic"""
+        return self.stats.setdefault(('user', uid), OrderedDict(
+            ((t, i), v if v is not None else OrderedDict(
+                (b, 0) for b in ('bind_transmitter', 'bind_receiver', 'bind_transceiver')))
+            for t, i, v in USER_STATS))
+
+    def smppc_stats(self, cid):
+        "Stats of an SMPP client connector, keyed by item, created on first use"
+        return self.stats.setdefault(('smppc', cid), OrderedDict(SMPPC_STATS))
+
+    def filter_repr(self, fid):
+        flt = self.filters.get(fid)
+        if flt is None:
+            return '<Unknown (fid=%s)>' % fid
+        key, template, _ = FILTER_TYPES[flt['type']]
+        return template % flt['parameter'] if key else template
+
+
+class Session:
+    """One logged in jcli session; handle() takes a line and returns the
+    text to send back, including the next prompt"""
+
+    def __init__(self, jasmin):
+        self.jasmin = jasmin
+        self.interactive = None
+        self.closed = False
+
+    def handle(self, line):
+        if self.interactive is not None:
+            return self.handle_interactive(line)
+        words = line.split()
+        if not words:
+            return ''
+        module, args = words[0], words[1:]
+        if module == 'quit':
+            self.closed = True
+            return ''
+        if module == 'persist':
+            self.jasmin.persists += 1
+            return self.reply('-default: Current configuration saved.')
+        if module == 'load':
+            return self.reply('-default: Configuration loaded.')
+        handler = getattr(self, 'cmd_%s' % module, None)
+        if handler is None or not args:
+            return self.reply('Unknown command: %s' % module)
+        with self.jasmin.lock:
+            return handler(args[0], args[1:])
+
+    def reply(self, *lines, prompt=STANDARD_PROMPT):
+        return ''.join(l + '\r\n' for l in lines) + prompt
+
+    def table(self, header, rows, total):
+        return self.reply(header, *(rows + [total]))
+
+    def tabulate(self, headers, rows):
+        "Lines laid out as tabulate's plain format, as jcli stats does"
+        rows = [headers] + [[str(c) for c in r] for r in rows]
+        widths = [max(len(r[i]) for r in rows) for i in range(len(headers))]
+        return ['  '.join(c.ljust(w) for c, w in zip(r, widths)).rstrip()
+                for r in rows]
+
+    #Interactive mode
+
+    def start_interactive(self, module, action, target=None, values=None):
+        self.interactive = {
+            'module': module, 'action': action, 'target': target,
+            'values': OrderedDict(values or {})}
+        if action == 'add':
+            header = ADD_HEADERS[module]
+        else:
+            header = 'Updating %s id [%s]: (ok: save, ko: exit)' % (
+                {'user': 'User', 'smppccm': 'connector'}[module], target)
+        return self.reply(header, prompt=INTERACTIVE_PROMPT)
+
+    def handle_interactive(self, line):
+        words = line.split()
+        if not words:
+            return INTERACTIVE_PROMPT
+        if words == ['ko']:
+            self.interactive = None
+            return self.reply()
+        session = self.interactive
+        if words == ['ok']:
+            with self.jasmin.lock:
+                result, keep_open = getattr(self, 'save_%s' % session['module'])(
+                    session['action'], session['target'], session['values'])
+            if keep_open:
+                return self.reply(result, prompt=INTERACTIVE_PROMPT)
+            self.interactive = None
+            return self.reply(result)
+        error = self.set_key(session, words)
+        if error:
+            return self.reply(error, prompt=INTERACTIVE_PROMPT)
+        return INTERACTIVE_PROMPT
+
+    def set_key(self, session, words):
+        module = session['module']
+        if module == 'user' and words[0] in ('mt_messaging_cred', 'smpps_cred'):
+            if len(words) != 4:
+                return 'Error: Invalid credential update'
+            key = tuple(words[:3])
+            if key not in dict(((s, k, n), v) for s, k, n, v in USER_CREDENTIALS):
+                return 'Unknown User key: %s' % ' '.join(words[:3])
+            session['values'][key] = words[3]
+            return None
+        allowed = {
+            'user': ('uid', 'gid', 'username', 'password'),
+            'group': ('gid',),
+            'filter': ('type', 'fid') + tuple(k for k, _, _ in FILTER_TYPES.values() if k),
+            'mtrouter': ('type', 'order', 'filters', 'connector', 'connectors', 'rate'),
+            'morouter': ('type', 'order', 'filters', 'connector', 'connectors'),
+            'smppccm': ('cid',) + tuple(SMPPCC_DEFAULTS),
+            'httpccm': ('cid', 'url', 'method'),
+        }[module]
+        if words[0] not in allowed:
+            if module == 'user':
+                return 'Unknown User key: %s' % words[0]
+            if module == 'smppccm':
+                return 'Unknown SMPPClientConfig key: %s' % words[0]
+            return 'Unknown %s key: %s' % (module, words[0])
+        if module == 'user' and session['action'] == 'update' and words[0] == 'uid':
+            return 'Error: uid can not be modified'
+        session['values'][words[0]] = ' '.join(words[1:])
+        return None
+
+    #Users
+
+    def cmd_user(self, flag, args):
+        users = self.jasmin.users
+        if flag == '-l':
+            rows = ['#%s %s %s %s %s' % (
+                ('!' if not u['enabled'] else '') + uid.ljust(16),
+                u['gid'].ljust(16), u['username'].ljust(16),
+                'ND'.ljust(7), 'ND/ND') for uid, u in users.items()]
+            return self.table(
+                '#User id          Group id         Username         Balance MT SMS Throughput',
+                rows, 'Total Users: %d' % len(users))
+        if flag == '-a':
+            return self.start_interactive('user', 'add')
+        if not args:
+            return self.reply('Usage: user [options]')
+        uid = args[0]
+        if uid not in users:
+            return self.reply('Unknown User: %s' % uid)
+        user = users[uid]
+        if flag == '-s':
+            lines = ['username %s' % user['username']]
+            lines += ['%s %s %s %s' % (k + (v,))
+                      for k, v in user['credentials'].items()]
+            lines += ['uid %s' % uid, 'gid %s' % user['gid']]
+            return self.reply(*lines)
+        if flag == '-u':
+            return self.start_interactive('user', 'update', uid)
+        if flag == '-r':
+            del users[uid]
+            return self.reply('Successfully removed User id:%s' % uid)
+        if flag in ('-e', '-d'):
+            user['enabled'] = flag == '-e'
+            return self.reply('Successfully %s User id:%s' % (
+                'enabled' if flag == '-e' else 'disabled', uid))
+        if flag in ('--smpp-unbind', '--smpp-ban'):
+            return self.reply('Successfully unbound User id:%s' % uid)
+        return self.reply('Usage: user [options]')
+
+    def save_user(self, action, uid, values):
+        users = self.jasmin.users
+        if action == 'add':
+            missing = [k for k in ('uid', 'gid', 'username', 'password')
+                       if k not in values]
+            if missing:
+                return ('You must set User id (uid), group (gid), username and '
+                        'password before saving !', True)
+            if values['gid'] not in self.jasmin.groups:
+                return 'Error: Group gid [%s] does not exist' % values['gid'], False
+            if values['uid'] in users:
+                return 'Error: User uid [%s] already exists' % values['uid'], False
+            user = self.jasmin.new_user(values['uid'], values['gid'], values['username'])
+            users[values['uid']] = user
+            return 'Successfully added User [%s] to Group [%s]' % (
+                values['uid'], values['gid']), False
+        user = users[uid]
+        for key, value in values.items():
+            if isinstance(key, tuple):
+                user['credentials'][key] = value
+            elif key == 'gid' and value not in self.jasmin.groups:
+                return 'Error: Group gid [%s] does not exist' % value, False
+            elif key != 'password':
+                user[key] = value
+        return 'Successfully updated User [%s]' % uid, False
+
+    #Groups
+
+    def cmd_group(self, flag, args):
+        groups = self.jasmin.groups
+        if flag == '-l':
+            rows = ['#%s%s' % ('' if g['enabled'] else '!', gid)
+                    for gid, g in groups.items()]
+            return self.table('#Group id', rows, 'Total Groups: %d' % len(groups))
+        if flag == '-a':
+            return self.start_interactive('group', 'add')
+        if not args:
+            return self.reply('Usage: group [options]')
+        gid = args[0]
+        if gid not in groups:
+            return self.reply('Unknown Group: %s' % gid)
+        if flag == '-r':
+            del groups[gid]
+            for uid in [u for u, d in self.jasmin.users.items() if d['gid'] == gid]:
+                del self.jasmin.users[uid]
+            return self.reply('Successfully removed Group id:%s' % gid)
+        if flag in ('-e', '-d'):
+            groups[gid]['enabled'] = flag == '-e'
+            return self.reply('Successfully %s Group id:%s' % (
+                'enabled' if flag == '-e' else 'disabled', gid))
+        return self.reply('Usage: group [options]')
+
+    def save_group(self, action, target, values):
+        if 'gid' not in values:
+            return 'You must set Group id (gid) before saving !', True
+        self.jasmin.groups[values['gid']] = {'enabled': True}
+        return 'Successfully added Group [%s]' % values['gid'], False
+
+    #Filters
+
+    def cmd_filter(self, flag, args):
+        filters = self.jasmin.filters
+        if flag == '-l':
+            rows = ['#%s %s %s %s' % (
+                fid.ljust(16), f['type'].ljust(22),
+                FILTER_TYPES[f['type']][2].ljust(6), self.jasmin.filter_repr(fid))
+                for fid, f in filters.items()]
+            return self.table(
+                '#Filter id        Type                   Routes Description',
+                rows, 'Total Filters: %d' % len(filters))
+        if flag == '-a':
+            return self.start_interactive('filter', 'add')
+        if not args:
+            return self.reply('Usage: filter [options]')
+        fid = args[0]
+        if fid not in filters:
+            return self.reply('Unknown Filter: %s' % fid)
+        if flag == '-s':
+            flt = filters[fid]
+            key = FILTER_TYPES[flt['type']][0]
+            lines = ['%s:' % flt['type']]
+            if key:
+                lines.append('%s = %s' % (key, flt['parameter']))
+            return self.reply(*lines)
+        if flag == '-r':
+            del filters[fid]
+            return self.reply('Successfully removed Filter id:%s' % fid)
+        return self.reply('Usage: filter [options]')
+
+    def save_filter(self, action, target, values):
+        types = {t.lower(): t for t in FILTER_TYPES}
+        ftype = types.get(values.get('type', '').lower())
+        if ftype is None or 'fid' not in values:
+            return 'You must set filter type and fid before saving !', True
+        key = FILTER_TYPES[ftype][0]
+        if key and key not in values:
+            return 'You must set %s before saving !' % key, True
+        self.jasmin.filters[values['fid']] = {
+            'fid': values['fid'], 'type': ftype,
+            'parameter': values[key] if key else None}
+        return 'Successfully added Filter [%s] with fid:%s' % (
+            ftype, values['fid']), False
+
+    #Routers
+
+    def route_rows(self, routes, with_rate):
+        rows = []
+        for order, route in sorted(routes.items(), reverse=True):
+            connectors = ', '.join(route['connectors'])
+            filters = ', '.join(self.jasmin.filter_repr(f) for f in route['filters'])
+            columns = [str(order).ljust(5), route['type'].ljust(23)]
+            if with_rate:
+                rate = route['rate']
+                columns.append(('%s (!)' % rate if float(rate) == 0 else rate).ljust(10))
+            columns += [connectors.ljust(48), filters]
+            rows.append(('#' + ' '.join(columns)).rstrip())
+        return rows
+
+    def router(self, kind, flag, args):
+        routes = self.jasmin.mtroutes if kind == 'MT' else self.jasmin.moroutes
+        module = kind.lower() + 'router'
+        if flag == '-l':
+            header = '#Order Type                    %sConnector ID(s)                                  Filter(s)' % (
+                'Rate       ' if kind == 'MT' else '')
+            return self.table(header, self.route_rows(routes, kind == 'MT'),
+                              'Total %s Routes: %d' % (kind, len(routes)))
+        if flag == '-a':
+            return self.start_interactive(module, 'add')
+        if flag == '-f':
+            count = len(routes)
+            routes.clear()
+            return self.reply('Successfully flushed %s route table (%d flushed entries)' % (
+                kind, count))
+        if not args:
+            return self.reply('Usage: %s [options]' % module)
+        try:
+            order = int(args[0])
+        except ValueError:
+            order = None
+        if order not in routes:
+            return self.reply('Unknown %s Route: %s' % (kind, args[0]))
+        if flag == '-s':
+            route = routes[order]
+            return self.reply('%s to %s' % (route['type'], ', '.join(route['connectors'])))
+        if flag == '-r':
+            del routes[order]
+            return self.reply('Successfully removed %s Route with order:%d' % (kind, order))
+        return self.reply('Usage: %s [options]' % module)
+
+    def save_route(self, kind, values):
+        routes = self.jasmin.mtroutes if kind == 'MT' else self.jasmin.moroutes
+        types = {t.lower(): t for t in (MT_ROUTE_TYPES if kind == 'MT' else MO_ROUTE_TYPES)}
+        rtype = types.get(values.get('type', '').lower())
+        if rtype is None:
+            return 'Unknown route type: %s' % values.get('type'), True
+        connectors = values.get('connectors', values.get('connector', ''))
+        connectors = [c for c in connectors.split(';') if c]
+        if not connectors:
+            return 'You must set connector before saving !', True
+        if rtype == 'DefaultRoute':
+            order, filters = 0, []
+        else:
+            filters = [f for f in values.get('filters', '').split(';') if f]
+            unknown = [f for f in filters if f not in self.jasmin.filters]
+            if unknown:
+                return 'Unknown fid: %s' % unknown[0], True
+            if not filters or 'order' not in values:
+                return 'You must set order and filters before saving !', True
+            order = int(values['order'])
+        route = {'type': rtype, 'filters': filters, 'connectors': connectors}
+        if kind == 'MT':
+            route['rate'] = values.get('rate', '0')
+        routes[order] = route
+        return 'Successfully added %sRoute [%s] with order:%d' % (kind, rtype, order), False
+
+    def cmd_mtrouter(self, flag, args):
+        return self.router('MT', flag, args)
+
+    def cmd_morouter(self, flag, args):
+        return self.router('MO', flag, args)
+
+    def save_mtrouter(self, action, target, values):
+        return self.save_route('MT', values)
+
+    def save_morouter(self, action, target, values):
+        return self.save_route('MO', values)
+
+    #Connectors
+
+    def cmd_smppccm(self, flag, args):
+        connectors = self.jasmin.smppccs
+        if flag == '-l':
+            rows = ['#%s %s %s %s %s' % (
+                cid.ljust(35), c['service'].ljust(7), c['session'].ljust(16),
+                str(c['starts']).ljust(6), c['stops'])
+                for cid, c in connectors.items()]
+            return self.table(
+                '#Connector id                        Service Session          Starts Stops',
+                rows, 'Total connectors: %d' % len(connectors))
+        if flag == '-a':
+            return self.start_interactive('smppccm', 'add')
+        if not args:
+            return self.reply('Usage: smppccm [options]')
+        cid = args[0]
+        if cid not in connectors:
+            return self.reply('Unknown connector: %s' % cid)
+        connector = connectors[cid]
+        if flag == '-s':
+            return self.reply(*['%s %s' % (k, v) for k, v in connector.items()
+                                if k not in ('service', 'session', 'starts', 'stops')])
+        if flag == '-u':
+            return self.start_interactive('smppccm', 'update', cid)
+        if flag == '-r':
+            del connectors[cid]
+            return self.reply('Successfully removed connector id:%s' % cid)
+        if flag == '-1':
+            if connector['service'] == 'started':
+                return self.reply('Failed starting connector, check log for details')
+            connector.update(service='started', session='BOUND_TRX')
+            connector['starts'] += 1
+            return self.reply('Successfully started connector id:%s' % cid)
+        if flag == '-0':
+            if connector['service'] == 'stopped':
+                return self.reply('Failed stopping connector, check log for details')
+            connector.update(service='stopped', session='None')
+            connector['stops'] += 1
+            return self.reply('Successfully stopped connector id:%s' % cid)
+        return self.reply('Usage: smppccm [options]')
+
+    def save_smppccm(self, action, cid, values):
+        connectors = self.jasmin.smppccs
+        if action == 'add':
+            if 'cid' not in values:
+                return 'You must set at least connector id (cid) before saving !', True
+            connector = self.jasmin.new_smppcc(values['cid'])
+            connector.update((k, v) for k, v in values.items() if k != 'cid')
+            connectors[values['cid']] = connector
+            return 'Successfully added connector [%s]' % values['cid'], False
+        if 'cid' in values:
+            return 'Error: Connector id can not be modified !', False
+        connectors[cid].update(values)
+        return 'Successfully updated connector [%s]' % cid, False
+
+    def cmd_httpccm(self, flag, args):
+        connectors = self.jasmin.httpccs
+        if flag == '-l':
+            rows = ['#%s %s %s %s' % (
+                cid.ljust(16), 'HttpConnector'.ljust(22), c['method'].ljust(6), c['url'])
+                for cid, c in connectors.items()]
+            return self.table(
+                '#Httpcc id        Type                   Method URL',
+                rows, 'Total Httpccs: %d' % len(connectors))
+        if flag == '-a':
+            return self.start_interactive('httpccm', 'add')
+        if not args:
+            return self.reply('Usage: httpccm [options]')
+        cid = args[0]
+        if cid not in connectors:
+            return self.reply('Unknown connector: %s' % cid)
+        connector = connectors[cid]
+        if flag == '-s':
+            return self.reply(
+                'HttpConnector:', 'cid = %s' % cid,
+                'baseurl = %s' % connector['url'], 'method = %s' % connector['method'])
+        if flag == '-r':
+            del connectors[cid]
+            return self.reply('Successfully removed connector id:%s' % cid)
+        return self.reply('Usage: httpccm [options]')
+
+    def save_httpccm(self, action, target, values):
+        if not values.get('url', '').startswith(('http://', 'https://')):
+            return 'HttpConnector url syntax is invalid', True
+        if values.get('method', '').upper() not in ('GET', 'POST'):
+            return 'HttpConnector method syntax is invalid, must be GET or POST', True
+        if 'cid' not in values:
+            return 'You must set cid, url and method before saving !', True
+        self.jasmin.httpccs[values['cid']] = {
+            'cid': values['cid'], 'url': values['url'],
+            'method': values['method'].upper()}
+        return 'Successfully added Httpcc [HttpConnector] with cid:%s' % values['cid'], False
+
+
+    #Stats
+
+    def cmd_stats(self, flag, args):
+        jasmin = self.jasmin
+        if flag == '--users':
+            rows = []
+            for uid in jasmin.users:
+                stats = jasmin.user_stats(uid)
+                rows.append([
+                    '#' + uid,
+                    sum(stats[('SMPP Server', 'bound_connections_count')].values()),
+                    stats[('SMPP Server', 'last_activity_at')],
+                    stats[('HTTP Api', 'connects_count')],
+                    stats[('HTTP Api', 'last_activity_at')]])
+            return self.reply(*self.tabulate(
+                ['#User id', 'SMPP Bound connections', 'SMPP L.A.',
+                 'HTTP requests counter', 'HTTP L.A.'], rows),
+                'Total users: %d' % len(rows))
+        if flag == '--smppcs':
+            rows = []
+            for cid in jasmin.smppccs:
+                stats = jasmin.smppc_stats(cid)
+                rows.append([
+                    '#' + cid, stats['connected_at'], stats['bound_at'],
+                    stats['disconnected_at'],
+                    '%s/%s' % (stats['submit_sm_request_count'], stats['submit_sm_count']),
+                    '%s/%s' % (stats['deliver_sm_count'], stats['data_sm_count']),
+                    stats['throttling_error_count'], stats['other_submit_error_count']])
+            return self.reply(*self.tabulate(
+                ['#Connector id', 'Connected at', 'Bound at', 'Disconnected at',
+                 'Submits', 'Delivers', 'QoS errors', 'Other errors'], rows),
+                'Total connectors: %d' % len(rows))
+        if flag == '--user' and args:
+            if args[0] not in jasmin.users:
+                return self.reply('Unknown user: %s' % args[0])
+            rows = [['#' + item, kind, dict(value) if isinstance(value, dict) else value]
+                    for (kind, item), value in jasmin.user_stats(args[0]).items()]
+            return self.reply(*self.tabulate(['#Item', 'Type', 'Value'], rows))
+        if flag == '--smppc' and args:
+            if args[0] not in jasmin.smppccs:
+                return self.reply('Unknown connector: %s' % args[0])
+            rows = [['#' + item, value]
+                    for item, value in jasmin.smppc_stats(args[0]).items()]
+            return self.reply(*self.tabulate(['#Item', 'Value'], rows))
+        return self.reply('Usage: stats [options]')
+
+
+class JcliHandler(socketserver.StreamRequestHandler):
+    "One telnet connection: login then one reply per received line"
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def negotiate(self, verb, option):
+        self.wfile.write(bytes((telnet.IAC, verb, option)))
+
+    def readline(self):
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError
+        #answers to our negotiation come first, drop them
+        line = self.negotiation.feed(line)[0]
+        return line.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def handle(self):
+        server = self.server
+        self.negotiation = telnet.Negotiation()
+        try:
+            self.write('Authentication required.\r\n\r\nUsername: ')
+            username = self.readline()
+            #jcli hides the password as it is typed
+            self.write(username + '\r\n')
+            self.negotiate(telnet.WILL, telnet.ECHO)
+            self.write('Password: ')
+            password = self.readline()
+            self.negotiate(telnet.WONT, telnet.ECHO)
+            time.sleep(server.login_latency)
+            if (username, password) != (server.username, server.password):
+                self.write('\r\nIncorrect Username/Password.\r\n')
+                return
+            self.write('\r\nWelcome to Jasmin console\r\n'
+                       'Type help or ? to list commands.\r\n\r\n' + STANDARD_PROMPT)
+            session = Session(server.jasmin)
+            while not session.closed:
+                line = self.readline()
+                reply = session.handle(line)
+                if not line.strip():
+                    #blank lines, as sent after persist, get no reply
+                    continue
+                if server.latency:
+                    time.sleep(server.latency)
+                self.write(line + '\r\n' + reply)
+        except (EOFError, ConnectionError):
+            pass
+
+
+class FakeJcliServer(socketserver.ThreadingTCPServer):
+    """Threaded fake jcli server
+
+    Use start() to serve from a background thread, port 0 picks a free port
+    (see port attribute). latency and login_latency are in seconds.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    #room for the connections async views open at once
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0, username='jcliadmin',
+                 password='jclipwd', latency=0.0, login_latency=0.0, **counts):
+        super().__init__((host, port), JcliHandler)
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.login_latency = login_latency
+        self.jasmin = FakeJasmin(**counts)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,93 @@
+"""Process and jcli health as /healthz and /readyz report it, kept in
+memory so that reporting it never opens a jcli session
+
+Every jcli login, and every session given back to a pool after a
+successful request, marks its backend contacted. Every failed login counts
+as a failure, until the next contact. There is no circuit breaker: failing
+logins are retried by every request, each waiting up to TELNET_TIMEOUT.
+"""
+import os
+import resource
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+
+_started = time.time()
+_lock = threading.Lock()
+#backend name: {'last_contact', 'failures', 'last_error'}
+_backends = {}
+_NEVER = {'last_contact': None, 'failures': 0, 'last_error': None}
+
+
+def _entry(name):
+    return _backends.setdefault(name, dict(_NEVER))
+
+
+def contacted(name):
+    "jcli of backend name answered"
+    with _lock:
+        entry = _entry(name)
+        entry['last_contact'] = time.time()
+        entry['failures'] = 0
+
+
+def failed(name, error):
+    "Logging in to the jcli of backend name failed with error"
+    if isinstance(error, APIException):
+        detail = str(error.detail)
+    else:
+        detail = str(error) or error.__class__.__name__
+    with _lock:
+        entry = _entry(name)
+        entry['failures'] += 1
+        entry['last_error'] = detail
+
+
+def _state(failures, last_contact):
+    if failures:
+        return 'failing'
+    return 'ok' if last_contact else 'unknown'
+
+
+def _async_pools(backend):
+    "(in use, idle) sessions of backend in the ajcli pools of every event loop"
+    from . import ajcli
+    in_use = idle = 0
+    for pools in list(ajcli._pools.values()):
+        pool = pools.get(backend)
+        if pool is not None:
+            in_use += settings.ASYNC_JCLI_SESSIONS - pool.slots._value
+            idle += len(pool.idle)
+    return in_use, idle
+
+
+def backends():
+    """{name: jcli state, last contact, consecutive login failures, last
+    error and pool occupancy} of every backend"""
+    from .backends import registry
+    with _lock:
+        known = {name: dict(entry) for name, entry in _backends.items()}
+    report = {}
+    for name, backend in sorted(registry().items()):
+        entry = known.get(name, _NEVER)
+        async_in_use, async_idle = _async_pools(backend)
+        report[name] = dict(
+            entry, state=_state(entry['failures'], entry['last_contact']),
+            sessions={'in_use': backend.pool.in_use,
+                      'idle': backend.pool.idle.qsize(),
+                      'pool_size': settings.JCLI_POOL_SIZE,
+                      'async_in_use': async_in_use,
+                      'async_idle': async_idle})
+    return report
+
+
+def process():
+    "pid, uptime in seconds, threads and peak resident memory in kB"
+    return {
+        'pid': os.getpid(),
+        'uptime': round(time.time() - _started, 3),
+        'threads': threading.active_count(),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
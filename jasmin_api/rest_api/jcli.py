@@ -0,0 +1,226 @@
+"""Opening, instrumenting and closing jcli telnet sessions"""
+import socket
+import time
+
+import pexpect
+from pexpect.socket_pexpect import SocketSpawn
+
+from django.conf import settings
+
+from .exceptions import (TelnetUnexpectedResponse, TelnetConnectionTimeout,
+                         TelnetConnectionRefused, TelnetLoginFailed)
+from . import budget, health, metrics, timing
+from .replay import (ReplaySpawn, TranscriptRecorder, describe_request,
+                     describe_response, load)
+from .telnet import Negotiation
+
+#jcli modules, first word of every top level command
+MODULES = (
+    'user', 'group', 'filter', 'mtrouter', 'morouter', 'smppccm', 'httpccm',
+    'stats', 'persist', 'load', 'quit',
+)
+
+
+def command_family(line):
+    """Family of a jcli command line such as 'user -s' or 'persist'
+    None for lines sent inside an interactive command (key value pairs, ok)
+    """
+    words = line.split()
+    if not words or words[0] not in MODULES:
+        return None
+    if len(words) > 1 and words[1].startswith('-'):
+        return '%s %s' % (words[0], words[1])
+    return words[0]
+
+
+class InstrumentedTelnet:
+    """Proxy for a pexpect spawn that times each command round trip
+
+    The clock starts on the first sendline after an expect and stops when
+    the next expect returns. Lines sent in interactive mode (keys, ok) are
+    accounted to the command that opened the interactive session.
+    """
+
+    def __init__(self, telnet, recorder=None):
+        self._telnet = telnet
+        self._family = 'login'
+        self._pending = None
+        self.recorder = recorder
+        #share of the JCLI_MAX_SESSIONS budget, see rest_api.budget
+        self.slot = None
+
+    def __getattr__(self, name):
+        return getattr(self._telnet, name)
+
+    def sendline(self, s=''):
+        family = command_family(s)
+        if self._pending is None:
+            self._pending = (family or self._family, time.perf_counter())
+        if family:
+            self._family = family
+        return self._telnet.sendline(s)
+
+    def _timed(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except pexpect.TIMEOUT:
+            metrics.JCLI_ERRORS.inc(stage='command', kind='timeout')
+            raise
+        except pexpect.EOF:
+            metrics.JCLI_ERRORS.inc(stage='command', kind='eof')
+            raise
+        finally:
+            if self._pending is not None:
+                family, start = self._pending
+                self._pending = None
+                elapsed = time.perf_counter() - start
+                metrics.JCLI_COMMAND_SECONDS.observe(elapsed, command=family)
+                timing.record_round_trip(family, elapsed)
+
+    def expect(self, *args, **kwargs):
+        return self._timed(self._telnet.expect, *args, **kwargs)
+
+    def expect_exact(self, *args, **kwargs):
+        return self._timed(self._telnet.expect_exact, *args, **kwargs)
+
+
+class TextSocketSpawn(SocketSpawn):
+    """SocketSpawn that decodes what it reads, which pexpect 4.9 omits,
+    once telnet commands are stripped out and answered"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.negotiation = Negotiation()
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        data = super().read_nonblocking(size, timeout)
+        if isinstance(data, bytes):
+            data, reply = self.negotiation.feed(data)
+            if reply:
+                self.socket.sendall(reply)
+            data = self._decoder.decode(data, final=False)
+            self._log(data, 'read')
+        return data
+
+
+def spawn(backend):
+    """Open a pexpect session to the jcli of a backend
+
+    With TELNET_TRANSPORT = 'telnet' (the default) the telnet command line
+    client is spawned, with 'socket' a plain TCP connection is used, which
+    needs no telnet binary and is cheaper to open. 'replay' serves the
+    session recorded in JCLI_REPLAY_FILE, see rest_api.replay.
+    """
+    transport = getattr(settings, 'TELNET_TRANSPORT', 'telnet')
+    if transport == 'replay':
+        return ReplaySpawn(
+            load(settings.JCLI_REPLAY_FILE)['events'],
+            timeout=settings.TELNET_TIMEOUT)
+    if transport == 'socket':
+        try:
+            sock = socket.create_connection(
+                (backend.host, backend.port),
+                timeout=settings.TELNET_TIMEOUT)
+        except socket.timeout:
+            raise pexpect.TIMEOUT('Connection to jcli timed out')
+        except OSError:
+            metrics.JCLI_ERRORS.inc(stage='connect', kind='refused')
+            raise TelnetConnectionRefused
+        return TextSocketSpawn(
+            sock, timeout=settings.TELNET_TIMEOUT, encoding='utf-8')
+    return pexpect.spawn(
+        "telnet %s %s" % (backend.host, backend.port),
+        timeout=settings.TELNET_TIMEOUT,
+        encoding='utf-8',
+    )
+
+
+def connect(backend=None):
+    """Spawn telnet to the jcli of backend (by default the current one, see
+    rest_api.backends) and log in
+
+    Returns an InstrumentedTelnet sitting at the standard prompt. Waits for
+    a slot when the backend's JCLI_MAX_SESSIONS are all open.
+    """
+    if backend is None:
+        from .backends import current
+        backend = current()
+    slot = budget.take(backend)
+    try:
+        telnet = _login(backend)
+    except BaseException as e:
+        slot.release()
+        health.failed(backend.name, e)
+        raise
+    health.contacted(backend.name)
+    telnet.slot = slot
+    return telnet
+
+
+def _login(backend):
+    start = time.perf_counter()
+    recorder = None
+    try:
+        telnet = spawn(backend)
+        if getattr(settings, 'JCLI_RECORD_DIR', None):
+            recorder = TranscriptRecorder()
+            telnet.logfile_read = recorder.read_log
+            telnet.logfile_send = recorder.send_log
+        telnet.expect_exact('Username: ')
+    except pexpect.EOF:
+        metrics.JCLI_ERRORS.inc(stage='connect', kind='eof')
+        raise TelnetUnexpectedResponse
+    except pexpect.TIMEOUT:
+        metrics.JCLI_ERRORS.inc(stage='connect', kind='timeout')
+        raise TelnetConnectionTimeout
+    connected = time.perf_counter()
+    metrics.JCLI_CONNECT_SECONDS.observe(connected - start)
+    timing.record('spawn', connected - start)
+    try:
+        telnet.sendline(backend.username)
+        telnet.expect_exact('Password: ')
+        if recorder:
+            recorder.redact_next_send()
+        telnet.sendline(backend.password)
+    except pexpect.EOF:
+        metrics.JCLI_ERRORS.inc(stage='login', kind='eof')
+        raise TelnetUnexpectedResponse
+    except pexpect.TIMEOUT:
+        metrics.JCLI_ERRORS.inc(stage='login', kind='timeout')
+        raise TelnetConnectionTimeout
+
+    try:
+        telnet.expect_exact(settings.STANDARD_PROMPT)
+    except pexpect.EOF:
+        metrics.JCLI_ERRORS.inc(stage='login', kind='eof')
+        raise TelnetLoginFailed
+    logged_in = time.perf_counter()
+    metrics.JCLI_LOGIN_SECONDS.observe(logged_in - connected)
+    timing.record('login', logged_in - connected)
+    metrics.JCLI_SESSIONS_OPENED.inc()
+    metrics.JCLI_SESSIONS_OPEN.inc()
+    return InstrumentedTelnet(telnet, recorder)
+
+
+def disconnect(telnet, request=None, response=None):
+    """Quit jcli, killing the telnet process if it does not go quietly
+
+    When recording, the transcript is saved along with the request and
+    response it belongs to.
+    """
+    try:
+        telnet.sendline('quit')
+        if isinstance(telnet._telnet, SocketSpawn):
+            telnet.close()
+    except (pexpect.ExceptionPexpect, OSError):
+        if not isinstance(telnet._telnet, SocketSpawn):
+            telnet.kill(9)
+    finally:
+        metrics.JCLI_SESSIONS_OPEN.dec()
+        if telnet.slot is not None:
+            telnet.slot.release()
+    if telnet.recorder is not None:
+        telnet.recorder.save(
+            settings.JCLI_RECORD_DIR,
+            request=request and describe_request(request),
+            response=response and describe_response(response))
@@ -0,0 +1,218 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from rest_framework.test import APIClient
+
+from rest_api import mirror
+from rest_api.fakehttpapi import FakeHTTPApiServer
+from rest_api.fakejcli import FakeJcliServer
+from rest_api.tools import dumps
+
+
+def percentile(sorted_values, pct):
+    "Nearest rank percentile of an already sorted list"
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def actions(counts):
+    """(name, method, path, data) for every viewset action, in run order.
+
+    path and data take the request number; bytes data is sent as newline
+    delimited JSON, anything else as JSON. Write actions create objects
+    named after the request number, which later actions update and delete.
+    """
+    users = max(counts['users'], 1)
+    filters = max(counts['filters'], 1)
+    smppccs = max(counts['smppccs'], 1)
+    httpccs = max(counts['httpccs'], 1)
+    none = lambda i: None
+    message = lambda i: {'uid': 'u%d' % (i % users), 'source_addr': str(1000 + i),
+                         'destination_addr': '27%d' % (60 + i % 40)}
+    return [
+        ('UserViewSet.list', 'get', lambda i: '/api/users', none),
+        ('UserViewSet.list?fields', 'get',
+            lambda i: '/api/users?fields=uid,gid,username,status', none),
+        ('UserViewSet.list?limit', 'get', lambda i: '/api/users?limit=10', none),
+        ('UserViewSet.export', 'get', lambda i: '/api/users/export', none),
+        ('UserViewSet.retrieve', 'get', lambda i: '/api/users/u%d' % (i % users), none),
+        ('UserViewSet.create', 'post', lambda i: '/api/users', lambda i: {
+            'uid': 'bench%d' % i, 'gid': 'g0', 'username': 'bench%d' % i,
+            'password': 'bench'}),
+        ('UserViewSet.partial_update', 'patch', lambda i: '/api/users/bench%d' % i,
+            lambda i: [['mt_messaging_cred', 'authorization', 'http_bulk', 'True']]),
+        ('UserViewSet.disable', 'put', lambda i: '/api/users/bench%d/disable' % i, none),
+        ('UserViewSet.enable', 'put', lambda i: '/api/users/bench%d/enable' % i, none),
+        ('UserViewSet.destroy', 'delete', lambda i: '/api/users/bench%d' % i, none),
+        ('GroupViewSet.list', 'get', lambda i: '/api/groups', none),
+        ('GroupViewSet.create', 'post', lambda i: '/api/groups',
+            lambda i: {'gid': 'bench%d' % i}),
+        ('GroupViewSet.disable', 'put', lambda i: '/api/groups/bench%d/disable' % i, none),
+        ('GroupViewSet.enable', 'put', lambda i: '/api/groups/bench%d/enable' % i, none),
+        ('GroupViewSet.destroy', 'delete', lambda i: '/api/groups/bench%d' % i, none),
+        ('FiltersViewSet.list', 'get', lambda i: '/api/filters', none),
+        ('FiltersViewSet.export', 'get', lambda i: '/api/filters/export', none),
+        ('FiltersViewSet.retrieve', 'get', lambda i: '/api/filters/f%d' % (i % filters), none),
+        ('FiltersViewSet.create', 'post', lambda i: '/api/filters', lambda i: {
+            'type': 'DestinationAddrFilter', 'fid': 'bench%d' % i,
+            'parameter': '^%d' % i}),
+        ('MTRouterViewSet.list', 'get', lambda i: '/api/mtrouters', none),
+        ('MTRouterViewSet.export', 'get', lambda i: '/api/mtrouters/export', none),
+        ('MTRouterViewSet.retrieve', 'get', lambda i: '/api/mtrouters/0', none),
+        ('MTRouterViewSet.simulate', 'post', lambda i: '/api/mtrouters/simulate',
+            lambda i: message(i)),
+        ('MTRouterViewSet.simulate?batch', 'post', lambda i: '/api/mtrouters/simulate',
+            lambda i: {'messages': [message(j) for j in range(1000)]}),
+        ('MTRouterViewSet.dryrun', 'post', lambda i: '/api/mtrouters/dryrun',
+            lambda i: b''.join(dumps(message(j)) + b'\n' for j in range(10000))),
+        ('MTRouterViewSet.create', 'post', lambda i: '/api/mtrouters', lambda i: {
+            'type': 'StaticMTRoute', 'order': str(1000 + i), 'rate': '0.1',
+            'smppconnectors': 'smppc0', 'filters': 'bench%d' % i}),
+        ('MTRouterViewSet.destroy', 'delete', lambda i: '/api/mtrouters/%d' % (1000 + i), none),
+        ('MORouterViewSet.list', 'get', lambda i: '/api/morouters', none),
+        ('MORouterViewSet.export', 'get', lambda i: '/api/morouters/export', none),
+        ('MORouterViewSet.retrieve', 'get', lambda i: '/api/morouters/0', none),
+        ('MORouterViewSet.create', 'post', lambda i: '/api/morouters', lambda i: {
+            'type': 'StaticMORoute', 'order': str(1000 + i),
+            'httpconnectors': 'http0', 'filters': 'bench%d' % i}),
+        ('MORouterViewSet.destroy', 'delete', lambda i: '/api/morouters/%d' % (1000 + i), none),
+        ('FiltersViewSet.destroy', 'delete', lambda i: '/api/filters/bench%d' % i, none),
+        ('SMPPCCMViewSet.list', 'get', lambda i: '/api/smppsconns', none),
+        ('SMPPCCMViewSet.retrieve', 'get',
+            lambda i: '/api/smppsconns/smppc%d' % (i % smppccs), none),
+        ('SMPPCCMViewSet.create', 'post', lambda i: '/api/smppsconns',
+            lambda i: {'cid': 'bench%d' % i, 'host': '127.0.0.1', 'port': '2775'}),
+        ('SMPPCCMViewSet.partial_update', 'patch',
+            lambda i: '/api/smppsconns/bench%d' % i, lambda i: {'port': '2776'}),
+        ('SMPPCCMViewSet.start', 'put', lambda i: '/api/smppsconns/bench%d/start' % i, none),
+        ('SMPPCCMViewSet.stop', 'put', lambda i: '/api/smppsconns/bench%d/stop' % i, none),
+        ('SMPPCCMViewSet.destroy', 'delete', lambda i: '/api/smppsconns/bench%d' % i, none),
+        ('HTTPCCMViewSet.list', 'get', lambda i: '/api/httpsconns', none),
+        ('HTTPCCMViewSet.retrieve', 'get',
+            lambda i: '/api/httpsconns/http%d' % (i % httpccs), none),
+        ('HTTPCCMViewSet.create', 'post', lambda i: '/api/httpsconns', lambda i: {
+            'cid': 'bench%d' % i, 'url': 'http://127.0.0.1/mo', 'method': 'GET'}),
+        ('HTTPCCMViewSet.destroy', 'delete', lambda i: '/api/httpsconns/bench%d' % i, none),
+        ('MessagesViewSet.create', 'post', lambda i: '/api/messages', lambda i: {
+            'username': 'foo', 'password': 'bar', 'messages': [
+                {'to': '2762%d' % j, 'content': 'bench'} for j in range(100)]}),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every viewset action end to end, through the full '
+            'middleware stack, against a local fake jcli server')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=50,
+                            help='Requests per action')
+        parser.add_argument('-c', '--concurrency', type=int, default=4,
+                            help='Concurrent client threads')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Fake jcli delay per command, in seconds')
+        parser.add_argument('--login-latency', type=float, default=0.0,
+                            help='Fake jcli delay per login, in seconds')
+        parser.add_argument('--only', default='',
+                            help='Only run actions whose name contains this')
+        parser.add_argument('--mirror', action='store_true',
+                            help='Serve reads from the database mirror, '
+                                 'refreshed once before the run, instead of jcli')
+        parser.add_argument('--json', dest='json_file',
+                            help='Also write results to this file as JSON')
+        for name, default in (('users', 100), ('groups', 5), ('filters', 20),
+                              ('mtroutes', 10), ('moroutes', 5),
+                              ('smppccs', 5), ('httpccs', 5)):
+            parser.add_argument('--%s' % name, type=int, default=default,
+                                help='Number of %s on the fake jcli' % name)
+
+    def handle(self, *args, **options):
+        counts = {k: options[k] for k in (
+            'users', 'groups', 'filters', 'mtroutes', 'moroutes', 'smppccs', 'httpccs')}
+        server = FakeJcliServer(
+            latency=options['latency'], login_latency=options['login_latency'],
+            **counts).start()
+        http_api = FakeHTTPApiServer().start()
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            user = User.objects.create_superuser('benchmark', '', 'benchmark')
+            with override_settings(
+                    TELNET_TRANSPORT='socket', TELNET_HOST='127.0.0.1',
+                    TELNET_PORT=server.port, TELNET_USERNAME=server.username,
+                    TELNET_PW=server.password, MIRROR_ENABLED=options['mirror'],
+                    MIRROR_MAX_AGE=3600, JASMIN_HTTP_URL=http_api.url):
+                if options['mirror']:
+                    mirror.sync()
+                results = self.run_actions(user, counts, options)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+            server.stop()
+            http_api.stop()
+        self.report(results)
+        if options['json_file']:
+            with open(options['json_file'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run_actions(self, user, counts, options):
+        local = threading.local()
+
+        def client():
+            if not hasattr(local, 'client'):
+                local.client = APIClient()
+                local.client.force_authenticate(user)
+                local.client.raise_request_exception = False
+            return local.client
+
+        results = []
+        n = options['requests']
+        for name, method, path, data in actions(counts):
+            if options['only'] not in name:
+                continue
+
+            def request(i):
+                start = time.perf_counter()
+                body = data(i)
+                if isinstance(body, bytes):
+                    kwargs = {'content_type': 'application/x-ndjson'}
+                else:
+                    kwargs = {'format': 'json'}
+                response = getattr(client(), method)(path(i), body, **kwargs)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                return time.perf_counter() - start, response.status_code
+
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                start = time.perf_counter()
+                timings = list(pool.map(request, range(n)))
+                wall = time.perf_counter() - start
+            latencies = sorted(t for t, _ in timings)
+            results.append({
+                'action': name,
+                'requests': n,
+                'errors': sum(1 for _, status in timings if status >= 400),
+                'rps': n / wall if wall else 0.0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+            })
+        return results
+
+    def report(self, results):
+        row = '%-32s %8s %6s %10s %10s %10s'
+        self.stdout.write(row % ('action', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+        for r in results:
+            self.stdout.write(row % (
+                r['action'], r['requests'], r['errors'], '%.1f' % r['rps'],
+                '%.2f' % r['p50_ms'], '%.2f' % r['p99_ms']))
@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from rest_api import ajcli, backends, metrics
+from rest_api.fakejcli import FakeJcliServer
+
+from .benchmark import percentile
+
+#Reads served by async views under ASGI, taking the request number
+PATHS = (
+    ('groups', lambda i: '/api/groups'),
+    ('users/<uid>', lambda i: '/api/users/u%d' % (i % 10)),
+    ('filters', lambda i: '/api/filters'),
+    ('mtrouters/<order>', lambda i: '/api/mtrouters/0'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Compare the ASGI application, whose async views wait on jcli '
+            'without a thread, with the WSGI application run_cherrypy.py '
+            'serves from a pool of threads, on reads from a slow fake jcli')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=500,
+                            help='Requests per path and application')
+        parser.add_argument('-c', '--concurrency', type=int, default=200,
+                            help='Requests in flight at once')
+        parser.add_argument('--threads', type=int, default=10,
+                            help='WSGI worker threads, as run_cherrypy.py '
+                                 'thread_pool')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Fake jcli delay per command, in seconds')
+        parser.add_argument('--login-latency', type=float, default=0.0,
+                            help='Fake jcli delay per login, in seconds')
+        parser.add_argument('--only', default='',
+                            help='Only run paths whose name contains this')
+        parser.add_argument('--json', dest='json_file',
+                            help='Also write results to this file as JSON')
+
+    def handle(self, *args, **options):
+        server = FakeJcliServer(
+            latency=options['latency'], login_latency=options['login_latency'],
+            users=10).start()
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            with override_settings(
+                    TELNET_TRANSPORT='socket', TELNET_HOST='127.0.0.1',
+                    TELNET_PORT=server.port, TELNET_USERNAME=server.username,
+                    TELNET_PW=server.password, MIRROR_ENABLED=False,
+                    PASSWORD_HASHERS=[
+                        'django.contrib.auth.hashers.MD5PasswordHasher']):
+                User.objects.create_superuser('benchmark', '', 'benchmark')
+                results = self.run_paths(options)
+        finally:
+            backends.close()
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+            server.stop()
+        self.report(results)
+        if options['json_file']:
+            with open(options['json_file'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run_paths(self, options):
+        authorization = 'Basic ' + base64.b64encode(b'benchmark:benchmark').decode()
+        n = options['requests']
+        results = []
+        for name, path in PATHS:
+            if options['only'] not in name:
+                continue
+            for application, run in (('wsgi', self.run_wsgi),
+                                     ('asgi', self.run_asgi)):
+                opened = metrics.JCLI_SESSIONS_OPENED.get()
+                start = time.perf_counter()
+                timings = run(path, authorization, options)
+                wall = time.perf_counter() - start
+                latencies = sorted(t for t, _ in timings)
+                results.append({
+                    'path': name,
+                    'application': application,
+                    'requests': n,
+                    'errors': sum(1 for _, status in timings if status >= 400),
+                    'rps': n / wall if wall else 0.0,
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'sessions': metrics.JCLI_SESSIONS_OPENED.get() - opened,
+                })
+        return results
+
+    def run_wsgi(self, path, authorization, options):
+        """Requests through Django's WSGI handler, each holding one of
+        --threads threads from start to end, as under CherryPy"""
+        local = threading.local()
+
+        def request(i):
+            if not hasattr(local, 'client'):
+                local.client = Client(
+                    HTTP_AUTHORIZATION=authorization,
+                    raise_request_exception=False)
+            start = time.perf_counter()
+            response = local.client.get(path(i))
+            return time.perf_counter() - start, response.status_code
+
+        workers = max(min(options['threads'], options['concurrency']), 1)
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(request, range(options['requests'])))
+
+    def run_asgi(self, path, authorization, options):
+        """Requests through Django's ASGI handler, --concurrency of them in
+        flight on one event loop"""
+        async def run():
+            client = AsyncClient(raise_request_exception=False)
+            limit = asyncio.Semaphore(options['concurrency'])
+
+            async def request(i):
+                async with limit:
+                    start = time.perf_counter()
+                    response = await client.get(
+                        path(i), headers={'Authorization': authorization})
+                    return time.perf_counter() - start, response.status_code
+
+            try:
+                return await asyncio.gather(
+                    *(request(i) for i in range(options['requests'])))
+            finally:
+                ajcli.close()
+
+        return asyncio.run(run())
+
+    def report(self, results):
+        row = '%-20s %-5s %8s %6s %10s %10s %10s %9s'
+        self.stdout.write(row % ('path', 'app', 'requests', 'errors', 'req/s',
+                                 'p50 ms', 'p99 ms', 'sessions'))
+        for r in results:
+            self.stdout.write(row % (
+                r['path'], r['application'], r['requests'], r['errors'],
+                '%.1f' % r['rps'], '%.2f' % r['p50_ms'], '%.2f' % r['p99_ms'],
+                r['sessions']))
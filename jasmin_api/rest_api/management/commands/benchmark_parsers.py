@@ -0,0 +1,124 @@
+import json
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from pexpect import TIMEOUT
+
+from rest_api.fakejcli import FakeJasmin, Session, STANDARD_PROMPT
+from rest_api.replay import ReplaySpawn
+from rest_api.tools import split_cols
+from rest_api.views import (
+    FiltersViewSet, MORouterViewSet, MTRouterViewSet, SMPPCCMViewSet, UserViewSet)
+
+
+def transcript(session, lines):
+    "Replay events for sending lines to a fake jcli session, after login"
+    events = [['recv', STANDARD_PROMPT]]
+    for line in lines:
+        events.append(['send', line + '\n'])
+        events.append(['recv', line + '\r\n' + session.handle(line)])
+    return events
+
+
+def table_lines(session, line):
+    "Output lines of a listing, as the views see them before split_cols"
+    result = session.handle(line).replace('\r', '').split('\n')
+    return [l for l in result[1:-2] if l]
+
+
+def cases(rows):
+    """(name, events, call) for every parser. call takes a ReplaySpawn
+    serving events, or the events themselves for split_cols."""
+    jasmin = FakeJasmin(users=rows, groups=10, filters=rows, mtroutes=rows,
+                        moroutes=rows, smppccs=rows, httpccs=10)
+    session = Session(jasmin)
+    uids = list(jasmin.users)
+    return [
+        ('split_cols', table_lines(session, 'filter -l'), split_cols),
+        ('FiltersViewSet._list', transcript(session, ['filter -l']),
+            FiltersViewSet()._list),
+        ('MTRouterViewSet._list', transcript(session, ['mtrouter -l']),
+            MTRouterViewSet()._list),
+        ('MORouterViewSet._list', transcript(session, ['morouter -l']),
+            MORouterViewSet()._list),
+        ('SMPPCCMViewSet.get_connector_list', transcript(session, ['smppccm -l']),
+            SMPPCCMViewSet().get_connector_list),
+        ('UserViewSet.list',
+            transcript(session, ['user -l'] + ['user -s ' + u for u in uids]),
+            lambda telnet: UserViewSet().list(
+                SimpleNamespace(telnet=telnet, query_params={}))),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the jcli output parsers on replayed listings of '
+            'increasing size, without a network or jcli')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10,1000,100000',
+                            help='Comma separated table sizes')
+        parser.add_argument('-n', '--repeat', type=int, default=3,
+                            help='Runs per parser and size, the best is kept')
+        parser.add_argument('--chunk', type=int, default=None,
+                            help='Bytes per read, default whole replies. '
+                                 'Small chunks show the cost of pexpect '
+                                 'rescanning the buffer on every read')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='pexpect timeout, runs exceeding it are '
+                                 'reported as timed out')
+        parser.add_argument('--max-round-trips', type=int, default=1000,
+                            help='Skip cases needing more jcli round trips, '
+                                 'UserViewSet.list needs one per user')
+        parser.add_argument('--only', default='',
+                            help='Only run parsers whose name contains this')
+        parser.add_argument('--json', dest='json_file',
+                            help='Also write results to this file as JSON')
+
+    @override_settings(MIRROR_ENABLED=False)
+    def handle(self, *args, **options):
+        results = []
+        for rows in [int(r) for r in options['rows'].split(',') if r]:
+            for name, events, call in cases(rows):
+                if options['only'] not in name:
+                    continue
+                round_trips = sum(1 for e in events if e[0] == 'send')
+                if round_trips > options['max_round_trips']:
+                    continue
+                best = None
+                for _ in range(options['repeat']):
+                    if name == 'split_cols':
+                        argument = events
+                    else:
+                        argument = ReplaySpawn(events, chunk=options['chunk'],
+                                               timeout=options['timeout'])
+                    start = time.perf_counter()
+                    try:
+                        call(argument)
+                    except TIMEOUT:
+                        best = None
+                        break
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                results.append({
+                    'parser': name,
+                    'rows': rows,
+                    'seconds': best,
+                    'rows_per_second': rows / best if best else None,
+                })
+                self.report(results[-1], header=len(results) == 1)
+        if options['json_file']:
+            with open(options['json_file'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def report(self, result, header=False):
+        row = '%-36s %8s %12s %14s'
+        if header:
+            self.stdout.write(row % ('parser', 'rows', 'ms', 'rows/s'))
+        if result['seconds'] is None:
+            self.stdout.write(row % (result['parser'], result['rows'], 'timeout', ''))
+            return
+        self.stdout.write(row % (
+            result['parser'], result['rows'], '%.2f' % (result['seconds'] * 1000),
+            '%.0f' % result['rows_per_second']))
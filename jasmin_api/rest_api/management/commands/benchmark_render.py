@@ -0,0 +1,103 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from rest_api.fakejcli import FakeJasmin
+from rest_api.middleware import brotli
+from rest_api.tools import orjson
+
+
+def users_payload(jasmin):
+    "Users as GET /api/users returns them"
+    users = []
+    for uid, u in jasmin.users.items():
+        user = {'username': u['username']}
+        for (section, key, name), value in u['credentials'].items():
+            user.setdefault(section, {}).setdefault(key, {})[name] = value
+        user.update(uid=uid, gid=u['gid'],
+                    status='enabled' if u['enabled'] else 'disabled')
+        users.append(user)
+    return {'users': users}
+
+
+def connectors_payload(jasmin):
+    "SMPP connectors as GET /api/smppsconns returns them"
+    connectors = []
+    for cid, c in jasmin.smppccs.items():
+        connector = {k: str(v) for k, v in c.items() if k != 'service'}
+        connector['status'] = c['service']
+        connectors.append(connector)
+    return {'connectors': connectors}
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Command(BaseCommand):
+    help = ('Benchmark JSON encoding and compressed response sizes for large '
+            'user and connector lists')
+    row = '%-12s %8s %-14s %10s %12s'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='1000,10000',
+                            help='Comma separated list sizes')
+        parser.add_argument('-n', '--repeat', type=int, default=3,
+                            help='Runs per measurement, the best is kept')
+        parser.add_argument('--gzip-level', type=int, default=6,
+                            help='gzip level, 6 is what the middleware uses')
+        parser.add_argument('--brotli-quality', type=int, default=5)
+        parser.add_argument('--json', dest='json_file',
+                            help='Also write results to this file as JSON')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        results = []
+        self.stdout.write(self.row % ('payload', 'rows', 'step', 'ms', 'bytes'))
+        for rows in [int(r) for r in options['rows'].split(',') if r]:
+            jasmin = FakeJasmin(users=rows, smppccs=rows, filters=0,
+                                mtroutes=0, moroutes=0)
+            for name, payload in (('users', users_payload(jasmin)),
+                                  ('connectors', connectors_payload(jasmin))):
+                encoders = [('json', lambda: json.dumps(
+                    payload, cls=DjangoJSONEncoder).encode('utf-8'))]
+                if orjson is not None:
+                    encoders.append(('orjson', lambda: orjson.dumps(payload)))
+                encoded = None
+                for encoder, function in encoders:
+                    seconds, encoded = best_time(function, repeat)
+                    results.append(self.result(
+                        name, rows, 'encode %s' % encoder, seconds, len(encoded)))
+                compressors = [('gzip', lambda: gzip.compress(
+                    encoded, compresslevel=options['gzip_level'], mtime=0))]
+                if brotli is not None:
+                    compressors.append(('br', lambda: brotli.compress(
+                        encoded, quality=options['brotli_quality'])))
+                for compressor, function in compressors:
+                    seconds, compressed = best_time(function, repeat)
+                    results.append(self.result(
+                        name, rows, 'compress %s' % compressor, seconds,
+                        len(compressed)))
+        if orjson is None:
+            self.stdout.write('orjson is not installed, only json was measured')
+        if brotli is None:
+            self.stdout.write('brotli is not installed, only gzip was measured')
+        if options['json_file']:
+            with open(options['json_file'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def result(self, payload, rows, step, seconds, size):
+        result = {'payload': payload, 'rows': rows, 'step': step,
+                  'seconds': seconds, 'bytes': size}
+        self.stdout.write(self.row % (
+            payload, rows, step, '%.2f' % (seconds * 1000), size))
+        return result
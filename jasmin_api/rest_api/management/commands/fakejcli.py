@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from rest_api.fakejcli import FakeJcliServer
+
+
+class Command(BaseCommand):
+    help = 'Run a fake jcli telnet server for testing and benchmarking the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8990)
+        parser.add_argument('--username', default='jcliadmin')
+        parser.add_argument('--password', default='jclipwd')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds to wait before answering each command')
+        parser.add_argument('--login-latency', type=float, default=0.0,
+                            help='Seconds to wait before accepting a login')
+        for name, default in (('users', 100), ('groups', 5), ('filters', 20),
+                              ('mtroutes', 10), ('moroutes', 5),
+                              ('smppccs', 5), ('httpccs', 5)):
+            parser.add_argument('--%s' % name, type=int, default=default,
+                                help='Number of %s to generate' % name)
+
+    def handle(self, *args, **options):
+        server = FakeJcliServer(
+            options['host'], options['port'],
+            username=options['username'], password=options['password'],
+            latency=options['latency'], login_latency=options['login_latency'],
+            users=options['users'], groups=options['groups'],
+            filters=options['filters'], mtroutes=options['mtroutes'],
+            moroutes=options['moroutes'], smppccs=options['smppccs'],
+            httpccs=options['httpccs'],
+        )
+        self.stdout.write('Fake jcli listening on %s:%d (Ctrl-C to stop)' % (
+            options['host'], server.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
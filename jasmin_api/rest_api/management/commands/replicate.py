@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import APIException
+
+from rest_api import replication
+
+
+class Command(BaseCommand):
+    help = ('Replicate users, groups, filters and routes of the primary '
+            'Jasmin backend to the standbys')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--primary', help='Backend to copy, default DEFAULT_BACKEND')
+        parser.add_argument('--standby', action='append', dest='standbys',
+                            help='Backend to update, repeat for several, '
+                                 'default all but the primary')
+        parser.add_argument('--tables', default=','.join(replication.TABLES),
+                            help='Comma separated tables to replicate, of %s'
+                                 % ', '.join(replication.TABLES))
+        parser.add_argument('--passwords', dest='passwords_file',
+                            help='JSON file of {uid: password} for users to '
+                                 'add to standbys')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the operations to apply')
+
+    def handle(self, *args, **options):
+        passwords = None
+        if options['passwords_file']:
+            with open(options['passwords_file']) as f:
+                passwords = json.load(f)
+        try:
+            report = replication.replicate(
+                options['primary'], options['standbys'], options['dry_run'],
+                passwords, [t for t in options['tables'].split(',') if t])
+        except APIException as e:
+            raise CommandError(e.detail)
+        self.stdout.write(json.dumps(report, indent=2))
+        if any(s['errors'] for s in report['standbys']):
+            raise CommandError('Replication failed on some standbys')
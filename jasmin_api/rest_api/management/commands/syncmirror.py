@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_api import mirror
+
+
+class Command(BaseCommand):
+    help = 'Refresh the database mirror of the Jasmin configuration from jcli'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', default=','.join(mirror.TABLES),
+                            help='Comma separated tables to refresh, of %s'
+                                 % ', '.join(mirror.TABLES))
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep refreshing every this many seconds, '
+                                 'default refresh once')
+
+    def handle(self, *args, **options):
+        if not settings.MIRROR_ENABLED:
+            raise CommandError('MIRROR_ENABLED is off, nothing to refresh')
+        tables = [t for t in options['tables'].split(',') if t]
+        unknown = set(tables) - set(mirror.TABLES)
+        if unknown:
+            raise CommandError('Unknown tables: %s' % ', '.join(sorted(unknown)))
+        while True:
+            start = time.monotonic()
+            mirror.sync(tables)
+            self.stdout.write('Refreshed %s in %.2fs' % (
+                ', '.join(tables), time.monotonic() - start))
+            if not options['interval']:
+                break
+            time.sleep(max(options['interval'] - (time.monotonic() - start), 0))
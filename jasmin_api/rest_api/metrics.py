@@ -0,0 +1,251 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Only the small part of the exposition format we need is implemented here, so
+no extra dependency is required. Values live in process memory and are reset
+on restart. snapshot() and merge() let the workers of run_cherrypy.py add up
+theirs, see rest_api.workers.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+
+class Metric:
+    "Base class for labelled metrics, registers itself on creation"
+    mtype = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames:
+            self._values[()] = self._zero()
+        REGISTRY.append(self)
+
+    def _zero(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects labels %s, got %s' % (
+                self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[l]) for l in self.labelnames)
+
+    def items(self):
+        "Sorted (label values, value) pairs, copied"
+        with self._lock:
+            return sorted(self._values.items())
+
+    def add(self, total, value):
+        "Sum of two values, to merge those of several processes"
+        return total + value
+
+    def samples(self, items):
+        "Yield (suffix, label values, extra labels, value) tuples of items"
+        raise NotImplementedError
+
+    def render(self, items=None):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.mtype),
+        ]
+        if items is None:
+            items = self.items()
+        for suffix, values, extra, value in self.samples(items):
+            lines.append('%s%s%s %s' % (
+                self.name, suffix,
+                _format_labels(self.labelnames, values, extra),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    "Monotonically increasing count"
+    mtype = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self, items):
+        for values, value in items:
+            yield '_total', values, (), value
+
+
+class Gauge(Metric):
+    "Value that can go up and down"
+    mtype = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self, items):
+        for values, value in items:
+            yield '', values, (), value
+
+
+class Histogram(Metric):
+    "Distribution of observed values in cumulative buckets"
+    mtype = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _zero(self):
+        return [0] * (len(self.buckets) + 1), 0.0
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or self._zero()
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def items(self):
+        with self._lock:
+            return sorted(
+                (k, (list(c), s)) for k, (c, s) in self._values.items())
+
+    def add(self, total, value):
+        return ([a + b for a, b in zip(total[0], value[0])],
+                total[1] + value[1])
+
+    def samples(self, items):
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', values, (('le', _format_value(bound)),), cumulative
+            yield '_count', values, (), cumulative
+            yield '_sum', values, (), total
+
+
+def render(snapshot=None):
+    """All registered metrics in the Prometheus text exposition format, with
+    the values of snapshot when given"""
+    if snapshot is None:
+        return '\n'.join(m.render() for m in REGISTRY) + '\n'
+    return '\n'.join(
+        m.render(sorted(snapshot.get(m.name, {}).items()))
+        for m in REGISTRY) + '\n'
+
+
+def snapshot():
+    "{metric name: {label values: value}} of every registered metric"
+    return {m.name: dict(m.items()) for m in REGISTRY}
+
+
+def merge(snapshots, gauges=True):
+    """Sum of snapshots, as the values of the processes they were taken in
+    would add up. Without gauges, only counters and histograms are kept"""
+    merged = {}
+    for m in REGISTRY:
+        if m.mtype == 'gauge' and not gauges:
+            continue
+        values = merged[m.name] = {}
+        for taken in snapshots:
+            for key, value in taken.get(m.name, {}).items():
+                values[key] = (m.add(values[key], value) if key in values
+                               else value)
+    return merged
+
+
+JCLI_CONNECT_SECONDS = Histogram(
+    'jasmin_api_jcli_connect_seconds',
+    'Time to open the telnet connection to jcli')
+JCLI_LOGIN_SECONDS = Histogram(
+    'jasmin_api_jcli_login_seconds',
+    'Time from connection to the jcli prompt after sending credentials')
+JCLI_COMMAND_SECONDS = Histogram(
+    'jasmin_api_jcli_command_seconds',
+    'Round trip time of jcli commands, from sendline to matching expect',
+    ['command'])
+JCLI_ERRORS = Counter(
+    'jasmin_api_jcli_errors',
+    'jcli failures by stage (connect, login, command) and kind',
+    ['stage', 'kind'])
+JCLI_SESSIONS_OPENED = Counter(
+    'jasmin_api_jcli_sessions_opened',
+    'jcli sessions opened since start')
+JCLI_SESSIONS_OPEN = Gauge(
+    'jasmin_api_jcli_sessions_open',
+    'jcli sessions currently open')
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'jasmin_api_http_request_seconds',
+    'Time to serve API requests',
+    ['viewset', 'action', 'method'])
+HTTP_REQUESTS = Counter(
+    'jasmin_api_http_requests',
+    'API requests served',
+    ['viewset', 'action', 'method', 'status'])
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'jasmin_api_http_requests_in_flight',
+    'API requests currently being served')
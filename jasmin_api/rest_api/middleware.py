@@ -1,51 +1,406 @@
-import pexpect
+import cProfile
+import json
+import re
+import time
 
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
 from django.conf import settings
-from django.utils.deprecation import MiddlewareMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.text import compress_sequence, compress_string
 
-from .exceptions import TelnetUnexpectedResponse, TelnetConnectionTimeout, TelnetLoginFailed
+from . import backends, metrics, profiling, timing
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-class TelnetConnectionMiddleware(MiddlewareMixin):
+
+#/api/backends/<name>/... works on backend name, as /api/... does
+BACKEND_PATH_RE = re.compile(r'^/api/backends/([^/]+)(/.*)$')
+
+
+class HybridMiddleware:
+    """Base of middleware that serves both WSGI and ASGI requests without a
+    thread of its own: under ASGI, Django runs middleware that is not async
+    capable, and everything after it, in a thread per request
+
+    Subclasses implement call for sync and acall for async request chains.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.acall(request)
+        return self.call(request)
+
+
+class TelnetConnectionMiddleware(HybridMiddleware):
     """Middleware to add telnet connection to API requests"""
-    
+
+    def call(self, request):
+        response = self.process_request(request) or self.get_response(request)
+        return self.process_response(request, response)
+
+    async def acall(self, request):
+        response = (self.process_request(request) or
+                    await self.get_response(request))
+        if hasattr(request, 'telnet') and request.telnet._wrapped is not empty:
+            #a viewset used a pexpect session, releasing it may block
+            return await sync_to_async(self.process_response)(request, response)
+        return self.process_response(request, response)
+
     def process_request(self, request):
         """Add a telnet connection to all request paths that start with /api/
         assuming we only need to connect for these means we avoid unnecessary
         overhead on any other functionality we add, and keeps URL path clear
         for it.
+
+        The connection is only opened when a view first uses it, so requests
+        answered from the mirror never spawn telnet. Errors connecting are
+        raised in the view, and rendered by DRF.
+
+        The backend worked on comes from an /api/backends/<name>/ path
+        prefix, which is stripped before the URL is resolved, or the
+        BACKEND_HEADER header. Its session pool provides the connection.
         """
+        backends.deactivate()
         if not request.path.startswith('/api/'):
             return None
+        name = request.headers.get(settings.BACKEND_HEADER)
+        match = BACKEND_PATH_RE.match(request.path_info)
+        if match:
+            name = match.group(1)
+            request.path_info = '/api' + match.group(2)
+        name = name or settings.DEFAULT_BACKEND
+        if name not in backends.registry():
+            return JsonResponse(
+                {'detail': 'Unknown backend: %s' % name}, status=404)
+        backends.activate(name)
+        request.backend = backend = backends.get(name)
+        if settings.ASGI_URLCONF and isinstance(request, ASGIRequest):
+            request.urlconf = settings.ASGI_URLCONF
+        if getattr(settings, 'JCLI_RECORD_DIR', None):
+            #keep the body for the transcript, DRF would consume the stream
+            request.body
+        request.telnet = SimpleLazyObject(backend.pool.acquire)
+        return None
+
+    def process_response(self, request, response):
+        """Make sure telnet connection is released when unleashing response back to client
+
+        Streaming responses still read from jcli while they are sent, so
+        their connection is released once the stream ends or is abandoned.
+        Only connections of successful responses, streams read to the end,
+        go back to the pool: a failed command may leave jcli mid way.
+        """
+        if not hasattr(request, 'telnet'):
+            return response
+
+        def close(completed=True):
+            backends.deactivate()
+            if request.telnet._wrapped is not empty:
+                request.backend.pool.release(
+                    request.telnet._wrapped,
+                    completed and response.status_code < 400,
+                    request, response)
+
+        if response.streaming:
+            response.streaming_content = DisconnectAfter(
+                response.streaming_content, close)
+        else:
+            close()
+        return response
+
+
+class DisconnectAfter:
+    """Iterator over streaming content that calls disconnect once, when the
+    content is exhausted or the response is closed before that. disconnect
+    is told whether the content was exhausted"""
+
+    def __init__(self, content, disconnect):
+        self._content = iter(content)
+        self._disconnect = disconnect
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
         try:
-            telnet = pexpect.spawn(
-                "telnet %s %s" %
-                (settings.TELNET_HOST, settings.TELNET_PORT),
-                timeout=settings.TELNET_TIMEOUT,
-                encoding='utf-8',
-            )
-            telnet.expect_exact('Username: ')
-            telnet.sendline(settings.TELNET_USERNAME)
-            telnet.expect_exact('Password: ')
-            telnet.sendline(settings.TELNET_PW)
-        except pexpect.EOF:
-            raise TelnetUnexpectedResponse
-        except pexpect.TIMEOUT:
-            raise TelnetConnectionTimeout
+            return next(self._content)
+        except StopIteration:
+            self.close(True)
+            raise
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self, completed=False):
+        if self._disconnect is not None:
+            disconnect, self._disconnect = self._disconnect, None
+            disconnect(completed)
+
 
+def view_labels(request):
+    """Viewset class name and action for a request, used as metric labels
+
+    Falls back to the URL name for plain views and to 'unmatched' when
+    the path does not resolve.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
         try:
-            telnet.expect_exact(settings.STANDARD_PROMPT)
-        except pexpect.EOF:
-            raise TelnetLoginFailed
-        else:
-            request.telnet = telnet
-            return None
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unmatched', 'unmatched'
+    cls = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if cls is not None and actions:
+        return cls.__name__, actions.get(request.method.lower(), 'unknown')
+    return match.url_name or 'unknown', request.method.lower()
 
-    def process_response(self, request, response):
-        """Make sure telnet connection is closed when unleashing response back to client"""
-        if hasattr(request, 'telnet'):
+
+class MetricsMiddleware(HybridMiddleware):
+    """Time and count API requests per viewset action
+
+    Should come first in MIDDLEWARE so the jcli connection and login done by
+    TelnetConnectionMiddleware are included in the request time.
+    """
+
+    def call(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        start = time.perf_counter()
+        with metrics.HTTP_REQUESTS_IN_FLIGHT.track_inprogress():
+            response = self.get_response(request)
+        return self.observe(request, response, start)
+
+    async def acall(self, request):
+        if not request.path.startswith('/api/'):
+            return await self.get_response(request)
+        start = time.perf_counter()
+        with metrics.HTTP_REQUESTS_IN_FLIGHT.track_inprogress():
+            response = await self.get_response(request)
+        return self.observe(request, response, start)
+
+    def observe(self, request, response, start):
+        viewset, action = view_labels(request)
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            viewset=viewset, action=action, method=request.method)
+        metrics.HTTP_REQUESTS.inc(
+            viewset=viewset, action=action, method=request.method,
+            status=response.status_code)
+        return response
+
+
+class ServerTimingMiddleware(HybridMiddleware):
+    """Add a Server-Timing header breaking API request time down into
+    telnet spawn, login, jcli round trips, JSON rendering and the rest (app)
+
+    With SERVER_TIMING_DEBUG set, JSON responses also get a debug_timing key
+    listing each jcli command and its duration.
+    """
+
+    def call(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        token = timing.begin()
+        try:
+            return self.add_header(self.get_response(request))
+        finally:
+            timing.end(token)
+
+    async def acall(self, request):
+        if not request.path.startswith('/api/'):
+            return await self.get_response(request)
+        token = timing.begin()
+        try:
+            return self.add_header(await self.get_response(request))
+        finally:
+            timing.end(token)
+
+    def add_header(self, response):
+        request_timing = timing.current()
+        phases = request_timing.finish()
+        response['Server-Timing'] = request_timing.header(phases)
+        if getattr(settings, 'SERVER_TIMING_DEBUG', False):
+            self.add_debug_block(response, request_timing.debug(phases))
+        return response
+
+    def add_debug_block(self, response, debug):
+        if (response.streaming or
+                not response.get('Content-Type', '').startswith('application/json')):
+            return
+        try:
+            data = json.loads(response.content)
+        except ValueError:
+            return
+        if isinstance(data, dict):
+            data['debug_timing'] = debug
+            response.content = json.dumps(data)
+            #CommonMiddleware has set it for the content without the block
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+
+
+def accepted_encoding(accept_encoding):
+    """Best of br (when brotli is installed) and gzip allowed by an
+    Accept-Encoding header, br winning ties. None if neither is allowed."""
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        q = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
             try:
-                request.telnet.sendline('quit')
-            except pexpect.ExceptionPexpect:
-                request.telnet.kill(9)
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        weights[token.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """Compress responses with brotli or gzip, as negotiated with the
+    client's Accept-Encoding
+
+    Responses shorter than COMPRESSION_MIN_SIZE are sent as they are, since
+    compressing them costs more than it saves. Streaming responses are
+    always compressed, but for async ones. Should come before
+    ServerTimingMiddleware, which may still change the content.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'COMPRESSION_ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        return self.compress(request, self.get_response(request))
+
+    async def acall(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if (response.has_header('Content-Encoding') or
+                response.streaming and response.is_async):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if (not response.streaming and
+                len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = _brotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(
+                    response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+            else:
+                compressed = compress_string(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        if response.has_header('ETag'):
+            #the body differs from the one the strong ETag was computed on
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        response['Content-Encoding'] = encoding
         return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """Profile a single request with cProfile when a superuser sends the
+    X-Profile header
+
+    Should come first in MIDDLEWARE so the profile covers the telnet spawn,
+    login and all jcli interaction. The dump is stored in the PROFILE_DIR
+    ring and its name returned in the X-Profile-Id response header, for
+    download from /profiles/<name>. Requests without the header only pay for
+    one dictionary lookup. The middleware is only used with
+    PROFILING_ENABLED set.
+
+    Whether the user is a superuser is only known once the view has
+    authenticated the request, so requests with the header are profiled and
+    the profile dropped when they were not made by one.
+
+    Under ASGI the profile covers whatever the event loop ran meanwhile,
+    other requests included.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        if 'HTTP_X_PROFILE' not in request.META:
+            return self.get_response(request)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+        if not self.is_superuser(request):
+            return response
+        return self.save(request, response, profile)
+
+    async def acall(self, request):
+        if 'HTTP_X_PROFILE' not in request.META:
+            return await self.get_response(request)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.disable()
+        #a session user is loaded from the database
+        if not await sync_to_async(self.is_superuser)(request):
+            return response
+        return self.save(request, response, profile)
+
+    def save(self, request, response, profile):
+        response['X-Profile-Id'] = profiling.save(
+            profile, request.method, request.path)
+        return response
+
+    def is_superuser(self, request):
+        """Whether the request was made by a superuser, as authenticated by
+        AuthenticationMiddleware or, for API views, by DRF"""
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_authenticated
+                    and user.is_superuser)
@@ -0,0 +1,105 @@
+# Generated by Django 4.2.16 on 2026-10-19 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirrorFilter',
+            fields=[
+                ('fid', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=32)),
+                ('description', models.CharField(db_index=True, max_length=255)),
+                ('position', models.IntegerField(default=0)),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MirrorGroup',
+            fields=[
+                ('gid', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('status', models.CharField(max_length=16)),
+                ('position', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MirrorRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('router', models.CharField(max_length=2)),
+                ('order', models.IntegerField()),
+                ('type', models.CharField(max_length=32)),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'ordering': ['router', '-order'],
+                'unique_together': {('router', 'order')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MirrorState',
+            fields=[
+                ('table', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('synced_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorUser',
+            fields=[
+                ('uid', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('gid', models.CharField(db_index=True, max_length=64)),
+                ('username', models.CharField(db_index=True, max_length=64)),
+                ('status', models.CharField(max_length=16)),
+                ('position', models.IntegerField(default=0)),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MirrorRouteFilter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(max_length=255)),
+                ('fid', models.CharField(db_index=True, max_length=64, null=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='filter_refs', to='rest_api.mirrorroute')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorRouteConnector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cid', models.CharField(db_index=True, max_length=64)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='connector_refs', to='rest_api.mirrorroute')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorConnector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=4)),
+                ('cid', models.CharField(max_length=64)),
+                ('position', models.IntegerField(default=0)),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'ordering': ['kind', 'position'],
+                'unique_together': {('kind', 'cid')},
+            },
+        ),
+    ]
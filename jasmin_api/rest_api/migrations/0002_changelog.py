@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-19 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirrorChange',
+            fields=[
+                ('version', models.AutoField(primary_key=True, serialize=False)),
+                ('table', models.CharField(max_length=32)),
+                ('key', models.CharField(max_length=64)),
+                ('action', models.CharField(max_length=8)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['table', 'version'], name='rest_api_mi_table_ad6c5c_idx')],
+            },
+        ),
+    ]
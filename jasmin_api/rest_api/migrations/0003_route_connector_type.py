@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0002_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mirrorrouteconnector',
+            name='type',
+            field=models.CharField(default='', max_length=8),
+        ),
+    ]
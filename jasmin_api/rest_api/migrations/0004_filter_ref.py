@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0003_route_connector_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mirrorfilter',
+            name='ref',
+            field=models.CharField(db_index=True, default='', max_length=128),
+        ),
+    ]
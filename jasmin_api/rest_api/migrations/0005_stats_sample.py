@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-19 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0004_filter_ref'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=8)),
+                ('oid', models.CharField(max_length=64)),
+                ('time', models.FloatField(db_index=True)),
+                ('values', models.JSONField()),
+                ('info', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'oid', 'time'], name='rest_api_st_kind_590ea0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-19 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0005_stats_sample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProbeResult',
+            fields=[
+                ('url', models.CharField(max_length=512, primary_key=True, serialize=False)),
+                ('checked_at', models.FloatField()),
+                ('result', models.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,641 @@
+"""Mirror of the Jasmin configuration in the database
+
+Tables are refreshed in full from jcli by refresh() (run by the syncmirror
+command and the run_cherrypy.py background thread) and by list requests
+served from jcli, and updated object by object by the viewsets after each
+write. Reads use the mirror while the table is fresh, see use_mirror().
+
+Every object created, updated or deleted in the mirror, by either path, is
+logged as a MirrorChange. Its version is the configuration version list
+endpoints take as ?since=, see delta().
+"""
+import contextlib
+import functools
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.http import http_date
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+
+from . import backends
+from .exceptions import ChangesExpired, JasminSyntaxError, ObjectInUse
+from .models import (MirrorState, MirrorGroup, MirrorUser, MirrorFilter,
+                     MirrorRoute, MirrorRouteConnector, MirrorRouteFilter,
+                     MirrorConnector, MirrorChange)
+from .tools import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+TABLES = ('groups', 'users', 'filters', 'mtrouters', 'morouters',
+          'smppsconns', 'httpsconns')
+
+#mirror table of each connector kind and router
+CONNECTOR_TABLES = {'smpp': 'smppsconns', 'http': 'httpsconns'}
+ROUTER_TABLES = {'mt': 'mtrouters', 'mo': 'morouters'}
+
+#field identifying objects of each table, as the list endpoints return them
+KEYS = {'groups': 'name', 'users': 'uid', 'filters': 'fid',
+        'mtrouters': 'order', 'morouters': 'order',
+        'smppsconns': 'cid', 'httpsconns': 'cid'}
+
+CONNECTOR_RE = re.compile(r'^(\w+)\((.+)\)$')
+DELETE_PARAMETERS = [
+    OpenApiParameter(
+        name='force', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY,
+        description='Delete even if users, filters or routes refer to it'),
+    OpenApiParameter(
+        name='preview', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY,
+        description='Only list what refers to it, delete nothing'),
+]
+
+#what connector, user and group filters match, from their description
+FILTER_REF_RE = re.compile(r'^<\w+ \(((?:cid|uid|gid)=.*)\)>$')
+
+SINCE_PARAMETER = OpenApiParameter(
+    name='since', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+    description='Only objects created, updated or deleted after this '
+                'configuration version (X-Config-Version), 0 for all. '
+                'Returns version, created, updated and deleted')
+
+
+def synced_at(table):
+    state = MirrorState.objects.filter(table=table).first()
+    return state.synced_at if state else None
+
+
+def age(table):
+    "Seconds since table was last refreshed, None if it never was"
+    synced = synced_at(table)
+    if synced is None:
+        return None
+    return (timezone.now() - synced).total_seconds()
+
+
+def is_fresh(table):
+    table_age = age(table)
+    return table_age is not None and table_age <= settings.MIRROR_MAX_AGE
+
+
+def enabled():
+    """Whether the mirror is in use: MIRROR_ENABLED is on and the current
+    request works on DEFAULT_BACKEND, the only one mirrored"""
+    return settings.MIRROR_ENABLED and backends.is_default()
+
+
+def use_mirror(request, table):
+    """Whether to answer request, a DRF or a plain Django one, from the
+    mirror. ?source=jcli always reads from jcli"""
+    if not enabled():
+        return False
+    if getattr(request, 'query_params', request.GET).get('source') == 'jcli':
+        return False
+    return is_fresh(table)
+
+
+def annotate(response, table):
+    "Tell the client a response comes from the mirror, and how old it is"
+    synced = synced_at(table)
+    response['X-Mirror-Synced-At'] = http_date(synced.timestamp())
+    response['X-Mirror-Age'] = '%.0f' % (timezone.now() - synced).total_seconds()
+    response['X-Config-Version'] = str(version())
+    return response
+
+
+def _when_enabled(function):
+    "Writes to the mirror do nothing while it is not enabled()"
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if enabled():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def _mark(table):
+    MirrorState.objects.update_or_create(
+        table=table, defaults={'synced_at': timezone.now()})
+
+
+def _next_position(model, **filters):
+    last = model.objects.filter(**filters).order_by('-position').first()
+    return last.position + 1 if last else 0
+
+
+#Full table replacement, from a complete jcli listing
+
+@_when_enabled
+def replace_groups(groups):
+    with transaction.atomic(), _tracking('groups'):
+        MirrorGroup.objects.all().delete()
+        MirrorGroup.objects.bulk_create([
+            MirrorGroup(gid=g['name'], status=g['status'], position=i)
+            for i, g in enumerate(groups)])
+        _mark('groups')
+
+
+@_when_enabled
+def replace_users(users):
+    "users as returned by the user list, with their details and status"
+    with transaction.atomic(), _tracking('users'):
+        MirrorUser.objects.all().delete()
+        MirrorUser.objects.bulk_create([
+            _user(u, position=i) for i, u in enumerate(users)])
+        _mark('users')
+
+
+@_when_enabled
+def replace_filters(filters):
+    with transaction.atomic(), _tracking('filters'):
+        MirrorFilter.objects.all().delete()
+        MirrorFilter.objects.bulk_create([
+            MirrorFilter(fid=f['fid'], type=f['type'],
+                         description=f['description'], ref=_filter_ref(f),
+                         position=i, data=f)
+            for i, f in enumerate(filters)])
+        _link_route_filters()
+        _mark('filters')
+
+
+@_when_enabled
+def replace_routes(router, routes):
+    "router is 'mt' or 'mo', routes as returned by its list"
+    with transaction.atomic(), _tracking(ROUTER_TABLES[router]):
+        MirrorRoute.objects.filter(router=router).delete()
+        created = MirrorRoute.objects.bulk_create([
+            MirrorRoute(router=router, order=int(r['order']), type=r['type'], data=r)
+            for r in routes])
+        descriptions = _filter_ids()
+        connector_refs, filter_refs = [], []
+        for route in created:
+            for connector in route.data['connectors']:
+                match = CONNECTOR_RE.match(connector)
+                connector_refs.append(MirrorRouteConnector(
+                    route=route, type=match.group(1) if match else '',
+                    cid=match.group(2) if match else connector))
+            for description in route.data['filters']:
+                for fid in descriptions.get(description, [None]):
+                    filter_refs.append(MirrorRouteFilter(
+                        route=route, description=description, fid=fid))
+        MirrorRouteConnector.objects.bulk_create(connector_refs)
+        MirrorRouteFilter.objects.bulk_create(filter_refs)
+        _mark(ROUTER_TABLES[router])
+
+
+@_when_enabled
+def replace_connectors(kind, connectors):
+    "kind is 'smpp' or 'http', connectors as returned by its list"
+    with transaction.atomic(), _tracking(CONNECTOR_TABLES[kind]):
+        MirrorConnector.objects.filter(kind=kind).delete()
+        MirrorConnector.objects.bulk_create([
+            MirrorConnector(kind=kind, cid=c['cid'], position=i, data=c)
+            for i, c in enumerate(connectors)])
+        _mark(CONNECTOR_TABLES[kind])
+
+
+def _filter_ref(f):
+    match = FILTER_REF_RE.match(f['description'])
+    return match.group(1) if match else ''
+
+
+def _filter_ids():
+    "Filter description to fids; filters with the same parameter share one"
+    descriptions = {}
+    for fid, description in MirrorFilter.objects.values_list('fid', 'description'):
+        descriptions.setdefault(description, []).append(fid)
+    return descriptions
+
+
+def _link_route_filters():
+    "Point route filter references at the filters with their description"
+    descriptions = _filter_ids()
+    refs = list(MirrorRouteFilter.objects.all())
+    MirrorRouteFilter.objects.all().delete()
+    linked, seen = [], set()
+    for ref in refs:
+        if (ref.route_id, ref.description) in seen:
+            continue
+        seen.add((ref.route_id, ref.description))
+        for fid in descriptions.get(ref.description, [None]):
+            linked.append(MirrorRouteFilter(
+                route_id=ref.route_id, description=ref.description, fid=fid))
+    MirrorRouteFilter.objects.bulk_create(linked)
+
+
+#Single object updates, after writes through the API
+
+@_when_enabled
+def save_group(gid, status):
+    with _tracking('groups', gid):
+        current = MirrorGroup.objects.filter(gid=gid).first()
+        MirrorGroup.objects.update_or_create(gid=gid, defaults={
+            'status': status,
+            'position': current.position if current else
+                _next_position(MirrorGroup)})
+
+
+@_when_enabled
+def delete_group(gid):
+    with _tracking('groups', gid):
+        MirrorGroup.objects.filter(gid=gid).delete()
+
+
+def _user(user, position):
+    data = dict(user)
+    status = data.pop('status', 'enabled')
+    return MirrorUser(
+        uid=data['uid'], gid=data.get('gid', ''),
+        username=data.get('username', ''), status=status,
+        position=position, data=data)
+
+
+@_when_enabled
+def save_user(user, status=None):
+    """Store a user as returned by user -s. status keeps the mirrored one
+    when not given"""
+    with _tracking('users', user['uid']):
+        current = MirrorUser.objects.filter(uid=user['uid']).first()
+        if status is None:
+            status = current.status if current else 'enabled'
+        position = current.position if current else _next_position(MirrorUser)
+        _user(dict(user, status=status), position).save()
+
+
+@_when_enabled
+def delete_user(uid):
+    with _tracking('users', uid):
+        MirrorUser.objects.filter(uid=uid).delete()
+
+
+@_when_enabled
+def save_connector(kind, connector):
+    with _tracking(CONNECTOR_TABLES[kind], connector['cid']):
+        current = MirrorConnector.objects.filter(
+            kind=kind, cid=connector['cid']).first()
+        MirrorConnector.objects.update_or_create(
+            kind=kind, cid=connector['cid'], defaults={
+                'data': connector,
+                'position': current.position if current else
+                    _next_position(MirrorConnector, kind=kind)})
+
+
+@_when_enabled
+def delete_connector(kind, cid):
+    with _tracking(CONNECTOR_TABLES[kind], cid):
+        MirrorConnector.objects.filter(kind=kind, cid=cid).delete()
+
+
+@_when_enabled
+def delete_filter(fid):
+    "Routes keep the filter description, unlinked"
+    with _tracking('filters', fid):
+        MirrorRouteFilter.objects.filter(fid=fid).update(fid=None)
+        MirrorFilter.objects.filter(fid=fid).delete()
+
+
+@_when_enabled
+def delete_route(router, order):
+    with _tracking(ROUTER_TABLES[router], order):
+        MirrorRoute.objects.filter(router=router, order=int(order)).delete()
+
+
+#Reads
+
+def groups():
+    return [{'name': g.gid, 'status': g.status} for g in MirrorGroup.objects.all()]
+
+
+def users(gid=None, status=None, q=None):
+    "Users with details and status, as the user list returns them"
+    queryset = MirrorUser.objects.all()
+    if gid:
+        queryset = queryset.filter(gid=gid)
+    if status:
+        queryset = queryset.filter(status=status)
+    if q:
+        queryset = queryset.filter(Q(uid__icontains=q) | Q(username__icontains=q))
+    return [dict(u.data, status=u.status) for u in queryset]
+
+
+def user(uid):
+    "A user as user -s gives it, None if not mirrored"
+    found = MirrorUser.objects.filter(uid=uid).first()
+    return found.data if found else None
+
+
+def filters():
+    return [f.data for f in MirrorFilter.objects.all()]
+
+
+def filter(fid):
+    found = MirrorFilter.objects.filter(fid=fid).first()
+    return found.data if found else None
+
+
+def routes(router):
+    return [r.data for r in MirrorRoute.objects.filter(router=router)]
+
+
+def route(router, order):
+    try:
+        found = MirrorRoute.objects.filter(router=router, order=int(order)).first()
+    except ValueError:
+        return None
+    return found.data if found else None
+
+
+def connectors(kind):
+    return [c.data for c in MirrorConnector.objects.filter(kind=kind)]
+
+
+def connector(kind, cid):
+    found = MirrorConnector.objects.filter(kind=kind, cid=cid).first()
+    return found.data if found else None
+
+
+def group_users(gid):
+    "Users of group gid, None if there is no such group"
+    if not MirrorGroup.objects.filter(gid=gid).exists():
+        return None
+    return users(gid=gid)
+
+
+def connector_routes(kind, cid):
+    """MT routes sending to the connector, None if there is no such
+    connector. Only SMPP client connectors are used by MT routes."""
+    if not MirrorConnector.objects.filter(kind=kind, cid=cid).exists():
+        return None
+    return [r.data for r in MirrorRoute.objects.filter(
+        router='mt', connector_refs__type='smppc' if kind == 'smpp' else kind,
+        connector_refs__cid=cid).distinct()]
+
+
+def filter_routes(fid):
+    "MT and MO routes using the filter, None if there is no such filter"
+    if not MirrorFilter.objects.filter(fid=fid).exists():
+        return None
+    found = {'mt': [], 'mo': []}
+    for route in MirrorRoute.objects.filter(filter_refs__fid=fid).distinct():
+        found[route.router].append(route.data)
+    return {'mtrouters': found['mt'], 'morouters': found['mo']}
+
+
+#Dependencies between objects
+
+DEPENDENCY_TABLES = {
+    'group': ('users', 'filters', 'mtrouters', 'morouters'),
+    'smppcc': ('filters', 'mtrouters', 'morouters'),
+    'filter': ('mtrouters', 'morouters'),
+}
+
+
+def dependents(kind, key):
+    """Objects that refer to an object of kind group, smppcc or filter, by
+    key, directly or through a filter: users of a group, connector and
+    group filters matching it and the routes using those filters, and
+    routes sending to a connector"""
+    found = {'users': [], 'filters': [], 'mtrouters': [], 'morouters': []}
+    routes = MirrorRoute.objects.none()
+    if kind == 'group':
+        found['users'] = list(
+            MirrorUser.objects.filter(gid=key).values_list('uid', flat=True))
+        found['filters'] = list(MirrorFilter.objects.filter(
+            ref='gid=%s' % key).values_list('fid', flat=True))
+    elif kind == 'smppcc':
+        found['filters'] = list(MirrorFilter.objects.filter(
+            ref='cid=%s' % key).values_list('fid', flat=True))
+        routes = MirrorRoute.objects.filter(
+            connector_refs__type='smppc', connector_refs__cid=key)
+    elif kind == 'filter':
+        routes = MirrorRoute.objects.filter(filter_refs__fid=key)
+    else:
+        raise ValueError('Unknown kind: %s' % kind)
+    if found['filters']:
+        routes = routes | MirrorRoute.objects.filter(
+            filter_refs__fid__in=found['filters'])
+    for router, order in routes.distinct().values_list('router', 'order'):
+        found[ROUTER_TABLES[router]].append(str(order))
+    return found
+
+
+def _flag(request, name):
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def guard_delete(request, kind, key):
+    """Check nothing refers to the object before deleting it
+
+    Raises ObjectInUse, listing the dependents, unless ?force=true. With
+    ?preview=true returns a response listing them, and nothing should be
+    deleted. Returns None when the delete can go ahead. Only tables never
+    synced are read from jcli; DELETE_CHECKS = False skips the check.
+    """
+    preview = _flag(request, 'preview')
+    if not settings.DELETE_CHECKS or not enabled():
+        if preview:
+            raise JasminSyntaxError(
+                'preview requires the mirror and DELETE_CHECKS')
+        return None
+    missing = [t for t in DEPENDENCY_TABLES[kind] if synced_at(t) is None]
+    if missing:
+        refresh(request.telnet, missing)
+    found = dependents(kind, key)
+    if preview:
+        return JsonResponse({'dependents': found})
+    if any(found.values()) and not _flag(request, 'force'):
+        raise ObjectInUse({
+            'detail': '%s %s is in use, delete or change its dependents '
+                      'first, or add ?force=true' % (kind, key),
+            'dependents': found})
+    return None
+
+
+#Change log
+
+def objects(table):
+    "Every object of a mirrored table, as its list endpoint returns them"
+    if table == 'groups':
+        return groups()
+    if table == 'users':
+        return users()
+    if table == 'filters':
+        return filters()
+    for router, router_table in ROUTER_TABLES.items():
+        if table == router_table:
+            return routes(router)
+    for kind, connector_table in CONNECTOR_TABLES.items():
+        if table == connector_table:
+            return connectors(kind)
+    raise ValueError('Unknown mirror table: %s' % table)
+
+
+def _object(table, key):
+    if table == 'groups':
+        found = MirrorGroup.objects.filter(gid=key).first()
+        return {'name': found.gid, 'status': found.status} if found else None
+    if table == 'users':
+        found = MirrorUser.objects.filter(uid=key).first()
+        return dict(found.data, status=found.status) if found else None
+    if table == 'filters':
+        return filter(key)
+    for router, router_table in ROUTER_TABLES.items():
+        if table == router_table:
+            return route(router, key)
+    for kind, connector_table in CONNECTOR_TABLES.items():
+        if table == connector_table:
+            return connector(kind, key)
+
+
+def _snapshot(table, key=None):
+    "{key: object} for the whole table, or only key"
+    if key is None:
+        return {str(o[KEYS[table]]): o for o in objects(table)}
+    found = _object(table, key)
+    return {str(key): found} if found is not None else {}
+
+
+@contextlib.contextmanager
+def _tracking(table, key=None):
+    """Log the changes made to table, or to one of its objects, in the
+    with block"""
+    before = _snapshot(table, key)
+    yield
+    after = _snapshot(table, key)
+    changes = [MirrorChange(table=table, key=k, action='deleted')
+               for k in before if k not in after]
+    for k, obj in after.items():
+        if k not in before:
+            changes.append(MirrorChange(table=table, key=k, action='created'))
+        elif before[k] != obj:
+            changes.append(MirrorChange(table=table, key=k, action='updated'))
+    if changes:
+        MirrorChange.objects.bulk_create(changes)
+        current = version()
+        MirrorChange.objects.filter(
+            version__lte=current - settings.MIRROR_CHANGELOG_SIZE).delete()
+
+
+def version():
+    "Current configuration version, 0 before any change"
+    last = MirrorChange.objects.order_by('-version').first()
+    return last.version if last else 0
+
+
+def changes(table, since):
+    """Objects of table created, updated and deleted after version since.
+    Objects created and deleted again in between are left out."""
+    current = version()
+    if since == 0:
+        return {'version': current, 'created': objects(table),
+                'updated': [], 'deleted': []}
+    oldest = MirrorChange.objects.order_by('version').first()
+    if since > current or (oldest is not None and since < oldest.version - 1):
+        raise ChangesExpired(
+            'No changes kept since version %d, list again or use since=0'
+            % since)
+    first, last = {}, {}
+    for key, action in MirrorChange.objects.filter(
+            table=table, version__gt=since).order_by(
+            'version').values_list('key', 'action'):
+        first.setdefault(key, action)
+        last[key] = action
+    delta = {'version': current, 'created': [], 'updated': [], 'deleted': []}
+    for key, action in last.items():
+        if action == 'deleted':
+            if first[key] != 'created':
+                delta['deleted'].append({KEYS[table]: key})
+            continue
+        obj = _object(table, key)
+        if obj is None:
+            continue
+        delta['created' if first[key] == 'created' else 'updated'].append(obj)
+    return delta
+
+
+def fresh(request, *tables):
+    """Refresh the tables a mirror only request needs from jcli, when they
+    are stale or ?source=jcli is given"""
+    if not enabled():
+        raise JasminSyntaxError(
+            'This request requires the mirror, of the default backend')
+    stale = [t for t in tables if not use_mirror(request, t)]
+    if stale:
+        refresh(request.telnet, stale)
+
+
+def delta(request, table):
+    """Response to ?since=<version> on the list of table. The table is
+    refreshed from jcli first when it is stale."""
+    try:
+        since = int(request.query_params['since'])
+    except ValueError:
+        raise JasminSyntaxError(
+            'Invalid since: %s' % request.query_params['since'])
+    if since < 0:
+        raise JasminSyntaxError('Invalid since: %d' % since)
+    fresh(request, table)
+    return annotate(JsonResponse(changes(table, since)), table)
+
+
+#Refreshing from jcli
+
+def refresh(telnet, tables=TABLES):
+    """Refresh tables in full over an open jcli session. Filters are
+    refreshed before routes, which refer to them."""
+    #views import this module for their write hooks
+    from .views import (GroupViewSet, UserViewSet, FiltersViewSet,
+                        MTRouterViewSet, MORouterViewSet, SMPPCCMViewSet,
+                        HTTPCCMViewSet)
+    for table in TABLES:
+        if table not in tables:
+            continue
+        if table == 'groups':
+            replace_groups(GroupViewSet()._list(telnet))
+        elif table == 'users':
+            viewset = UserViewSet()
+            replace_users(list(viewset._details(telnet, viewset._list(telnet), None)))
+        elif table == 'filters':
+            replace_filters(FiltersViewSet()._list(telnet)['filters'])
+        elif table == 'mtrouters':
+            replace_routes('mt', MTRouterViewSet()._list(telnet)['mtrouters'])
+        elif table == 'morouters':
+            replace_routes('mo', MORouterViewSet()._list(telnet)['morouters'])
+        elif table == 'smppsconns':
+            replace_connectors('smpp', SMPPCCMViewSet()._list(telnet))
+        elif table == 'httpsconns':
+            replace_connectors('http', HTTPCCMViewSet()._list(telnet))
+
+
+def sync(tables=TABLES):
+    "Open a jcli session and refresh tables over it"
+    from .jcli import connect, disconnect
+    telnet = connect()
+    try:
+        refresh(telnet, tables)
+    finally:
+        disconnect(telnet)
+
+
+def start_sync_thread(interval, tables=TABLES, delay=0):
+    """Refresh the mirror every interval seconds in a daemon thread, the
+    first time after delay seconds"""
+    def run():
+        time.sleep(delay)
+        while True:
+            start = time.monotonic()
+            try:
+                sync(tables)
+            except Exception:
+                logger.exception('Mirror sync failed')
+            finally:
+                close_old_connections()
+            time.sleep(max(interval - (time.monotonic() - start), 0))
+
+    thread = threading.Thread(target=run, name='mirror-sync', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,123 @@
+"""Mirror of the Jasmin configuration, kept in sync by rest_api.mirror
+
+Each table keeps the objects as the list endpoints return them in data,
+plus indexed columns for the lookups done without jcli. position keeps the
+order jcli lists objects in.
+"""
+from django.db import models
+
+
+class MirrorState(models.Model):
+    "When a mirrored table was last refreshed in full from jcli"
+    table = models.CharField(max_length=32, primary_key=True)
+    synced_at = models.DateTimeField()
+
+
+class MirrorGroup(models.Model):
+    gid = models.CharField(max_length=64, primary_key=True)
+    status = models.CharField(max_length=16)
+    position = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['position']
+
+
+class MirrorUser(models.Model):
+    uid = models.CharField(max_length=64, primary_key=True)
+    gid = models.CharField(max_length=64, db_index=True)
+    username = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=16)
+    position = models.IntegerField(default=0)
+    data = models.JSONField()
+
+    class Meta:
+        ordering = ['position']
+
+
+class MirrorFilter(models.Model):
+    """ref is the object a connector, user or group filter matches, as
+    cid=..., uid=... or gid=..., empty for other filters"""
+    fid = models.CharField(max_length=64, primary_key=True)
+    type = models.CharField(max_length=32)
+    description = models.CharField(max_length=255, db_index=True)
+    ref = models.CharField(max_length=128, db_index=True, default='')
+    position = models.IntegerField(default=0)
+    data = models.JSONField()
+
+    class Meta:
+        ordering = ['position']
+
+
+class MirrorRoute(models.Model):
+    "An MT or MO route, router is 'mt' or 'mo'"
+    router = models.CharField(max_length=2)
+    order = models.IntegerField()
+    type = models.CharField(max_length=32)
+    data = models.JSONField()
+
+    class Meta:
+        ordering = ['router', '-order']
+        unique_together = [('router', 'order')]
+
+
+class MirrorRouteConnector(models.Model):
+    "A connector a route sends to, type is smppc, http or smpps"
+    route = models.ForeignKey(
+        MirrorRoute, on_delete=models.CASCADE, related_name='connector_refs')
+    type = models.CharField(max_length=8, default='')
+    cid = models.CharField(max_length=64, db_index=True)
+
+
+class MirrorRouteFilter(models.Model):
+    """A filter of a route. Routes are listed with filter descriptions, fid
+    is the filter with that description, None if there is none"""
+    route = models.ForeignKey(
+        MirrorRoute, on_delete=models.CASCADE, related_name='filter_refs')
+    description = models.CharField(max_length=255)
+    fid = models.CharField(max_length=64, null=True, db_index=True)
+
+
+class MirrorConnector(models.Model):
+    "An SMPP or HTTP client connector, kind is 'smpp' or 'http'"
+    kind = models.CharField(max_length=4)
+    cid = models.CharField(max_length=64)
+    position = models.IntegerField(default=0)
+    data = models.JSONField()
+
+    class Meta:
+        ordering = ['kind', 'position']
+        unique_together = [('kind', 'cid')]
+
+
+class MirrorChange(models.Model):
+    """An object created, updated or deleted in a mirrored table. version
+    only increases, the highest is the current configuration version"""
+    version = models.AutoField(primary_key=True)
+    table = models.CharField(max_length=32)
+    key = models.CharField(max_length=64)
+    action = models.CharField(max_length=8)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['table', 'version'])]
+
+
+class StatsSample(models.Model):
+    """The stats of a user or SMPP client connector, kind 'user' or 'smppc',
+    sampled at time (a timestamp) by rest_api.stats. values holds the
+    numeric series, info the other values"""
+    kind = models.CharField(max_length=8)
+    oid = models.CharField(max_length=64)
+    time = models.FloatField(db_index=True)
+    values = models.JSONField()
+    info = models.JSONField()
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'oid', 'time'])]
+
+
+class ProbeResult(models.Model):
+    "The last probe of an HTTP client connector base URL, see rest_api.probe"
+    url = models.CharField(max_length=512, primary_key=True)
+    checked_at = models.FloatField()
+    result = models.JSONField()
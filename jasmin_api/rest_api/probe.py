@@ -0,0 +1,139 @@
+"""Reachability of HTTP client connector base URLs
+
+probe() checks URLs concurrently on an asyncio event loop: each is sent a
+HEAD request, and is reachable when anything answering HTTP is there,
+whatever the status. Each host has its own timeout (PROBE_TIMEOUTS, else
+PROBE_TIMEOUT), so checking many URLs takes about one timeout window.
+Results are kept in the database, and reused for PROBE_TTL seconds, by
+every process. The first worker of run_cherrypy.py probes every connector
+every PROBE_INTERVAL seconds in the background.
+"""
+import asyncio
+import logging
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import ProbeResult
+
+logger = logging.getLogger(__name__)
+
+
+def timeout_for(host):
+    return settings.PROBE_TIMEOUTS.get(host, settings.PROBE_TIMEOUT)
+
+
+async def _status_line(parts, port, secure):
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port,
+        ssl=ssl.create_default_context() if secure else None)
+    try:
+        writer.write((
+            'HEAD %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n' % (
+                parts.path or '/', parts.netloc)).encode('latin-1'))
+        await writer.drain()
+        return await reader.readline()
+    finally:
+        writer.close()
+
+
+async def probe_url(url):
+    """Result of probing url: reachable, HTTP status, latency in ms, error
+    and when it was checked"""
+    started = time.monotonic()
+    result = {'reachable': False, 'status': None, 'latency_ms': None,
+              'error': None, 'checked_at': time.time()}
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        result['error'] = 'Invalid URL'
+        return result
+    secure = parts.scheme == 'https'
+    try:
+        line = await asyncio.wait_for(
+            _status_line(parts, parts.port or (443 if secure else 80), secure),
+            timeout_for(parts.hostname))
+        fields = line.decode('latin-1').split()
+        if len(fields) < 2 or not fields[0].startswith('HTTP/'):
+            result['error'] = 'Not an HTTP server'
+        else:
+            result['reachable'] = True
+            result['status'] = int(fields[1])
+    except asyncio.TimeoutError:
+        result['error'] = 'Timed out'
+    except (OSError, ValueError) as e:
+        result['error'] = str(e) or e.__class__.__name__
+    result['latency_ms'] = (time.monotonic() - started) * 1000
+    return result
+
+
+async def probe_all(urls):
+    "{url: result} for urls, PROBE_CONCURRENCY of them probed at once"
+    urls = list(urls)
+    limit = asyncio.Semaphore(settings.PROBE_CONCURRENCY)
+
+    async def bounded(url):
+        async with limit:
+            return await probe_url(url)
+
+    results = await asyncio.gather(*(bounded(u) for u in urls))
+    return dict(zip(urls, results))
+
+
+def probe(urls, refresh=False):
+    """{url: result} for urls, probing those not checked in the last
+    PROBE_TTL seconds, or all of them when refresh is set"""
+    urls = set(urls)
+    cached = {}
+    if not refresh:
+        cached = dict(ProbeResult.objects.filter(
+            url__in=urls, checked_at__gt=time.time() - settings.PROBE_TTL
+        ).values_list('url', 'result'))
+    stale = urls - set(cached)
+    if stale:
+        probed = asyncio.run(probe_all(stale))
+        with transaction.atomic():
+            ProbeResult.objects.filter(url__in=probed).delete()
+            ProbeResult.objects.bulk_create([
+                ProbeResult(url=url, checked_at=result['checked_at'],
+                            result=result)
+                for url, result in probed.items()])
+        cached.update(probed)
+    return cached
+
+
+def connectors():
+    "HTTP client connectors, from the mirror when it is enabled"
+    from . import mirror
+    if mirror.enabled() and mirror.synced_at('httpsconns') is not None:
+        return mirror.connectors('http')
+    from .jcli import connect, disconnect
+    from .views import HTTPCCMViewSet
+    telnet = connect()
+    try:
+        return HTTPCCMViewSet()._list(telnet)
+    finally:
+        disconnect(telnet)
+
+
+def start_prober(interval):
+    "Probe every connector every interval seconds in a daemon thread"
+    def run():
+        while True:
+            start = time.monotonic()
+            try:
+                urls = [c['url'] for c in connectors() if c.get('url')]
+                probe(urls, refresh=True)
+                ProbeResult.objects.exclude(url__in=urls).delete()
+            except Exception:
+                logger.exception('Probing HTTP connectors failed')
+            finally:
+                close_old_connections()
+            time.sleep(max(interval - (time.monotonic() - start), 0))
+
+    thread = threading.Thread(target=run, name='httpcc-prober', daemon=True)
+    thread.start()
+    return thread
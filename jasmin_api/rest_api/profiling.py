@@ -0,0 +1,71 @@
+"""Bounded on-disk ring of cProfile dumps taken by ProfilingMiddleware"""
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+NAME_RE = re.compile(r'^[0-9]+-[0-9]+-[A-Z]+-[\w.-]*\.prof$')
+
+_lock = threading.Lock()
+_counter = 0
+
+
+def profile_dir():
+    return settings.PROFILE_DIR
+
+
+def _slug(path):
+    return re.sub(r'[^\w.-]+', '_', path.strip('/'))[:80]
+
+
+def save(profile, method, path):
+    """Dump a finished cProfile.Profile and drop the oldest dumps beyond
+    PROFILE_RING_SIZE. Returns the name of the new dump."""
+    global _counter
+    directory = profile_dir()
+    with _lock:
+        _counter += 1
+        name = '%d-%d-%s-%s.prof' % (
+            int(time.time() * 1000), _counter, method.upper(), _slug(path))
+        os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(os.path.join(directory, name))
+        for old in list_profiles()[settings.PROFILE_RING_SIZE:]:
+            try:
+                os.remove(os.path.join(directory, old['name']))
+            except FileNotFoundError:
+                pass
+    return name
+
+
+def list_profiles():
+    "Stored dumps, newest first"
+    try:
+        names = [n for n in os.listdir(profile_dir()) if NAME_RE.match(n)]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        created, counter, method, slug = name[:-len('.prof')].split('-', 3)
+        try:
+            size = os.path.getsize(os.path.join(profile_dir(), name))
+        except FileNotFoundError:
+            continue
+        profiles.append(((int(created), int(counter)), {
+            'name': name,
+            'created': int(created) / 1000.0,
+            'method': method,
+            'path': '/' + slug,
+            'size': size,
+        }))
+    profiles.sort(key=lambda p: p[0], reverse=True)
+    return [p for _, p in profiles]
+
+
+def profile_path(name):
+    "Full path of a stored dump, None if name is not a valid existing dump"
+    if not NAME_RE.match(name):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
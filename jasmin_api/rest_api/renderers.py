@@ -0,0 +1,21 @@
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from .tools import orjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with orjson when FAST_JSON is set and it is
+    installed. Indented output and types orjson does not know fall back to
+    the standard renderer."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or not settings.FAST_JSON or
+                self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,234 @@
+"""Recording jcli sessions to transcripts and replaying them
+
+A transcript holds everything sent to and received from jcli during one API
+request, in order, plus the request and the response it produced. With
+JCLI_RECORD_DIR set every session is written to that directory. With
+TELNET_TRANSPORT = 'replay' the session in JCLI_REPLAY_FILE is served back
+by ReplaySpawn instead of talking to jcli, deterministically and with no
+network, which is what the regression tests and parser benchmarks use.
+
+Transcripts never hold credentials: the login password, the value of every
+password key sent to or shown by jcli, and password-like fields of the
+request and response JSON are all replaced by REDACTED when saved.
+ReplaySpawn matches a redacted send whatever value is sent in its place.
+"""
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from pexpect import EOF, TIMEOUT
+from pexpect.spawnbase import SpawnBase
+
+TRANSCRIPT_VERSION = 1
+REDACTED = '<redacted>'
+
+#jcli lines setting or showing a password, as sent, echoed and listed
+PASSWORD_LINE_RE = re.compile(r'(^|\n)(password) [^\r\n]*')
+#request and response fields holding credentials
+SECRET_KEY_RE = re.compile(r'password|secret', re.IGNORECASE)
+
+_lock = threading.Lock()
+_counter = 0
+
+
+def redact_text(data):
+    "data sent to or received from jcli without password values"
+    return PASSWORD_LINE_RE.sub(r'\1\2 ' + REDACTED, data)
+
+
+def redact_json(value):
+    "value with the values of password-like keys replaced, at any depth"
+    if isinstance(value, dict):
+        return {k: REDACTED if (SECRET_KEY_RE.search(str(k))
+                                and not isinstance(v, (dict, list)))
+                else redact_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_json(v) for v in value]
+    return value
+
+
+class TranscriptMismatch(AssertionError):
+    "Replayed session sent something other than what was recorded"
+
+
+class _Log:
+    "File-like target for pexpect's logfile_read and logfile_send"
+
+    def __init__(self, callback):
+        self.write = callback
+
+    def flush(self):
+        pass
+
+
+class TranscriptRecorder:
+    "Collects send and recv events from a pexpect spawn"
+
+    def __init__(self):
+        self.events = []
+        self._redact_next = False
+        self.read_log = _Log(self.received)
+        self.send_log = _Log(self.sent)
+
+    def _append(self, kind, data):
+        if self.events and self.events[-1][0] == kind and kind == 'recv':
+            self.events[-1][1] += data
+        else:
+            self.events.append([kind, data])
+
+    def received(self, data):
+        self._append('recv', data)
+
+    def sent(self, data):
+        if self._redact_next:
+            self._redact_next = False
+            data = REDACTED + '\n'
+        self._append('send', data)
+
+    def redact_next_send(self):
+        "Do not store the next line sent, used for the password"
+        self._redact_next = True
+
+    def save(self, directory, request=None, response=None):
+        "Write the transcript to a new file in directory, returns its path"
+        global _counter
+        with _lock:
+            _counter += 1
+            name = '%d-%d-%d.json' % (int(time.time() * 1000), os.getpid(), _counter)
+        transcript = {'version': TRANSCRIPT_VERSION, 'events': [
+            [kind, redact_text(data)] for kind, data in self.events]}
+        if request is not None:
+            transcript['request'] = request
+        if response is not None:
+            transcript['response'] = response
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            json.dump(transcript, f, indent=1)
+        return path
+
+
+def load(path):
+    with open(path) as f:
+        transcript = json.load(f)
+    if transcript.get('version') != TRANSCRIPT_VERSION:
+        raise ValueError('Unsupported transcript version in %s' % path)
+    return transcript
+
+
+def _normalise(data):
+    return data.replace('\r\n', '\n')
+
+
+class ReplaySpawn(SpawnBase):
+    """pexpect spawn serving a recorded session
+
+    Received data up to the next recorded send is available at once. When
+    the session expects more than was recorded, expect raises TIMEOUT
+    straight away rather than waiting, and EOF once the transcript is used
+    up. With strict (the default) each line sent must match the recording.
+
+    chunk limits how much each read returns; by default a whole recorded
+    reply is returned in one read.
+    """
+
+    def __init__(self, events, timeout=10, chunk=None, encoding='utf-8',
+                 strict=True):
+        super().__init__(timeout=timeout, maxread=chunk or 2 ** 31,
+                         encoding=encoding)
+        self.events = [tuple(e) for e in events]
+        self.strict = strict
+        self.closed = False
+        self.child_fd = -1
+        self._position = 0
+        self._available = []
+        self._release()
+
+    def _release(self):
+        "Make received data available up to the next recorded send"
+        while (self._position < len(self.events) and
+               self.events[self._position][0] == 'recv'):
+            self._available.append(self.events[self._position][1])
+            self._position += 1
+
+    def send(self, s):
+        s = self._coerce_send_string(s)
+        self._log(s, 'send')
+        if self._position >= len(self.events):
+            if self.strict:
+                raise TranscriptMismatch('Sent %r after the end of the transcript' % s)
+            return len(s)
+        recorded = self.events[self._position][1]
+        if (self.strict and recorded != REDACTED + '\n' and
+                _normalise(recorded) != _normalise(redact_text(s))):
+            raise TranscriptMismatch('Sent %r, transcript has %r' % (s, recorded))
+        self._position += 1
+        self._release()
+        return len(s)
+
+    def sendline(self, s=''):
+        return self.send(s + self.linesep)
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        if not self._available:
+            if self._position >= len(self.events):
+                self.flag_eof = True
+                raise EOF('End of transcript')
+            raise TIMEOUT('Nothing more recorded before the next send')
+        data = self._available[0]
+        if len(data) > size:
+            self._available[0] = data[size:]
+            data = data[:size]
+        else:
+            self._available.pop(0)
+        self._log(data, 'read')
+        return data
+
+    def isalive(self):
+        return not self.closed
+
+    def close(self, force=True):
+        self.closed = True
+
+    def kill(self, sig):
+        self.closed = True
+
+
+def _redact_body(body, content_type):
+    "A JSON or form request body without password-like fields"
+    if content_type.startswith('application/json'):
+        try:
+            return json.dumps(redact_json(json.loads(body)), separators=(',', ':'))
+        except ValueError:
+            return body
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        return urlencode([
+            (k, REDACTED if SECRET_KEY_RE.search(k) else v)
+            for k, v in parse_qsl(body, keep_blank_values=True)])
+    return body
+
+
+def describe_request(request):
+    "What the regression tests need to re-issue a recorded API request"
+    content_type = request.META.get('CONTENT_TYPE', '')
+    return {
+        'method': request.method,
+        'path': request.path,
+        'query': request.META.get('QUERY_STRING', ''),
+        'content_type': content_type,
+        'body': _redact_body(
+            request.body.decode('utf-8', 'replace'), content_type),
+    }
+
+
+def describe_response(response):
+    described = {'status': response.status_code}
+    if not response.streaming:
+        try:
+            described['json'] = redact_json(json.loads(response.content))
+        except ValueError:
+            described['body'] = response.content.decode('utf-8', 'replace')
+    return described
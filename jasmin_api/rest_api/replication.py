@@ -0,0 +1,350 @@
+"""Replication of users, groups, filters and routes from a primary Jasmin
+backend to standbys
+
+snapshot() reads a backend's configuration through the viewsets' list and
+detail parsers. plan() diffs a standby's snapshot against the primary's and
+returns the fewest jcli operations that make them equal: objects missing
+on the standby are added (-a), changed users updated (-u) and objects only
+the standby has removed (-r). Filters and routes can not be updated in
+jcli, a changed one is removed and added again. replicate() plans every
+standby in parallel and, unless dry_run is set, applies each plan over one
+jcli session, ending with a single persist.
+
+jcli never shows passwords: users missing on a standby are only added when
+their password is given.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+
+from . import backends, mirror
+from .exceptions import JasminError, JasminSyntaxError
+from .tools import set_ikeys
+
+STANDARD_PROMPT = settings.STANDARD_PROMPT
+INTERACTIVE_PROMPT = settings.INTERACTIVE_PROMPT
+
+TABLES = ('groups', 'users', 'filters', 'mtrouters', 'morouters')
+#filter -s key of the parameter of each filter type, None for no parameter
+FILTER_KEYS = {
+    'transparentfilter': None, 'connectorfilter': 'cid', 'userfilter': 'uid',
+    'groupfilter': 'gid', 'sourceaddrfilter': 'source_addr',
+    'destinationaddrfilter': 'destination_addr',
+    'shortmessagefilter': 'short_message', 'dateintervalfilter': 'dateInterval',
+    'timeintervalfilter': 'timeInterval', 'tagfilter': 'tag',
+    'evalpyfilter': 'pyCode',
+}
+#Operations are applied in this order: routes and filters are removed
+#before what they refer to changes, and added back last
+STEPS = (
+    ('mtrouter', '-r'), ('morouter', '-r'), ('filter', '-r'), ('user', '-r'),
+    ('group', '-a'), ('group', '-e'), ('group', '-d'),
+    ('user', '-a'), ('user', '-u'), ('user', '-e'), ('user', '-d'),
+    ('group', '-r'), ('filter', '-a'), ('mtrouter', '-a'), ('morouter', '-a'),
+)
+#changed tables to refresh in the mirror after applying, by module
+MODULE_TABLES = {'group': 'groups', 'user': 'users', 'filter': 'filters',
+                 'mtrouter': 'mtrouters', 'morouter': 'morouters'}
+
+
+def _credentials(user):
+    "user -s credentials, nested three deep, as {(section, kind, key): value}"
+    return {(s, k, n): v
+            for s, kinds in user.items() if isinstance(kinds, dict)
+            for k, keys in kinds.items() if isinstance(keys, dict)
+            for n, v in keys.items()}
+
+
+def _route(route, rate):
+    values = {'type': route['type'], 'connectors': tuple(route['connectors']),
+              'filters': tuple(route['filters'])}
+    if rate:
+        values['rate'] = route['rate'].strip()
+    return values
+
+
+def snapshot(telnet, tables=TABLES):
+    "Configuration of the backend telnet is connected to, keyed by table"
+    from .views import (GroupViewSet, UserViewSet, FiltersViewSet,
+                        MTRouterViewSet, MORouterViewSet)
+    result = {}
+    if 'groups' in tables:
+        result['groups'] = {
+            g['name']: g['status'] for g in GroupViewSet()._list(telnet)}
+    if 'users' in tables:
+        viewset = UserViewSet()
+        result['users'] = {
+            u['uid']: {'gid': u['gid'], 'username': u['username'],
+                       'status': u['status'], 'credentials': _credentials(u)}
+            for u in viewset._details(telnet, viewset._list(telnet), None)}
+    if 'filters' in tables:
+        result['filters'] = {
+            f['fid']: {'type': f['type'], 'description': f['description']}
+            for f in FiltersViewSet()._list(telnet)['filters']}
+    if 'mtrouters' in tables:
+        result['mtrouters'] = {
+            r['order']: _route(r, True)
+            for r in MTRouterViewSet()._list(telnet)['mtrouters']}
+    if 'morouters' in tables:
+        result['morouters'] = {
+            r['order']: _route(r, False)
+            for r in MORouterViewSet()._list(telnet)['morouters']}
+    return result
+
+
+def filter_parameter(telnet, fid):
+    "The parameter a filter was added with, from filter -s"
+    telnet.sendline('filter -s %s' % fid)
+    telnet.expect(r'\n' + STANDARD_PROMPT)
+    for line in telnet.before.replace('\r', '').split('\n')[1:]:
+        key, sep, value = line.partition(' = ')
+        if sep:
+            return value.strip()
+    return None
+
+
+def _op(module, action, oid, keys=None):
+    operation = {'module': module, 'action': action, 'id': oid,
+                 'command': '%s %s' % (module, action)}
+    if action != '-a':
+        operation['command'] += ' %s' % oid
+    if keys is not None:
+        operation['keys'] = keys
+    return operation
+
+
+def _route_keys(kind, order, route, fids):
+    keys = OrderedDict({'type': route['type'].lower()})
+    if route['type'].lower() != 'defaultroute':
+        keys['filters'] = ';'.join(fids[f] for f in route['filters'])
+        keys['order'] = order
+    if len(route['connectors']) > 1:
+        keys['connectors'] = ';'.join(route['connectors'])
+    else:
+        keys['connector'] = route['connectors'][0]
+    if kind == 'mtrouter':
+        keys['rate'] = route['rate']
+    return keys
+
+
+def plan(primary, standby, passwords=None, parameters=None, tables=TABLES):
+    """(operations, skipped) making the tables of standby, a snapshot, equal
+    to those of primary. parameters maps fids to the parameters of the
+    primary's filters, needed for those to add; skipped lists what can not
+    be replicated and why. Snapshots need filters to replicate routes"""
+    passwords = passwords or {}
+    parameters = parameters or {}
+    ops, skipped = [], []
+
+    if 'groups' in tables:
+        mine, theirs = primary['groups'], standby['groups']
+        for gid in sorted(set(mine) - set(theirs)):
+            ops.append(_op('group', '-a', gid, OrderedDict({'gid': gid})))
+        for gid in sorted(set(theirs) - set(mine)):
+            ops.append(_op('group', '-r', gid))
+        for gid in sorted(mine):
+            #a new group is enabled
+            if mine[gid] != theirs.get(gid, 'enabled'):
+                ops.append(_op('group', '-e' if mine[gid] == 'enabled' else '-d', gid))
+
+    if 'users' in tables:
+        mine, theirs = primary['users'], standby['users']
+        for uid in sorted(set(theirs) - set(mine)):
+            ops.append(_op('user', '-r', uid))
+        for uid in sorted(mine):
+            user, other = mine[uid], theirs.get(uid)
+            if other is None:
+                if uid not in passwords:
+                    skipped.append({'module': 'user', 'id': uid,
+                                    'reason': 'Password not given'})
+                    continue
+                ops.append(_op('user', '-a', uid, OrderedDict([
+                    ('uid', uid), ('gid', user['gid']),
+                    ('username', user['username']),
+                    ('password', passwords[uid])])))
+                other = {'gid': user['gid'], 'username': user['username'],
+                         'status': 'enabled', 'credentials': {}}
+            keys = OrderedDict(
+                (k, user[k]) for k in ('gid', 'username') if user[k] != other[k])
+            for key, value in sorted(user['credentials'].items()):
+                if other['credentials'].get(key) != value:
+                    keys[' '.join(key)] = value
+            if keys:
+                ops.append(_op('user', '-u', uid, keys))
+                if uid not in theirs:
+                    #credentials left as the standby's defaults are skipped
+                    ops[-1]['new'] = True
+            if user['status'] != other['status']:
+                ops.append(_op(
+                    'user', '-e' if user['status'] == 'enabled' else '-d', uid))
+
+    fids = {}
+    if 'filters' in tables:
+        mine, theirs = primary['filters'], standby['filters']
+        for fid, flt in sorted(mine.items()):
+            fids.setdefault(flt['description'], fid)
+        for fid in sorted(set(theirs) - set(mine)):
+            ops.append(_op('filter', '-r', fid))
+        for fid in sorted(mine):
+            if theirs.get(fid) == mine[fid]:
+                continue
+            ftype = mine[fid]['type'].lower()
+            if ftype not in FILTER_KEYS or (
+                    FILTER_KEYS[ftype] and parameters.get(fid) is None):
+                skipped.append({'module': 'filter', 'id': fid,
+                                'reason': 'Unknown filter type or parameter'})
+                continue
+            if fid in theirs:
+                ops.append(_op('filter', '-r', fid))
+            keys = OrderedDict([('type', ftype), ('fid', fid)])
+            if FILTER_KEYS[ftype]:
+                keys[FILTER_KEYS[ftype]] = parameters[fid]
+            ops.append(_op('filter', '-a', fid, keys))
+    else:
+        fids = {f['description']: fid
+                for fid, f in standby.get('filters', {}).items()}
+
+    for kind, table in (('mtrouter', 'mtrouters'), ('morouter', 'morouters')):
+        if table not in tables:
+            continue
+        mine, theirs = primary[table], standby[table]
+        for order in sorted(set(theirs) - set(mine), key=int):
+            ops.append(_op(kind, '-r', order))
+        for order in sorted(mine, key=int):
+            if theirs.get(order) == mine[order]:
+                continue
+            unknown = [f for f in mine[order]['filters'] if f not in fids]
+            if unknown:
+                skipped.append({'module': kind, 'id': order,
+                                'reason': 'Unknown filter: %s' % unknown[0]})
+                continue
+            if order in theirs:
+                ops.append(_op(kind, '-r', order))
+            ops.append(_op(kind, '-a', order,
+                           _route_keys(kind, order, mine[order], fids)))
+
+    steps = {step: i for i, step in enumerate(STEPS)}
+    ops.sort(key=lambda o: steps[(o['module'], o['action'])])
+    return ops, skipped
+
+
+def _interactive(telnet, operation):
+    "Run an add or update, in interactive mode, left with ko on errors"
+    telnet.sendline(operation['command'])
+    matched_index = telnet.expect([
+        r'(?:Adding a new|Updating) .+\n' + INTERACTIVE_PROMPT,
+        r'\n' + STANDARD_PROMPT,
+    ])
+    if matched_index == 1:
+        raise JasminError(' '.join(telnet.before.split('\n', 1)[-1].split()))
+    try:
+        set_ikeys(telnet, operation['keys'])
+    except APIException:
+        telnet.sendline('ko')
+        telnet.expect(r'.*' + STANDARD_PROMPT)
+        raise
+    result = telnet.before + telnet.after
+    if 'Successfully' not in result:
+        raise JasminError(' '.join(result.replace(STANDARD_PROMPT, '').split()))
+
+
+def _simple(telnet, operation):
+    telnet.sendline(operation['command'])
+    telnet.expect(r'\n' + STANDARD_PROMPT)
+    result = telnet.before.split('\n', 1)[-1]
+    if 'Successfully' not in result:
+        raise JasminError(' '.join(result.split()))
+
+
+def _new_user_keys(telnet, operation):
+    "Keys of the update of a user just added that differ from its defaults"
+    from .views import UserViewSet
+    user = UserViewSet().get_user(telnet, operation['id'])
+    current = {' '.join(k): v for k, v in _credentials(user).items()}
+    current.update(gid=user.get('gid'), username=user.get('username'))
+    return OrderedDict(
+        (k, v) for k, v in operation['keys'].items() if current.get(k) != v)
+
+
+def apply(telnet, operations):
+    """Run operations, then persist once. Returns the errors, one per
+    operation that failed; the others are applied and persisted anyway"""
+    errors = []
+    for operation in operations:
+        try:
+            if operation.get('new'):
+                operation = dict(operation, keys=_new_user_keys(telnet, operation))
+                if not operation['keys']:
+                    continue
+            if 'keys' in operation:
+                _interactive(telnet, operation)
+            else:
+                _simple(telnet, operation)
+        except APIException as e:
+            errors.append({'command': operation['command'], 'detail': str(e.detail)})
+    if len(errors) < len(operations):
+        telnet.sendline('persist')
+        telnet.expect(r'\n' + STANDARD_PROMPT)
+    return errors
+
+
+def _report(operation):
+    "An operation as reported, without the password of users to add"
+    operation = {k: v for k, v in operation.items() if k != 'new'}
+    if operation['module'] == 'user' and 'password' in operation.get('keys', {}):
+        operation['keys'] = dict(operation['keys'], password='***')
+    return operation
+
+
+def replicate(primary=None, standbys=None, dry_run=False, passwords=None,
+              tables=TABLES):
+    """Replicate tables of primary (DEFAULT_BACKEND by default) to standbys
+    (all other backends by default). Returns a report per standby: its
+    operations, what was skipped and, unless dry_run, the errors"""
+    primary = primary or settings.DEFAULT_BACKEND
+    names = set(backends.registry())
+    standbys = sorted(standbys if standbys is not None else names - {primary})
+    for name in [primary] + standbys:
+        backends.get(name)
+    if primary in standbys:
+        raise JasminSyntaxError('The primary can not be a standby')
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise JasminSyntaxError('Unknown tables: %s' % ', '.join(sorted(unknown)))
+
+    read = set(tables)
+    if read & {'mtrouters', 'morouters'}:
+        read.add('filters')
+
+    def read_primary(telnet):
+        source = snapshot(telnet, read)
+        parameters = {
+            fid: filter_parameter(telnet, fid)
+            for fid, f in source.get('filters', {}).items()
+            if 'filters' in tables and FILTER_KEYS.get(f['type'].lower())}
+        return source, parameters
+
+    source, parameters = backends.run(backends.get(primary), read_primary)
+
+    def replicate_to(telnet):
+        operations, skipped = plan(
+            source, snapshot(telnet, read), passwords, parameters, tables)
+        report = {'operations': [_report(o) for o in operations],
+                  'skipped': skipped, 'errors': []}
+        if not dry_run:
+            report['errors'] = apply(telnet, operations)
+            if operations and mirror.enabled():
+                mirror.refresh(telnet, {
+                    MODULE_TABLES[o['module']] for o in operations})
+        return report
+
+    results, errors = backends.fan_out(replicate_to, standbys)
+    return {
+        'primary': primary, 'dry_run': dry_run,
+        'standbys': [
+            dict({'backend': name}, **results[name]) if name in results
+            else {'backend': name, 'operations': [], 'skipped': [],
+                  'errors': [{'command': None, 'detail': errors[name]}]}
+            for name in standbys],
+    }
@@ -0,0 +1,530 @@
+"""Local simulation of Jasmin MT and MO routing
+
+Router compiles a routing table, as the MT or MO router list returns it, and
+the filters it uses into plain Python predicates. route() then picks the
+route Jasmin would: the highest order route whose filters all match.
+
+Filters are known by their description, which is how routes list them. A
+filter that can not be evaluated here (EvalPyFilter, or a filter not making
+sense for the router, such as a ConnectorFilter on MT) never matches; routes
+skipped because of one are reported as undetermined.
+"""
+import codecs
+import csv
+import itertools
+import json
+import re
+from datetime import date, datetime, time
+
+from django.utils.dateparse import parse_datetime
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+
+from . import mirror
+from .exceptions import JasminSyntaxError
+from .tools import orjson
+
+DESCRIPTION_RE = re.compile(r'^<(\w+)(?: \((.*)\))?>$')
+DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})\D+(\d{4}-\d{2}-\d{2})')
+TIME_RE = re.compile(r'(\d{2}:\d{2}(?::\d{2})?)\D+(\d{2}:\d{2}(?::\d{2})?)')
+
+#filter description code to filter type
+FILTER_CODES = {
+    'T': 'TransparentFilter', 'C': 'ConnectorFilter', 'U': 'UserFilter',
+    'G': 'GroupFilter', 'SA': 'SourceAddrFilter',
+    'DA': 'DestinationAddrFilter', 'SM': 'ShortMessageFilter',
+    'DI': 'DateIntervalFilter', 'TI': 'TimeIntervalFilter', 'TG': 'TagFilter',
+    'Ev': 'EvalPyFilter',
+}
+
+#filter types each router can evaluate
+ROUTER_FILTERS = {
+    'mt': {'TransparentFilter', 'UserFilter', 'GroupFilter',
+           'SourceAddrFilter', 'DestinationAddrFilter', 'ShortMessageFilter',
+           'DateIntervalFilter', 'TimeIntervalFilter', 'TagFilter'},
+    'mo': {'TransparentFilter', 'ConnectorFilter', 'SourceAddrFilter',
+           'DestinationAddrFilter', 'ShortMessageFilter',
+           'DateIntervalFilter', 'TimeIntervalFilter', 'TagFilter'},
+}
+
+#OpenAPI description of the dry run parameters and request body
+DRY_RUN_PARAMETERS = [
+    OpenApiParameter(
+        name='rows', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY,
+        description='false to answer with the summary only, as JSON'),
+]
+DRY_RUN_REQUEST = {'text/csv': OpenApiTypes.STR,
+                   'application/x-ndjson': OpenApiTypes.STR}
+
+MESSAGE_FIELDS = ('uid', 'gid', 'connector', 'source_addr', 'destination_addr',
+                  'content', 'tags', 'time')
+#Message fields given as strings, numbers being taken for their digits
+TEXT_FIELDS = ('uid', 'gid', 'connector', 'source_addr', 'destination_addr',
+               'content')
+
+
+class Message:
+    """A message to route. connector is the connector an MO message came
+    in from; time defaults to now. Jasmin matches date and time filters
+    against its local time, taken to be that of this process (TIME_ZONE):
+    a time with a UTC offset is converted to it"""
+    __slots__ = MESSAGE_FIELDS
+
+    def __init__(self, uid=None, gid=None, connector=None, source_addr='',
+                 destination_addr='', content='', tags=(), time=None):
+        self.uid = uid
+        self.gid = gid
+        self.connector = connector
+        self.source_addr = source_addr or ''
+        self.destination_addr = destination_addr or ''
+        self.content = content or ''
+        self.tags = frozenset(str(t) for t in tags or ())
+        time = time or datetime.now()
+        if time.tzinfo:
+            time = time.astimezone().replace(tzinfo=None)
+        self.time = time
+
+    @classmethod
+    def from_data(cls, data):
+        "Message from request data, with time as ISO 8601 and tags as a list"
+        if hasattr(data, 'dict'):
+            #form data
+            data = data.dict()
+        if not isinstance(data, dict):
+            raise JasminSyntaxError('Invalid message: %s' % str(data)[:80])
+        unknown = set(data) - set(MESSAGE_FIELDS)
+        if unknown:
+            raise JasminSyntaxError(
+                'Unknown message fields: %s' % ', '.join(sorted(unknown)))
+        fields = dict(data)
+        for field in TEXT_FIELDS:
+            value = fields.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                fields[field] = str(value)
+            elif value is not None and not isinstance(value, str):
+                raise JasminSyntaxError('Invalid %s: %s' % (field, value))
+        if fields.get('time') and not isinstance(fields['time'], datetime):
+            parsed = parse_datetime(str(fields['time']))
+            if parsed is None:
+                raise JasminSyntaxError('Invalid time: %s' % fields['time'])
+            fields['time'] = parsed
+        tags = fields.get('tags')
+        if isinstance(tags, (str, int)):
+            fields['tags'] = str(tags).split(',')
+        elif tags is not None and not isinstance(tags, list):
+            raise JasminSyntaxError('Invalid tags: %s' % (tags,))
+        return cls(**fields)
+
+
+#filters matching a Message field equal to their value
+EQ_FIELDS = {'ConnectorFilter': 'connector', 'UserFilter': 'uid',
+             'GroupFilter': 'gid'}
+#filters matching a Message field with their regex
+REGEX_FIELDS = {'SourceAddrFilter': 'source_addr',
+                'DestinationAddrFilter': 'destination_addr',
+                'ShortMessageFilter': 'content'}
+
+
+def _regex(pattern):
+    try:
+        match = re.compile(pattern).match
+    except re.error:
+        return None
+    return lambda value: match(value) is not None
+
+
+def _key_test(kind, field, value):
+    "(field, test) for an index_key"
+    if kind == 'eq':
+        return field, lambda v: v == value
+    if kind == 'member':
+        return field, lambda tags: value in tags
+    return field, lambda v: v.startswith(value)
+
+
+def filter_type(description):
+    "Filter type from a filter description, None if it is not known"
+    match = DESCRIPTION_RE.match(description.strip())
+    return FILTER_CODES.get(match.group(1)) if match else None
+
+
+def compile_filter(ftype, description):
+    """(field, test) for a filter: it matches a Message when test passes on
+    that field of it. field is None for filters matching everything. None
+    when the filter can not be evaluated here. ftype may be None, it is
+    then taken from description"""
+    match = DESCRIPTION_RE.match(description.strip())
+    if match is None:
+        return None
+    args = match.group(2) or ''
+    ftype = ftype or filter_type(description)
+    value = args.split('=', 1)[1] if '=' in args else args
+    if ftype == 'TransparentFilter':
+        return None, None
+    if ftype in EQ_FIELDS:
+        return _key_test('eq', EQ_FIELDS[ftype], value)
+    if ftype in REGEX_FIELDS:
+        test = _regex(value)
+        if test is None:
+            return None
+        return REGEX_FIELDS[ftype], test
+    if ftype == 'TagFilter':
+        return _key_test('member', 'tags', value)
+    if ftype == 'DateIntervalFilter':
+        dates = DATE_RE.search(args)
+        if dates is None:
+            return None
+        start, end = (date.fromisoformat(d) for d in dates.groups())
+        return 'time', lambda t: start <= t.date() <= end
+    if ftype == 'TimeIntervalFilter':
+        times = TIME_RE.search(args)
+        if times is None:
+            return None
+        start, end = (time.fromisoformat(t) for t in times.groups())
+        return 'time', lambda t: start <= t.time() <= end
+    return None
+
+
+def index_key(ftype, description):
+    """(kind, field, value) for filters Router indexes instead of testing
+    one by one: 'eq' filters match a field equal to value, 'prefix' ones a
+    field starting with it, 'member' ones a tag. None for other filters"""
+    match = DESCRIPTION_RE.match(description.strip())
+    args = (match.group(2) or '') if match else ''
+    value = args.split('=', 1)[1] if '=' in args else args
+    if ftype in EQ_FIELDS:
+        return 'eq', EQ_FIELDS[ftype], value
+    if ftype == 'TagFilter':
+        return 'member', 'tags', value
+    if ftype in REGEX_FIELDS and value.startswith('^'):
+        literal = value[1:]
+        if literal and re.escape(literal) == literal:
+            return 'prefix', REGEX_FIELDS[ftype], literal
+    return None
+
+
+def _bits(mask):
+    "Indexes of the bits set in mask, lowest first"
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Router:
+    """A compiled MT or MO routing table
+
+    routes as the router list returns them, filters as the filter list does.
+    Descriptions of filters not in filters are compiled from the description
+    alone.
+
+    Each route is a bit, highest order first. Equality, tag and literal
+    prefix filters are indexed by value, so routing a message costs a few
+    lookups and integer operations however many routes use them; other
+    filters are tested one by one.
+    """
+    #decisions remembered by route_many, before starting afresh
+    memo_size = 100000
+
+    def __init__(self, router, routes, filters=()):
+        self.router = router
+        types = {f['description']: f['type'] for f in filters}
+        supported = ROUTER_FILTERS[router]
+        self.routes = sorted(routes, key=lambda r: -int(r['order']))
+        self.all = (1 << len(self.routes)) - 1
+        #routes with a filter that can not be evaluated
+        self.undetermined = 0
+        #field: [mask of routes indexed on it, {value: mask of passing routes}]
+        self.eq, self.member, self.prefix = {}, {}, {}
+        #[field, test, mask of routes using it]
+        self.tests = []
+        compiled = {}
+        fields = set()
+        for bit, route in enumerate(self.routes):
+            keys = {}
+            for description in route['filters']:
+                ftype = types.get(description) or filter_type(description)
+                if description not in compiled:
+                    compiled[description] = (
+                        compile_filter(ftype, description)
+                        if ftype in supported else None)
+                if compiled[description] is None:
+                    self.undetermined |= 1 << bit
+                    continue
+                field = compiled[description][0]
+                if field is None:
+                    continue
+                fields.add(field)
+                key = index_key(ftype, description)
+                if key is not None:
+                    keys.setdefault(key[:2], set()).add(key[2])
+                else:
+                    self._test(compiled[description], bit)
+            for (kind, field), values in keys.items():
+                if len(values) == 1:
+                    index = getattr(self, kind).setdefault(field, [0, {}])
+                    index[0] |= 1 << bit
+                    value = values.pop()
+                    index[1][value] = index[1].get(value, 0) | 1 << bit
+                else:
+                    #the same field tested more than once, leave it to tests
+                    for value in values:
+                        self._test(_key_test(kind, field, value), bit)
+        self.prefix_lengths = {
+            field: sorted({len(p) for p in index[1]})
+            for field, index in self.prefix.items()}
+        #the only Message fields decisions depend on
+        self.fields = tuple(sorted(fields))
+
+    def _test(self, compiled, bit):
+        for test in self.tests:
+            if test[:2] == list(compiled):
+                test[2] |= 1 << bit
+                return
+        self.tests.append([compiled[0], compiled[1], 1 << bit])
+
+    def route(self, message):
+        """(route, connector, undetermined) for a Message: the winning route,
+        None if none matches, its connector, None for round robin routes,
+        and the orders of higher routes skipped for a filter that could not
+        be evaluated"""
+        failing = 0
+        for field, (mask, passing) in self.eq.items():
+            failing |= mask & ~passing.get(getattr(message, field), 0)
+        for field, (mask, passing) in self.member.items():
+            passed = 0
+            for tag in message.tags:
+                passed |= passing.get(tag, 0)
+            failing |= mask & ~passed
+        for field, (mask, passing) in self.prefix.items():
+            value = getattr(message, field)
+            passed = 0
+            for length in self.prefix_lengths[field]:
+                if length > len(value):
+                    break
+                passed |= passing.get(value[:length], 0)
+            failing |= mask & ~passed
+        for field, test, mask in self.tests:
+            if mask & ~failing and not test(getattr(message, field)):
+                failing |= mask
+        candidates = self.all & ~failing
+        decided = candidates & ~self.undetermined
+        if decided:
+            bit = (decided & -decided).bit_length() - 1
+            skipped = candidates & self.undetermined & ((1 << bit) - 1)
+            route = self.routes[bit]
+        else:
+            skipped = candidates & self.undetermined
+            route = None
+        undetermined = [self.routes[b]['order'] for b in _bits(skipped)]
+        if route is None:
+            return None, None, undetermined
+        connectors = route['connectors']
+        return (route, connectors[0] if len(connectors) == 1 else None,
+                undetermined)
+
+    def route_many(self, messages):
+        """route() for each of messages, as a generator. Messages alike in
+        every field the filters look at share one evaluation."""
+        fields = self.fields
+        decisions = {}
+        for message in messages:
+            key = tuple([getattr(message, f) for f in fields])
+            decision = decisions.get(key)
+            if decision is None:
+                if len(decisions) >= self.memo_size:
+                    decisions.clear()
+                decision = decisions[key] = self.route(message)
+            yield decision
+
+    def decide(self, message):
+        "route() as a dict, as the simulate endpoints return it"
+        route, connector, undetermined = self.route(message)
+        return {'route': route, 'connector': connector,
+                'undetermined': undetermined}
+
+
+#compiled routers by router, with the mirror state they were compiled from
+_compiled = {}
+
+
+def current_tables(request, router):
+    "(routes, filters) as the router and filter lists return them"
+    if not mirror.enabled():
+        from .views import FiltersViewSet, MTRouterViewSet, MORouterViewSet
+        viewset = MTRouterViewSet() if router == 'mt' else MORouterViewSet()
+        return (viewset._list(request.telnet)[router + 'routers'],
+                FiltersViewSet()._list(request.telnet)['filters'])
+    mirror.fresh(request, mirror.ROUTER_TABLES[router], 'filters')
+    return mirror.routes(router), mirror.filters()
+
+
+def current_router(request, router):
+    """Router compiled from the live routing table and filters. Compiled
+    routers are kept until the mirrored tables change or are refreshed;
+    without the mirror the tables are listed from jcli every time."""
+    if not mirror.enabled():
+        return Router(router, *current_tables(request, router))
+    table = mirror.ROUTER_TABLES[router]
+    mirror.fresh(request, table, 'filters')
+    version = (mirror.version(), mirror.synced_at(table),
+               mirror.synced_at('filters'))
+    cached = _compiled.get(router)
+    if cached is None or cached[0] != version:
+        cached = version, Router(router, mirror.routes(router), mirror.filters())
+        _compiled[router] = cached
+    return cached[1]
+
+
+def proposed_tables(routes, filters, proposal):
+    """(routes, filters) with the proposal applied to the current ones.
+
+    proposal may have filters, as the filter list returns them, replacing
+    or adding to the current ones by fid, and routes, as the router list
+    returns them, replacing the current routing table. Route filters are
+    given as fids or descriptions; those of current filters follow any
+    change to them."""
+    if not isinstance(proposal, dict) or not (
+            'routes' in proposal or 'filters' in proposal):
+        raise JasminSyntaxError('Nothing proposed: give routes or filters')
+    fids = {f['description']: f['fid'] for f in filters}
+    proposed = {f['fid']: f for f in filters}
+    if not isinstance(proposal.get('filters') or [], list):
+        raise JasminSyntaxError('filters must be a list')
+    for f in proposal.get('filters') or ():
+        if not isinstance(f, dict) or not f.get('fid') or not f.get('description'):
+            raise JasminSyntaxError('Proposed filters need fid and description')
+        proposed[f['fid']] = dict(
+            f, type=f.get('type') or filter_type(f['description']))
+    routes = proposal.get('routes', routes)
+    if not isinstance(routes, list):
+        raise JasminSyntaxError('routes must be a list')
+    resolved = []
+    for route in routes:
+        try:
+            int(route['order'])
+            connectors = list(route['connectors'])
+        except (KeyError, TypeError, ValueError):
+            raise JasminSyntaxError(
+                'Proposed routes need an order and connectors: %s' % (route,))
+        route_filters = route.get('filters') or []
+        if not isinstance(route_filters, list) or not all(
+                isinstance(f, str) for f in route_filters):
+            raise JasminSyntaxError(
+                'Route filters must be a list of fids or descriptions: %s' % (
+                    route_filters,))
+        descriptions = []
+        for f in route_filters:
+            fid = f if f in proposed else fids.get(f)
+            if fid is None and not DESCRIPTION_RE.match(f):
+                raise JasminSyntaxError('Unknown filter: %s' % f)
+            descriptions.append(proposed[fid]['description'] if fid else f)
+        resolved.append(dict(route, connectors=connectors, filters=descriptions))
+    return resolved, list(proposed.values())
+
+
+def connector_key(route, connector):
+    """What a decision is counted under: its connector, the connectors of a
+    round robin route joined with ' | ', None when no route matched"""
+    if route is None:
+        return None
+    return connector or ' | '.join(route['connectors'])
+
+
+def diff(current, proposed, messages, rows=True):
+    """Compare how two Routers route messages: the rows changing connector
+    (from 1, when rows is set) and message counts per connector under
+    each, 'unrouted' for messages no route matches"""
+    changes = []
+    counts = {}
+    total = changed = 0
+    messages = itertools.tee(messages)
+    decisions = zip(current.route_many(messages[0]),
+                    proposed.route_many(messages[1]))
+    for total, (before, after) in enumerate(decisions, 1):
+        keys = connector_key(*before[:2]), connector_key(*after[:2])
+        for key, side in zip(keys, ('current', 'proposed')):
+            count = counts.setdefault(key or 'unrouted', {
+                'current': 0, 'proposed': 0, 'delta': 0})
+            count[side] += 1
+            count['delta'] += 1 if side == 'proposed' else -1
+        if keys[0] != keys[1]:
+            changed += 1
+            if rows:
+                changes.append({'row': total, 'current': _decision(*before),
+                                'proposed': _decision(*after)})
+    result = {'rows': total, 'changed': changed, 'connectors': counts}
+    if rows:
+        result['changes'] = changes
+    return result
+
+
+def _decision(route, connector, undetermined):
+    return {'order': route and route['order'], 'connector': connector,
+            'undetermined': undetermined}
+
+
+def read_messages(stream, content_type):
+    """Messages from a CSV (text/csv, with a header row naming message
+    fields) or newline delimited JSON stream of bytes lines, such as a
+    request or an uploaded file, read as they are consumed. Messages without
+    a time share one."""
+    now = datetime.now()
+    lines = codecs.iterdecode(stream or (), 'utf-8')
+    if 'csv' in (content_type or ''):
+        rows = csv.DictReader(lines)
+        unknown = set(rows.fieldnames or ()) - set(MESSAGE_FIELDS)
+        if unknown:
+            raise JasminSyntaxError(
+                'Unknown message fields: %s' % ', '.join(sorted(unknown)))
+        rows = ({k: v for k, v in row.items() if v} for row in rows)
+    else:
+        rows = _json_rows(lines)
+    for row in rows:
+        if 'time' not in row:
+            row['time'] = now
+        yield Message.from_data(row)
+
+
+def _json_rows(lines):
+    loads = orjson.loads if orjson is not None else json.loads
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            raise JasminSyntaxError('Invalid message: %s' % line.strip()[:80])
+        yield row
+
+
+def dry_run(router, messages, rows=True):
+    """Route messages through router. Yields one dict per message when rows
+    is set, with its row number (from 1), the winning route order, its
+    connector and undetermined routes, and then a summary: message counts
+    per connector, round robin routes counted by their connectors list.
+    Invalid messages are raised, unless rows is set: as the rows may be
+    streamed already, they then end the output with an error instead."""
+    counts = {}
+    total = unrouted = undetermined = 0
+    try:
+        for total, (route, connector, skipped) in enumerate(
+                router.route_many(messages), 1):
+            key = connector_key(route, connector)
+            if key is None:
+                unrouted += 1
+            else:
+                counts[key] = counts.get(key, 0) + 1
+            if skipped:
+                undetermined += 1
+            if rows:
+                yield dict(row=total, **_decision(route, connector, skipped))
+    except JasminSyntaxError as e:
+        if not rows:
+            raise
+        yield {'error': 'Row %d: %s' % (total + 1, e.detail)}
+        return
+    yield {'summary': {'rows': total, 'connectors': counts,
+                       'unrouted': unrouted, 'undetermined': undetermined}}
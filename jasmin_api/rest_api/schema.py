@@ -0,0 +1,85 @@
+"""The OpenAPI schema, generated once per process
+
+drf_spectacular introspects every viewset to generate the schema, which
+takes longer than any jcli round trip. get() generates it on first use, or
+reads SCHEMA_FILE when it is set and exists (writing it there otherwise),
+and keeps it in memory. rendered() keeps each format rendered as well, with
+the ETag of its bytes. drf_spectacular's generator and renderers are only
+imported then, not when the URLs load.
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_schema = None
+#renderer format: (content, ETag)
+_rendered = {}
+
+
+def generate():
+    "The schema as ./manage.py spectacular generates it"
+    from drf_spectacular.settings import spectacular_settings
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(
+        urlconf=spectacular_settings.SERVE_URLCONF)
+    return generator.get_schema(
+        request=None, public=spectacular_settings.SERVE_PUBLIC)
+
+
+def _etag(content):
+    return '"%s"' % hashlib.sha1(content).hexdigest()
+
+
+def _write(path, schema):
+    """Write schema as YAML, atomically as other processes may read path,
+    and return the YAML"""
+    from drf_spectacular.renderers import OpenApiYamlRenderer
+    content = OpenApiYamlRenderer().render(schema)
+    temporary = '%s.%d' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+    return content
+
+
+def get():
+    "The schema, from memory, SCHEMA_FILE or generated"
+    global _schema
+    with _lock:
+        if _schema is None:
+            path = settings.SCHEMA_FILE
+            content = None
+            if path and os.path.exists(path):
+                import yaml
+                with open(path, 'rb') as f:
+                    content = f.read()
+                _schema = yaml.load(
+                    content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+            else:
+                _schema = generate()
+                if path:
+                    content = _write(path, _schema)
+            #the file holds the schema as served in YAML, unless written as JSON
+            if content is not None and not path.endswith('.json'):
+                _rendered['yaml'] = (content, _etag(content))
+        return _schema
+
+
+def rendered(renderer):
+    "The schema rendered by renderer, and its ETag"
+    schema = get()
+    with _lock:
+        if renderer.format not in _rendered:
+            content = renderer.render(schema, renderer_context={})
+            _rendered[renderer.format] = (content, _etag(content))
+        return _rendered[renderer.format]
+
+
+def clear():
+    "Forget the schema, to read or generate it again on next use"
+    global _schema
+    with _lock:
+        _schema = None
+        _rendered.clear()
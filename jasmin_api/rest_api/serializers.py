@@ -76,6 +76,9 @@ class UserSerializer(serializers.Serializer):
 class UserListSerializer(serializers.Serializer):
     """Serializer for list of users"""
     users = UserSerializer(many=True)
+    next = serializers.CharField(
+        help_text="Cursor of the next page, only when paging",
+        required=False, allow_null=True)
 
 
 class UserDetailSerializer(serializers.Serializer):
@@ -276,3 +279,287 @@ class SimpleResponseSerializer(serializers.Serializer):
     cid = serializers.CharField(required=False, help_text="Connector identifier")
     order = serializers.IntegerField(required=False, help_text="Router order")
     name = serializers.CharField(required=False, help_text="Name/identifier")
+
+
+class FilterRoutesSerializer(serializers.Serializer):
+    """Serializer for the routes using a filter"""
+    mtrouters = MTRouterSerializer(many=True)
+    morouters = MORouterSerializer(many=True)
+
+
+class MessageSerializer(serializers.Serializer):
+    """Serializer for a message to route"""
+    uid = serializers.CharField(required=False, help_text="User sending an MT message")
+    gid = serializers.CharField(required=False, help_text="Group of the user")
+    connector = serializers.CharField(
+        required=False, help_text="Connector an MO message came in from")
+    source_addr = serializers.CharField(required=False, help_text="Source address")
+    destination_addr = serializers.CharField(required=False, help_text="Destination address")
+    content = serializers.CharField(required=False, help_text="Message text")
+    tags = serializers.ListField(
+        child=serializers.CharField(), required=False, help_text="Message tags")
+    time = serializers.DateTimeField(
+        required=False, help_text="When the message is routed, default now")
+
+
+class RouteSimulateSerializer(serializers.Serializer):
+    """Serializer for routing simulation requests, one message or several"""
+    messages = MessageSerializer(
+        many=True, required=False,
+        help_text="Messages to route; without it the body is one message")
+
+
+class MTRoutingDecisionSerializer(serializers.Serializer):
+    """Serializer for the route an MT message would take"""
+    route = MTRouterSerializer(allow_null=True, help_text="Winning route, null if none")
+    connector = serializers.CharField(
+        allow_null=True, help_text="Its connector, null for round robin routes")
+    undetermined = serializers.ListField(
+        child=serializers.CharField(),
+        help_text="Orders of higher routes with filters that can not be simulated")
+
+
+class DryRunRowSerializer(serializers.Serializer):
+    """Serializer for a routing dry run line: a row, then a summary"""
+    row = serializers.IntegerField(required=False, help_text="Row number, from 1")
+    order = serializers.CharField(
+        required=False, allow_null=True, help_text="Winning route order, null if none")
+    connector = serializers.CharField(
+        required=False, allow_null=True,
+        help_text="Its connector, null for round robin routes")
+    undetermined = serializers.ListField(
+        child=serializers.CharField(), required=False,
+        help_text="Orders of higher routes with filters that can not be simulated")
+    summary = serializers.DictField(
+        required=False,
+        help_text="Last line: rows, message counts per connector, unrouted and undetermined counts")
+    error = serializers.CharField(
+        required=False, help_text="Last line instead of summary for an invalid row")
+
+
+class RouteDiffSerializer(serializers.Serializer):
+    """Serializer for a proposed routing table to compare with the current one"""
+    routes = serializers.ListField(
+        child=serializers.DictField(), required=False,
+        help_text="Proposed routing table, as the router list returns it; "
+                  "route filters may be fids. Default the current table")
+    filters = serializers.ListField(
+        child=serializers.DictField(), required=False,
+        help_text="Proposed filters (fid, type, description), replacing or "
+                  "adding to the current ones")
+    messages = MessageSerializer(
+        many=True, required=False, help_text="Sample traffic")
+    traffic = serializers.FileField(
+        required=False,
+        help_text="Sample traffic as a CSV or newline delimited JSON file, "
+                  "with routes and filters as JSON form fields")
+
+
+class RouteDiffResultSerializer(serializers.Serializer):
+    """Serializer for the traffic impact of a proposed routing table"""
+    rows = serializers.IntegerField(help_text="Messages routed")
+    changed = serializers.IntegerField(help_text="Messages changing connector")
+    connectors = serializers.DictField(
+        help_text="Per connector: current, proposed and delta message counts")
+    changes = serializers.ListField(
+        child=serializers.DictField(), required=False,
+        help_text="Rows changing connector, with their current and proposed decisions")
+
+
+class StatsSerializer(serializers.Serializer):
+    """Serializer for the sampled stats of a user or connector"""
+    sampled_at = serializers.FloatField(help_text="Last sample, as a UNIX timestamp")
+    info = serializers.DictField(
+        help_text="Last seen non numeric values, such as last activity times")
+    series = serializers.DictField(
+        help_text="Per series: latest value, and delta, rate per second "
+                  "(counters only) and span in seconds over each window")
+
+
+class StatsListSerializer(serializers.Serializer):
+    """Serializer for the sampled stats of all users or connectors"""
+    sampled_at = serializers.FloatField(
+        allow_null=True, help_text="Last sample, null before the first")
+    stats = StatsSerializer(many=True)
+
+
+class SendMessageSerializer(serializers.Serializer):
+    """Serializer for a message to send through Jasmin's HTTP API. Any other
+    /send parameter (from, hex-content, sdt, validity-period, dlr-url,
+    dlr-level, dlr-method) is passed on too"""
+    to = serializers.CharField(help_text="Destination address")
+    content = serializers.CharField(required=False, help_text="Message text")
+    coding = serializers.IntegerField(required=False, help_text="Data coding")
+    priority = serializers.IntegerField(required=False, help_text="Priority, 0 to 3")
+    dlr = serializers.CharField(required=False, help_text="yes to request a delivery receipt")
+    tags = serializers.CharField(required=False, help_text="Comma separated tags")
+
+
+class SendBatchSerializer(serializers.Serializer):
+    """Serializer for a batch of messages to send"""
+    username = serializers.CharField(help_text="Jasmin user sending the messages")
+    password = serializers.CharField(help_text="Its password")
+    messages = SendMessageSerializer(
+        many=True, help_text="Messages; other /send parameters given "
+                             "beside messages apply to all of them")
+
+
+class SendResultSerializer(serializers.Serializer):
+    """Serializer for the result of sending one message"""
+    status = serializers.CharField(help_text="success or error")
+    id = serializers.CharField(required=False, help_text="Jasmin message id")
+    http_status = serializers.IntegerField(
+        required=False, allow_null=True,
+        help_text="Status Jasmin answered with, null when unreachable")
+    error = serializers.CharField(required=False, help_text="Jasmin error")
+
+
+class SendBatchResultSerializer(serializers.Serializer):
+    """Serializer for the results of a batch, in message order"""
+    sent = serializers.IntegerField(help_text="Messages Jasmin accepted")
+    failed = serializers.IntegerField(help_text="Messages Jasmin refused or not sent")
+    results = SendResultSerializer(many=True)
+
+
+class HTTPCCMProbeSerializer(serializers.Serializer):
+    """Serializer for the reachability of an HTTP client connector"""
+    cid = serializers.CharField(help_text="Connector identifier")
+    url = serializers.CharField(help_text="Base URL probed")
+    reachable = serializers.BooleanField(help_text="Whether an HTTP server answered")
+    status = serializers.IntegerField(
+        allow_null=True, help_text="Status it answered a HEAD request with")
+    latency_ms = serializers.FloatField(allow_null=True, help_text="Time to answer")
+    error = serializers.CharField(allow_null=True, help_text="Why it is not reachable")
+    checked_at = serializers.FloatField(help_text="When, as a UNIX timestamp")
+
+
+class ClusterErrorSerializer(serializers.Serializer):
+    """Serializer for a backend a cluster read failed on"""
+    backend = serializers.CharField(help_text="Backend name")
+    detail = serializers.CharField(help_text="Why it failed")
+
+
+class ClusterGroupSerializer(GroupSerializer):
+    backend = serializers.CharField(help_text="Backend the group is on")
+
+
+class ClusterGroupListSerializer(serializers.Serializer):
+    """Serializer for the groups of every backend"""
+    groups = ClusterGroupSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ClusterUserSerializer(UserSerializer):
+    backend = serializers.CharField(help_text="Backend the user is on")
+
+
+class ClusterUserListSerializer(serializers.Serializer):
+    """Serializer for the users of every backend"""
+    users = ClusterUserSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ClusterFilterSerializer(FilterSerializer):
+    backend = serializers.CharField(help_text="Backend the filter is on")
+
+
+class ClusterFilterListSerializer(serializers.Serializer):
+    """Serializer for the filters of every backend"""
+    filters = ClusterFilterSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ClusterMTRouterSerializer(MTRouterSerializer):
+    backend = serializers.CharField(help_text="Backend the route is on")
+
+
+class ClusterMTRouterListSerializer(serializers.Serializer):
+    """Serializer for the MT routes of every backend"""
+    mtrouters = ClusterMTRouterSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ClusterMORouterSerializer(MORouterSerializer):
+    backend = serializers.CharField(help_text="Backend the route is on")
+
+
+class ClusterMORouterListSerializer(serializers.Serializer):
+    """Serializer for the MO routes of every backend"""
+    morouters = ClusterMORouterSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ClusterSMPPCCMSerializer(SMPPCCMSerializer):
+    backend = serializers.CharField(help_text="Backend the connector is on")
+
+
+class ClusterSMPPCCMListSerializer(serializers.Serializer):
+    """Serializer for the SMPP client connectors of every backend"""
+    connectors = ClusterSMPPCCMSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ClusterHTTPCCMSerializer(HTTPCCMSerializer):
+    backend = serializers.CharField(help_text="Backend the connector is on")
+
+
+class ClusterHTTPCCMListSerializer(serializers.Serializer):
+    """Serializer for the HTTP client connectors of every backend"""
+    connectors = ClusterHTTPCCMSerializer(many=True)
+    errors = ClusterErrorSerializer(many=True)
+
+
+class ReplicateSerializer(serializers.Serializer):
+    """Serializer for a replication request"""
+    primary = serializers.CharField(
+        required=False, help_text="Backend to copy, default the default backend")
+    standbys = serializers.ListField(
+        child=serializers.CharField(), required=False,
+        help_text="Backends to update, default all but the primary")
+    tables = serializers.ListField(
+        child=serializers.CharField(), required=False,
+        help_text="Of groups, users, filters, mtrouters and morouters, default all")
+    dry_run = serializers.BooleanField(
+        required=False, help_text="Only report the operations to apply")
+    passwords = serializers.DictField(
+        child=serializers.CharField(), required=False,
+        help_text="Passwords of users to add to standbys, by uid")
+
+
+class ReplicationOperationSerializer(serializers.Serializer):
+    """Serializer for a jcli operation of a replication"""
+    module = serializers.CharField(help_text="jcli module, such as user")
+    action = serializers.CharField(help_text="-a, -u, -r, -e or -d")
+    id = serializers.CharField(help_text="Object identifier, or route order")
+    command = serializers.CharField(help_text="jcli command line")
+    keys = serializers.DictField(
+        required=False, help_text="Keys set in interactive mode")
+
+
+class ReplicationSkipSerializer(serializers.Serializer):
+    """Serializer for an object a replication can not copy"""
+    module = serializers.CharField(help_text="jcli module")
+    id = serializers.CharField(help_text="Object identifier, or route order")
+    reason = serializers.CharField(help_text="Why it is skipped")
+
+
+class ReplicationErrorSerializer(serializers.Serializer):
+    """Serializer for a replication operation that failed"""
+    command = serializers.CharField(
+        allow_null=True, help_text="jcli command, null when the backend is unreachable")
+    detail = serializers.CharField(help_text="Error")
+
+
+class ReplicationStandbySerializer(serializers.Serializer):
+    """Serializer for the replication to one standby"""
+    backend = serializers.CharField(help_text="Standby backend name")
+    operations = ReplicationOperationSerializer(many=True)
+    skipped = ReplicationSkipSerializer(many=True)
+    errors = ReplicationErrorSerializer(many=True)
+
+
+class ReplicationReportSerializer(serializers.Serializer):
+    """Serializer for a replication report"""
+    primary = serializers.CharField(help_text="Backend copied")
+    dry_run = serializers.BooleanField(help_text="Whether nothing was applied")
+    standbys = ReplicationStandbySerializer(many=True)
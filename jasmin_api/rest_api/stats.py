@@ -0,0 +1,362 @@
+"""Jasmin traffic statistics, sampled from jcli into the database
+
+A sampler thread (start_sampler, started by the first worker of
+run_cherrypy.py) runs stats --users and stats --smppcs every STATS_INTERVAL
+seconds, plus stats --user and stats --smppc for a few objects in turn, and
+stores a StatsSample of every user and connector, keeping the last
+STATS_RING_SIZE rounds. Every worker then answers with the same samples.
+The stats endpoints compute deltas and rates over windows from the samples
+alone, loaded in a Ring per series, they never reach jcli.
+"""
+import logging
+import re
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+
+from .exceptions import JasminSyntaxError
+from .models import StatsSample
+from .tools import list_lines
+
+logger = logging.getLogger(__name__)
+
+STANDARD_PROMPT = settings.STANDARD_PROMPT
+
+#jcli lays stats out with tabulate, columns are two or more spaces apart
+COLUMNS_RE = re.compile(r'\s{2,}')
+WINDOW_RE = re.compile(r'^(\d+)([smh])$')
+UNITS = {'s': 1, 'm': 60, 'h': 3600}
+DEFAULT_WINDOWS = ('1m', '5m', '1h')
+
+#stats --user Type column to series prefix
+USER_TYPES = {'SMPP Server': 'smpps', 'HTTP Api': 'http'}
+#series that go up and down; the others are counters
+GAUGES = {'smpps.bound_connections'}
+
+
+class Ring:
+    """The last size (time, value) samples of a series, oldest overwritten
+    first, in two preallocated arrays"""
+    __slots__ = ('size', 'times', 'values', 'count', 'head')
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array('d', [0.0]) * size
+        self.values = array('d', [0.0]) * size
+        self.count = 0
+        #next slot written
+        self.head = 0
+
+    def __len__(self):
+        return self.count
+
+    def _slot(self, i):
+        "Slot of the i-th sample, oldest first"
+        return (self.head - self.count + i) % self.size
+
+    def append(self, when, value):
+        self.times[self.head] = when
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self):
+        "Newest (time, value), None when empty"
+        if not self.count:
+            return None
+        slot = self._slot(self.count - 1)
+        return self.times[slot], self.values[slot]
+
+    def window(self, seconds, now):
+        """Samples, oldest first, from the last one at or before now - seconds
+        (the oldest kept when the ring does not reach back that far)"""
+        start = now - seconds
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._slot(middle)] <= start:
+                low = middle + 1
+            else:
+                high = middle
+        return [(self.times[s], self.values[s])
+                for s in map(self._slot, range(max(low - 1, 0), self.count))]
+
+
+def increase(samples, counter=True):
+    """Change of a series over samples. A counter going down was reset, the
+    value after the reset is counted as its increase"""
+    total = 0.0
+    for (_, before), (_, after) in zip(samples, samples[1:]):
+        if counter and after < before:
+            total += after
+        else:
+            total += after - before
+    return total
+
+
+def parse_windows(value):
+    "Window labels (such as 1m,5m,1h) to [(label, seconds)]"
+    windows = []
+    for label in (value.split(',') if value else DEFAULT_WINDOWS):
+        match = WINDOW_RE.match(label.strip())
+        if match is None or int(match.group(1)) == 0:
+            raise JasminSyntaxError('Invalid window: %s' % label)
+        windows.append((label.strip(), int(match.group(1)) * UNITS[match.group(2)]))
+    return windows
+
+
+def _series(rows, windows, now):
+    """Latest value, and delta and rate (per second, counters only) over
+    each window, of every series of an object's rows, oldest first"""
+    rings = {}
+    info = {}
+    for row in rows:
+        for name, value in row.values.items():
+            ring = rings.get(name)
+            if ring is None:
+                ring = rings[name] = Ring(len(rows))
+            ring.append(row.time, value)
+        info.update(row.info)
+    series = {}
+    for name, ring in sorted(rings.items()):
+        counter = name not in GAUGES
+        result = {'value': ring.last()[1], 'windows': {}}
+        for label, seconds in windows:
+            samples = ring.window(seconds, now)
+            span = samples[-1][0] - samples[0][0] if samples else 0.0
+            if span <= 0:
+                result['windows'][label] = {
+                    'delta': None, 'rate': None, 'span': 0.0}
+                continue
+            delta = increase(samples, counter)
+            result['windows'][label] = {
+                'delta': delta,
+                'rate': delta / span if counter else None,
+                'span': span}
+        series[name] = result
+    return {'sampled_at': rows[-1].time, 'info': info, 'series': series}
+
+
+class Store:
+    """Samples of every user and connector, kind 'user' or 'smppc', in the
+    StatsSample table. Sampling rounds share their time, the last size of
+    them are kept"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def record(self, kind, when, objects):
+        """Store the values of every object of kind, {id: values}, sampled
+        at when, and forget the objects no longer listed"""
+        rows = []
+        for oid, values in objects.items():
+            numbers = {k: v for k, v in values.items()
+                       if isinstance(v, (int, float))}
+            rows.append(StatsSample(
+                kind=kind, oid=oid, time=when, values=numbers,
+                info={k: v for k, v in values.items() if k not in numbers}))
+        with transaction.atomic():
+            StatsSample.objects.filter(kind=kind).exclude(
+                oid__in=list(objects)).delete()
+            StatsSample.objects.bulk_create(rows)
+
+    def trim(self):
+        "Drop the samples of rounds older than the last size ones"
+        oldest = list(StatsSample.objects.order_by('-time').values_list(
+            'time', flat=True).distinct()[self.size - 1:self.size])
+        if oldest:
+            StatsSample.objects.filter(time__lt=oldest[0]).delete()
+
+    @property
+    def sampled_at(self):
+        "Time of the last sampling round, None before the first"
+        return StatsSample.objects.aggregate(last=Max('time'))['last']
+
+    def _rows(self, windows, now):
+        """Samples needed for windows: from the last round at or before the
+        start of the longest"""
+        start = StatsSample.objects.filter(
+            time__lte=now - max(seconds for _, seconds in windows)).aggregate(
+                start=Max('time'))['start']
+        rows = StatsSample.objects.order_by('time')
+        return rows if start is None else rows.filter(time__gte=start)
+
+    def query(self, kind, oid, windows, now=None):
+        "_series of an object, None if it is unknown"
+        now = time.time() if now is None else now
+        rows = list(self._rows(windows, now).filter(kind=kind, oid=oid))
+        return _series(rows, windows, now) if rows else None
+
+    def query_all(self, kind, windows, now=None):
+        "[(id, _series)] of every object of kind, by id"
+        now = time.time() if now is None else now
+        objects = {}
+        for row in self._rows(windows, now).filter(kind=kind):
+            objects.setdefault(row.oid, []).append(row)
+        return [(oid, _series(rows, windows, now))
+                for oid, rows in sorted(objects.items())]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    "The Store, keeping STATS_RING_SIZE rounds"
+    global _store
+    with _store_lock:
+        if _store is None or _store.size != settings.STATS_RING_SIZE:
+            _store = Store(settings.STATS_RING_SIZE)
+        return _store
+
+
+#Parsing jcli stats output
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _columns(line):
+    return COLUMNS_RE.split(line.strip().lstrip('#'))
+
+
+def item_rows(telnet, command):
+    """(item, [columns]) rows of a stats --user or stats --smppc reply, which
+    have a header and no Total line"""
+    telnet.sendline(command)
+    telnet.expect(r'\n' + STANDARD_PROMPT)
+    lines = telnet.before.replace('\r', '').split('\n')[1:]
+    rows = [_columns(l) for l in lines if l.startswith('#')]
+    return [(r[0], r[1:]) for r in rows[1:] if len(r) > 1]
+
+
+def parse_users(lines):
+    "stats --users rows to {uid: values}"
+    users = {}
+    for line in lines:
+        columns = _columns(line)
+        if not line.startswith('#') or len(columns) < 5:
+            continue
+        users[columns[0]] = {
+            'smpps.bound_connections': _number(columns[1]),
+            'smpps.last_activity_at': columns[2],
+            'http.connects_count': _number(columns[3]),
+            'http.last_activity_at': columns[4],
+        }
+    return users
+
+
+def parse_user(rows):
+    "stats --user rows, (item, [type, value]), to values"
+    values = {}
+    for item, columns in rows:
+        if len(columns) < 2 or columns[0] not in USER_TYPES:
+            continue
+        prefix = USER_TYPES[columns[0]]
+        if item == 'bound_connections_count':
+            #a dict of counts per bind type
+            values[prefix + '.bound_connections'] = sum(
+                int(n) for n in re.findall(r':\s*(\d+)', columns[1]))
+        else:
+            values['%s.%s' % (prefix, item)] = _number(columns[1])
+    return values
+
+
+def _pair(value):
+    parts = value.split('/')
+    if len(parts) != 2:
+        return None, None
+    return _number(parts[0]), _number(parts[1])
+
+
+def parse_smppcs(lines):
+    "stats --smppcs rows to {cid: values}"
+    connectors = {}
+    for line in lines:
+        columns = _columns(line)
+        if not line.startswith('#') or len(columns) < 8:
+            continue
+        values = {'connected_at': columns[1], 'bound_at': columns[2],
+                  'disconnected_at': columns[3],
+                  'throttling_error_count': _number(columns[6]),
+                  'other_submit_error_count': _number(columns[7])}
+        (values['submit_sm_request_count'],
+         values['submit_sm_count']) = _pair(columns[4])
+        values['deliver_sm_count'], values['data_sm_count'] = _pair(columns[5])
+        connectors[columns[0]] = {
+            k: v for k, v in values.items() if v is not None}
+    return connectors
+
+
+def parse_smppc(rows):
+    "stats --smppc rows, (item, [value]), to values"
+    return {item: _number(columns[0]) for item, columns in rows}
+
+
+#Sampling
+
+_next_detail = {'user': 0, 'smppc': 0}
+
+
+def _details(kind, ids, batch):
+    "The next batch of ids to run a detail command for, in turn"
+    if not ids or batch <= 0:
+        return []
+    start = _next_detail[kind] % len(ids)
+    _next_detail[kind] = start + batch
+    return (ids[start:] + ids[:start])[:batch]
+
+
+def sample(telnet, now=None):
+    """Run the stats commands once over an open jcli session and record
+    their values"""
+    now = time.time() if now is None else now
+    target = store()
+    batch = settings.STATS_DETAIL_BATCH
+    users = parse_users(list_lines(telnet, 'stats --users'))
+    for uid in _details('user', sorted(users), batch):
+        users[uid].update(parse_user(item_rows(telnet, 'stats --user %s' % uid)))
+    connectors = parse_smppcs(list_lines(telnet, 'stats --smppcs'))
+    for cid in _details('smppc', sorted(connectors), batch):
+        detail = parse_smppc(item_rows(telnet, 'stats --smppc %s' % cid))
+        connectors[cid].update(detail)
+    target.record('user', now, users)
+    target.record('smppc', now, connectors)
+    target.trim()
+
+
+def start_sampler(interval):
+    """Sample every interval seconds in a daemon thread, over one jcli
+    session reopened after errors"""
+    from .jcli import connect, disconnect
+
+    def run():
+        telnet = None
+        while True:
+            start = time.monotonic()
+            try:
+                if telnet is None:
+                    telnet = connect()
+                sample(telnet)
+            except Exception:
+                logger.exception('Stats sampling failed')
+                if telnet is not None:
+                    try:
+                        disconnect(telnet)
+                    except Exception:
+                        pass
+                    telnet = None
+            finally:
+                close_old_connections()
+            time.sleep(max(interval - (time.monotonic() - start), 0))
+
+    thread = threading.Thread(target=run, name='stats-sampler', daemon=True)
+    thread.start()
+    return thread
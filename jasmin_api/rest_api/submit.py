@@ -0,0 +1,200 @@
+"""Forwarding of messages to Jasmin's HTTP API /send
+
+Connections to the HTTP API of each backend (JASMIN_HTTP_URL unless the
+backend sets its http_url) are kept alive in a Pool and reused across
+requests. Messages are sent by a process wide thread pool of
+SUBMIT_CONCURRENCY workers, which bounds the load put on Jasmin whatever the
+number of concurrent batches.
+"""
+import functools
+import http.client
+import queue
+import re
+import select
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+
+from . import backends
+from .exceptions import JasminSyntaxError
+
+#parameters of /send, as Jasmin names them
+SEND_PARAMETERS = (
+    'to', 'from', 'coding', 'content', 'hex-content', 'priority', 'sdt',
+    'validity-period', 'dlr', 'dlr-url', 'dlr-level', 'dlr-method', 'tags',
+)
+REPLY_RE = re.compile(r'^(Success|Error) "(.*)"\s*$', re.S)
+
+
+class Pool:
+    """Keep-alive HTTP connections to one host, at most size of them idle.
+    Connections are only ever used by one thread at a time."""
+
+    def __init__(self, url, size, timeout):
+        self.url = url
+        parts = urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection
+                                 if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(size)
+        self.opened = 0
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, body) of a request, over an idle connection when there is
+        one. Idle connections the server closed are replaced, and the
+        request is sent again when sending it over a reused connection
+        failed. It is never sent again once sent: a /send the server read
+        may have been submitted, whether it answered or not."""
+        for _ in range(2):
+            connection, reused = self._get()
+            try:
+                connection.request(method, self.path + path, body, headers or {})
+            except (ConnectionError, http.client.HTTPException):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    self.idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+            return response.status, data
+        raise ConnectionError('Connection closed by %s' % self.host)
+
+    def _get(self):
+        "(connection, reused), an idle one still open if there is one"
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return self._open(), False
+            if not _dropped(connection):
+                return connection, True
+            connection.close()
+
+    def _open(self):
+        self.opened += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _dropped(connection):
+    """Whether the server closed an idle connection: with no request
+    pending, it is only readable at end of file"""
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+_lock = threading.Lock()
+#url: Pool
+_pools = {}
+#(workers, ThreadPoolExecutor)
+_executor = None
+
+
+def pool(url=None):
+    "The Pool to url, by default the HTTP API of the current backend"
+    if url is None:
+        url = backends.current().http_url
+    with _lock:
+        if url not in _pools:
+            _pools[url] = Pool(
+                url, settings.SUBMIT_CONCURRENCY, settings.SUBMIT_TIMEOUT)
+        return _pools[url]
+
+
+def executor():
+    "The thread pool messages are sent from"
+    global _executor
+    with _lock:
+        workers = settings.SUBMIT_CONCURRENCY
+        if _executor is None or _executor[0] != workers:
+            if _executor is not None:
+                _executor[1].shutdown(wait=False)
+            _executor = workers, ThreadPoolExecutor(
+                workers, thread_name_prefix='submit')
+        return _executor[1]
+
+
+def send(params, url=None):
+    """Send one message, params as /send takes them, to the HTTP API at url
+    (by default the current backend's). Returns its result: the message
+    id, or the error and the HTTP status Jasmin answered with"""
+    try:
+        status, body = pool(url).request(
+            'POST', '/send', urlencode(params),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+    except (OSError, http.client.HTTPException) as e:
+        return {'status': 'error', 'http_status': None,
+                'error': 'Jasmin HTTP API unreachable: %s' % e}
+    text = body.decode('utf-8', 'replace')
+    match = REPLY_RE.match(text)
+    if status == 200 and match and match.group(1) == 'Success':
+        return {'status': 'success', 'id': match.group(2)}
+    return {'status': 'error', 'http_status': status,
+            'error': match.group(2) if match else text.strip()}
+
+
+def messages_params(data):
+    """/send parameters of every message of a batch: its username and
+    password, the batch defaults and then the message's own parameters"""
+    if not isinstance(data, dict):
+        raise JasminSyntaxError('Expected a JSON object')
+    messages = data.get('messages')
+    if not isinstance(messages, list) or not messages:
+        raise JasminSyntaxError('messages must be a non empty list')
+    if len(messages) > settings.SUBMIT_MAX_BATCH:
+        raise JasminSyntaxError(
+            'At most %d messages per batch' % settings.SUBMIT_MAX_BATCH)
+    if not data.get('username') or not data.get('password'):
+        raise JasminSyntaxError('username and password are required')
+    defaults = {k: data[k] for k in SEND_PARAMETERS if k in data}
+    batch = []
+    for message in messages:
+        if not isinstance(message, dict):
+            raise JasminSyntaxError('Messages must be objects')
+        unknown = set(message) - set(SEND_PARAMETERS)
+        if unknown:
+            raise JasminSyntaxError(
+                'Unknown message parameters: %s' % ', '.join(sorted(unknown)))
+        params = {'username': data['username'], 'password': data['password']}
+        params.update(defaults)
+        params.update(message)
+        batch.append(params)
+    return batch
+
+
+def submit(batch):
+    """Send messages concurrently to the current backend, results in the
+    order of batch"""
+    url = backends.current().http_url
+    return list(executor().map(functools.partial(send, url=url), batch))
@@ -0,0 +1,98 @@
+"""Telnet option negotiation for the clients that speak to jcli over TCP
+
+jcli is a telnet server: it may send commands such as IAC WILL ECHO around
+the password, and escapes 0xff bytes as IAC IAC. The telnet binary deals with
+them; the 'socket' transport of rest_api.jcli and the sessions of
+rest_api.ajcli feed what they read to a Negotiation instead, which strips
+the commands out and gives the answers to send back.
+"""
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+ECHO = 1
+SGA = 3
+
+#options the server may enable, the others are refused
+ACCEPTED = (ECHO, SGA)
+
+_DATA = 'data'
+_COMMAND = 'command'
+_OPTION = 'option'
+_SUB = 'sub'
+_SUB_IAC = 'sub iac'
+
+
+class Negotiation:
+    """Telnet state of one connection, as seen by the client
+
+    feed() takes the bytes read, split anywhere, and returns the data they
+    hold and the bytes to send back. The client never enables an option of
+    its own: DO is answered with WONT, WILL with DO for ECHO and SGA and
+    with DONT otherwise.
+    """
+
+    def __init__(self):
+        self._state = _DATA
+        self._verb = None
+        #options enabled on the server side
+        self._remote = set()
+
+    def feed(self, chunk):
+        "(data, reply) of chunk"
+        if self._state == _DATA and IAC not in chunk:
+            return chunk, b''
+        data = bytearray()
+        reply = bytearray()
+        i = 0
+        while i < len(chunk):
+            if self._state == _DATA:
+                end = chunk.find(IAC, i)
+                if end == -1:
+                    data += chunk[i:]
+                    break
+                data += chunk[i:end]
+                self._state = _COMMAND
+                i = end + 1
+                continue
+            byte = chunk[i]
+            i += 1
+            if self._state == _COMMAND:
+                if byte == IAC:
+                    data.append(IAC)
+                    self._state = _DATA
+                elif byte in (WILL, WONT, DO, DONT):
+                    self._verb = byte
+                    self._state = _OPTION
+                elif byte == SB:
+                    self._state = _SUB
+                else:
+                    self._state = _DATA
+            elif self._state == _OPTION:
+                reply += self._answer(self._verb, byte)
+                self._state = _DATA
+            elif self._state == _SUB:
+                if byte == IAC:
+                    self._state = _SUB_IAC
+            else:
+                self._state = _DATA if byte == SE else _SUB
+        return bytes(data), bytes(reply)
+
+    def _answer(self, verb, option):
+        if verb == WILL:
+            if option in self._remote:
+                return b''
+            if option in ACCEPTED:
+                self._remote.add(option)
+                return bytes((IAC, DO, option))
+            return bytes((IAC, DONT, option))
+        if verb == WONT and option in self._remote:
+            self._remote.discard(option)
+            return bytes((IAC, DONT, option))
+        if verb == DO:
+            return bytes((IAC, WONT, option))
+        return b''
@@ -1,3 +1,1308 @@
-from django.test import TestCase
+import base64
+import glob
+import gzip
+import json
+import marshal
+import os
+import socket
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, TestCase, override_settings
+
+from rest_framework.test import APIClient
+
+from . import (ajcli, backends, budget, health, metrics, mirror, probe,
+               profiling, replication, schema, stats, submit, telnet,
+               warmup, workers)
+from .exceptions import TooManySessions
+from .jcli import connect, disconnect
+from .middleware import accepted_encoding
+from .models import (MirrorRouteConnector, MirrorRouteFilter, ProbeResult,
+                     StatsSample)
+from .fakehttpapi import FakeHTTPApiServer
+from .fakejcli import FakeJcliServer
+from .replay import ReplaySpawn, TranscriptMismatch, load
+from .routing import Message, Router
+from .tools import split_cols
+
+TRANSCRIPTS = os.path.join(os.path.dirname(__file__), 'transcripts')
+
+
+def replay(client, path):
+    """Re-issue the request recorded in the transcript at path, replaying its
+    jcli session. Returns the recorded response and the new one"""
+    transcript = load(path)
+    request = transcript['request']
+    url = request['path']
+    if request['query']:
+        url += '?' + request['query']
+    with override_settings(TELNET_TRANSPORT='replay', JCLI_REPLAY_FILE=path):
+        response = client.generic(
+            request['method'], url, request['body'],
+            content_type=request['content_type'] or 'application/octet-stream')
+    return transcript['response'], response
+
+
+class FakeJcliTestCase(TestCase):
+    """Runs the API against a FakeJcliServer, recreated for every test so
+    writes do not leak between tests"""
+    counts = dict(users=5, groups=2, filters=8, mtroutes=4, moroutes=3,
+                  smppccs=2, httpccs=2)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def setUp(self):
+        self.server = FakeJcliServer(**self.counts).start()
+        self.addCleanup(self.server.stop)
+        override = override_settings(
+            TELNET_TRANSPORT='socket', TELNET_HOST='127.0.0.1',
+            TELNET_PORT=self.server.port, TELNET_TIMEOUT=2)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(backends.close)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class UserTests(FakeJcliTestCase):
+
+    def test_list(self):
+        response = self.client.get('/api/users')
+        self.assertEqual(response.status_code, 200)
+        users = response.json()['users']
+        self.assertEqual([u['uid'] for u in users], ['u0', 'u1', 'u2', 'u3', 'u4'])
+        self.assertEqual(users[0]['status'], 'enabled')
+        self.assertEqual(
+            users[0]['mt_messaging_cred']['authorization']['smpps_send'], 'True')
+
+    def test_filters(self):
+        self.client.put('/api/users/u3/disable')
+        users = self.client.get('/api/users?gid=g1&status=enabled').json()['users']
+        self.assertEqual([u['uid'] for u in users], ['u1'])
+        users = self.client.get('/api/users?q=USER4').json()['users']
+        self.assertEqual([u['uid'] for u in users], ['u4'])
+        self.assertEqual(self.client.get('/api/users?status=gone').status_code, 400)
+
+    def test_fields_from_listing_only(self):
+        self.client.put('/api/users/u1/disable')
+        response = self.client.get('/api/users?fields=uid,status')
+        self.assertIn('desc="1 round trips"', response['Server-Timing'])
+        self.assertEqual(response.json()['users'][:2], [
+            {'uid': 'u0', 'status': 'enabled'}, {'uid': 'u1', 'status': 'disabled'}])
+        users = self.client.get('/api/users?fields=uid,mt_messaging_cred').json()['users']
+        self.assertEqual(sorted(users[0]), ['mt_messaging_cred', 'uid'])
+
+    def test_cursor_pagination(self):
+        seen = []
+        url = '/api/users?limit=2&fields=uid'
+        while True:
+            page = self.client.get(url).json()
+            seen += [u['uid'] for u in page['users']]
+            if page['next'] is None:
+                break
+            url = '/api/users?limit=2&fields=uid&cursor=' + page['next']
+        self.assertEqual(seen, ['u0', 'u1', 'u2', 'u3', 'u4'])
+        self.assertEqual(self.client.get('/api/users?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/users?cursor=not!a!cursor').status_code, 400)
+
+    def test_retrieve_unknown(self):
+        response = self.client.get('/api/users/nobody')
+        self.assertEqual(response.status_code, 404)
+
+    def test_create_update_delete(self):
+        response = self.client.post('/api/users', {
+            'uid': 'new', 'gid': 'g1', 'username': 'newbie', 'password': 'secret'})
+        self.assertEqual(response.json()['user']['gid'], 'g1')
+        response = self.client.patch('/api/users/new', [
+            ['gid', 'g0'],
+            ['mt_messaging_cred', 'authorization', 'smpps_send', 'False'],
+        ], format='json')
+        user = response.json()['user']
+        self.assertEqual(user['gid'], 'g0')
+        self.assertEqual(
+            user['mt_messaging_cred']['authorization']['smpps_send'], 'False')
+        response = self.client.delete('/api/users/new')
+        self.assertEqual(response.json(), {'uid': 'new'})
+        self.assertNotIn('new', self.server.jasmin.users)
+
+    def test_disable(self):
+        self.client.put('/api/users/u1/disable')
+        users = self.client.get('/api/users').json()['users']
+        self.assertEqual(
+            {u['uid']: u['status'] for u in users}['u1'], 'disabled')
+
+
+class GroupTests(FakeJcliTestCase):
+
+    def test_list_create_delete(self):
+        self.assertEqual(self.client.post('/api/groups', {'gid': 'new'}).status_code, 201)
+        self.client.put('/api/groups/g1/disable')
+        groups = self.client.get('/api/groups').json()['groups']
+        self.assertEqual(groups, [
+            {'name': 'g0', 'status': 'enabled'},
+            {'name': 'g1', 'status': 'disabled'},
+            {'name': 'new', 'status': 'enabled'},
+        ])
+        self.assertEqual(self.client.delete('/api/groups/new').status_code, 200)
+        self.assertEqual(self.client.delete('/api/groups/new').status_code, 404)
+
+
+class FilterTests(FakeJcliTestCase):
+
+    def test_list(self):
+        filters = self.client.get('/api/filters').json()['filters']
+        self.assertEqual(len(filters), 8)
+        self.assertEqual(filters[2]['type'], 'DestinationAddrFilter')
+        self.assertEqual(filters[2]['routes'], 'MO MT')
+
+    def test_create_delete(self):
+        response = self.client.post('/api/filters', {
+            'type': 'TagFilter', 'fid': 'tag9', 'parameter': '9'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.jasmin.filters['tag9']['type'], 'TagFilter')
+        self.assertEqual(self.client.delete('/api/filters/tag9').json(), {'fid': 'tag9'})
+
+
+class RouterTests(FakeJcliTestCase):
+
+    def test_mtrouter_list(self):
+        routes = self.client.get('/api/mtrouters').json()['mtrouters']
+        self.assertEqual([r['order'] for r in routes], ['30', '20', '10', '0'])
+        self.assertEqual(routes[-1]['type'], 'DefaultRoute')
+        self.assertEqual(routes[-1]['connectors'], ['smppc(smppc0)'])
+
+    def test_mtrouter_create_delete(self):
+        response = self.client.post('/api/mtrouters', {
+            'type': 'StaticMTRoute', 'order': '100', 'rate': '0.5',
+            'smppconnectors': 'smppc1', 'filters': 'f2'})
+        route = response.json()['mtrouter']['mtrouter']
+        self.assertEqual(route['connectors'], ['smppc(smppc1)'])
+        self.assertEqual(route['filters'], ['<DA (dst_addr=^2762)>'])
+        self.assertEqual(self.client.delete('/api/mtrouters/100').status_code, 200)
+        self.assertEqual(self.client.delete('/api/mtrouters/100').status_code, 404)
+
+    def test_morouter_list_and_flush(self):
+        routes = self.client.get('/api/morouters').json()['morouters']
+        self.assertEqual(routes[0]['connectors'], ['http(http0)'])
+        self.client.delete('/api/morouters/flush')
+        self.assertEqual(self.client.get('/api/morouters').json(), {'morouters': []})
+
+
+class ConnectorTests(FakeJcliTestCase):
+
+    def test_smppccm_list_start_update(self):
+        self.client.put('/api/smppsconns/smppc1/start')
+        connectors = self.client.get('/api/smppsconns').json()['connectors']
+        self.assertEqual(
+            [(c['cid'], c['status'], c['session']) for c in connectors],
+            [('smppc0', 'stopped', 'None'), ('smppc1', 'started', 'BOUND_TRX')])
+        self.assertEqual(self.client.put('/api/smppsconns/smppc1/start').status_code, 400)
+        response = self.client.patch(
+            '/api/smppsconns/smppc0', {'host': '10.0.0.1'}, format='json')
+        self.assertEqual(response.json()['connector']['host'], '10.0.0.1')
+
+    def test_httpccm_create_retrieve(self):
+        self.client.post('/api/httpsconns', {
+            'cid': 'web', 'url': 'http://example.com/mo', 'method': 'POST'}, format='json')
+        connector = self.client.get('/api/httpsconns/web').json()['connector']
+        self.assertEqual(connector['url'], 'http://example.com/mo')
+        self.assertEqual(connector['method'], 'POST')
+
+
+class ExportTests(FakeJcliTestCase):
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(l) for l in b''.join(response.streaming_content).splitlines()]
+
+    def test_filters_and_routes_match_list(self):
+        for name in ('filters', 'mtrouters', 'morouters'):
+            with self.subTest(name=name):
+                self.assertEqual(
+                    self.export('/api/%s/export' % name),
+                    self.client.get('/api/%s' % name).json()[name])
+
+    def test_users(self):
+        self.assertEqual(
+            self.export('/api/users/export?gid=g0&fields=uid,username'),
+            [{'uid': 'u0', 'username': 'user0'}, {'uid': 'u2', 'username': 'user2'},
+             {'uid': 'u4', 'username': 'user4'}])
+        users = self.export('/api/users/export')
+        self.assertEqual(users, self.client.get('/api/users').json()['users'])
+
+    @override_settings(JCLI_POOL_SIZE=0)
+    def test_disconnects_when_stream_ends(self):
+        sessions = metrics.JCLI_SESSIONS_OPEN.get()
+        response = self.client.get('/api/filters/export')
+        content = iter(response.streaming_content)
+        next(content)
+        self.assertEqual(metrics.JCLI_SESSIONS_OPEN.get(), sessions + 1)
+        b''.join(content)
+        self.assertEqual(metrics.JCLI_SESSIONS_OPEN.get(), sessions)
+        response = self.client.get('/api/filters/export')
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(metrics.JCLI_SESSIONS_OPEN.get(), sessions)
+
+
+class CompressionTests(FakeJcliTestCase):
+
+    def test_gzip_above_threshold(self):
+        response = self.client.get('/api/users', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        users = json.loads(gzip.decompress(response.content))['users']
+        self.assertEqual(len(users), 5)
+        response = self.client.get('/api/groups', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_gzip_stream(self):
+        response = self.client.get('/api/filters/export', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 8)
+
+    def test_accepted_encoding(self):
+        self.assertEqual(accepted_encoding('gzip;q=0.5, identity'), 'gzip')
+        self.assertIsNone(accepted_encoding('gzip;q=0'))
+        self.assertIsNone(accepted_encoding(''))
+
+    def test_same_json_without_orjson(self):
+        fast = self.client.get('/api/mtrouters').json()
+        with override_settings(FAST_JSON=False):
+            self.assertEqual(self.client.get('/api/mtrouters').json(), fast)
+
+
+class InstrumentationTests(FakeJcliTestCase):
+
+    def test_server_timing_counts_round_trips(self):
+        response = self.client.get('/api/groups')
+        self.assertIn('jcli;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 round trips"', response['Server-Timing'])
+
+    @override_settings(SERVER_TIMING_DEBUG=True)
+    def test_server_timing_debug(self):
+        response = self.client.get('/api/groups')
+        self.assertEqual(response.json()['debug_timing']['jcli_round_trips'], 1)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    def test_metrics_without_jcli(self):
+        self.client.get('/api/smppsconns')
+        self.server.stop()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'jasmin_api_jcli_command_seconds_count{command="smppccm -s"}',
+            response.content.decode())
+
+    def test_login_failure(self):
+        with override_settings(TELNET_PW='wrong'):
+            self.client.raise_request_exception = False
+            response = self.client.get('/api/groups')
+        self.assertEqual(response.status_code, 403)
+
+
+class MirrorTests(FakeJcliTestCase):
+    paths = ('/api/users', '/api/users/u1', '/api/groups', '/api/filters',
+             '/api/filters/f2', '/api/mtrouters', '/api/mtrouters/10',
+             '/api/morouters', '/api/smppsconns', '/api/smppsconns/smppc1',
+             '/api/httpsconns', '/api/httpsconns/http0')
+
+    def test_reads_without_jcli(self):
+        live = {p: self.client.get(p + '?source=jcli').json() for p in self.paths}
+        mirror.sync()
+        self.server.stop()
+        for path in self.paths:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('X-Mirror-Age', response)
+                self.assertEqual(response.json(), live[path])
+        response = self.client.get('/api/users?gid=g1&fields=uid')
+        self.assertEqual(response.json()['users'], [{'uid': 'u1'}, {'uid': 'u3'}])
+
+    def test_live_list_refreshes(self):
+        self.client.get('/api/groups')
+        self.server.stop()
+        response = self.client.get('/api/groups')
+        self.assertIn('X-Mirror-Age', response)
+
+    def test_writes_update_mirror(self):
+        mirror.sync()
+        self.client.post('/api/groups', {'gid': 'g9'})
+        self.client.put('/api/users/u0/disable')
+        self.client.delete('/api/mtrouters/20')
+        self.client.put('/api/smppsconns/smppc1/start')
+        self.server.stop()
+        self.assertIn({'name': 'g9', 'status': 'enabled'},
+                      self.client.get('/api/groups').json()['groups'])
+        users = self.client.get('/api/users?status=disabled&fields=uid').json()
+        self.assertEqual(users['users'], [{'uid': 'u0'}])
+        orders = [r['order'] for r in self.client.get('/api/mtrouters').json()['mtrouters']]
+        self.assertNotIn('20', orders)
+        connector = self.client.get('/api/smppsconns/smppc1').json()['connector']
+        self.assertEqual(connector['status'], 'started')
+
+    def test_stale_or_forced_reads_use_jcli(self):
+        mirror.sync(['groups'])
+        self.assertIn('X-Mirror-Age', self.client.get('/api/groups'))
+        self.assertNotIn('X-Mirror-Age', self.client.get('/api/groups?source=jcli'))
+        with override_settings(MIRROR_MAX_AGE=-1):
+            self.assertNotIn('X-Mirror-Age', self.client.get('/api/groups'))
+        self.assertNotIn('X-Mirror-Age', self.client.get('/api/filters'))
+
+    def test_route_references(self):
+        mirror.sync(['filters', 'mtrouters'])
+        routes = MirrorRouteConnector.objects.filter(cid='smppc0')
+        self.assertEqual(
+            sorted(r.route.order for r in routes.select_related('route')), [0, 20])
+        self.assertEqual(
+            MirrorRouteFilter.objects.get(route__router='mt', route__order=10).fid, 'f1')
+
+
+class ReverseIndexTests(FakeJcliTestCase):
+
+    def test_group_users(self):
+        users = self.client.get('/api/groups/g1/users').json()['users']
+        self.assertEqual([u['uid'] for u in users], ['u1', 'u3'])
+        self.client.patch('/api/users/u1', [['gid', 'g0']], format='json')
+        self.server.stop()
+        users = self.client.get('/api/groups/g1/users').json()['users']
+        self.assertEqual([u['uid'] for u in users], ['u3'])
+        self.assertEqual(self.client.get('/api/groups/g7/users').status_code, 404)
+
+    def test_connector_routes(self):
+        routes = self.client.get('/api/smppsconns/smppc0/routes').json()['mtrouters']
+        self.assertEqual([r['order'] for r in routes], ['20', '0'])
+        self.client.delete('/api/mtrouters/20')
+        routes = self.client.get('/api/smppsconns/smppc0/routes').json()['mtrouters']
+        self.assertEqual([r['order'] for r in routes], ['0'])
+        self.assertEqual(
+            self.client.get('/api/smppsconns/nothere/routes').status_code, 404)
+
+    def test_filter_routes(self):
+        routes = self.client.get('/api/filters/f1/routes').json()
+        self.assertEqual([r['order'] for r in routes['mtrouters']], ['10'])
+        self.client.post('/api/mtrouters', {
+            'type': 'StaticMTRoute', 'order': '100', 'rate': '0.5',
+            'smppconnectors': 'smppc1', 'filters': 'f1'})
+        routes = self.client.get('/api/filters/f1/routes').json()
+        self.assertEqual([r['order'] for r in routes['mtrouters']], ['100', '10'])
+        self.assertEqual(self.client.get('/api/filters/f99/routes').status_code, 404)
+
+
+class DeleteCheckTests(FakeJcliTestCase):
+
+    def test_group_in_use(self):
+        response = self.client.delete('/api/groups/g1')
+        self.assertEqual(response.status_code, 409)
+        #f1 is a group filter on g1, used by MT route 10
+        self.assertEqual(response.json()['dependents'], {
+            'users': ['u1', 'u3'], 'filters': ['f1'],
+            'mtrouters': ['10'], 'morouters': []})
+        self.assertIn('g1', self.server.jasmin.groups)
+        self.assertEqual(self.client.delete('/api/groups/g1?force=true').status_code, 200)
+        self.assertNotIn('g1', self.server.jasmin.groups)
+
+    def test_preview_without_jcli(self):
+        mirror.sync()
+        self.server.stop()
+        response = self.client.delete('/api/smppsconns/smppc0?preview=true')
+        #routes sending to it, and MO route 20 through connector filter f4
+        self.assertEqual(response.json()['dependents'], {
+            'users': [], 'filters': ['f4'], 'mtrouters': ['20', '0'],
+            'morouters': ['20']})
+
+    def test_unused(self):
+        self.client.post('/api/groups', {'gid': 'empty'})
+        self.assertEqual(self.client.delete('/api/groups/empty').status_code, 200)
+        self.assertEqual(self.client.delete('/api/filters/f2').status_code, 409)
+        self.client.delete('/api/mtrouters/20')
+        self.assertEqual(self.client.delete('/api/filters/f2').status_code, 200)
+
+
+class SimulateTests(FakeJcliTestCase):
+
+    def test_simulate(self):
+        cases = [
+            ({'source_addr': '1003', 'destination_addr': '27621'}, '30', 'smppc(smppc1)'),
+            ({'destination_addr': '27621'}, '20', 'smppc(smppc0)'),
+            ({'uid': 'u1', 'gid': 'g1'}, '10', 'smppc(smppc1)'),
+            ({'destination_addr': '3312'}, '0', 'smppc(smppc0)'),
+        ]
+        for message, order, connector in cases:
+            with self.subTest(message=message):
+                decision = self.client.post(
+                    '/api/mtrouters/simulate', message, format='json').json()
+                self.assertEqual(decision['route']['order'], order)
+                self.assertEqual(decision['connector'], connector)
+        results = self.client.post('/api/mtrouters/simulate', {
+            'messages': [m for m, _, _ in cases]}, format='json').json()['results']
+        self.assertEqual([r['route']['order'] for r in results], ['30', '20', '10', '0'])
+        response = self.client.post(
+            '/api/mtrouters/simulate', {'sender': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        #numbers are taken as strings, other types are rejected
+        decision = self.client.post(
+            '/api/mtrouters/simulate', {'destination_addr': 27621}, format='json').json()
+        self.assertEqual(decision['route']['order'], '20')
+        for body in ({'messages': 5}, [{'destination_addr': '27621'}],
+                     {'destination_addr': ['27621']}, {'tags': {'a': 1}}):
+            with self.subTest(body=body):
+                response = self.client.post(
+                    '/api/mtrouters/simulate', body, format='json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_router(self):
+        router = Router('mt', [
+            {'order': '40', 'type': 'StaticMTRoute', 'connectors': ['smppc(a)'],
+             'filters': ['<Ev (pyCode=if routable ..)>']},
+            {'order': '30', 'type': 'StaticMTRoute', 'connectors': ['smppc(b)'],
+             'filters': ['<TG (tag=7)>', '<TI (08:00:00;18:00:00)>']},
+            {'order': '20', 'type': 'RandomRoundrobinMTRoute',
+             'connectors': ['smppc(c)', 'smppc(d)'], 'filters': ['<SM (msg=^STOP)>']},
+        ])
+        noon = datetime(2024, 1, 1, 12, 0)
+        route, connector, undetermined = router.route(
+            Message(tags=['7'], time=noon))
+        self.assertEqual((route['order'], connector, undetermined),
+                         ('30', 'smppc(b)', ['40']))
+        route, connector, _ = router.route(
+            Message(tags=['7'], content='STOP', time=noon.replace(hour=20)))
+        self.assertEqual((route['order'], connector), ('20', None))
+        self.assertEqual(router.route(Message()), (None, None, ['40']))
+        #times with an offset are matched as the local time they are
+        for offset in (-9, 2, 9):
+            with self.subTest(offset=offset):
+                zone = timezone(timedelta(hours=offset))
+                route, _, _ = router.route(
+                    Message(tags=['7'], time=noon.astimezone().astimezone(zone)))
+                self.assertEqual(route['order'], '30')
+        #TIME_ZONE is UTC
+        self.assertEqual(Message.from_data({'time': '2024-01-01T23:30:00+02:00'}).time,
+                         datetime(2024, 1, 1, 21, 30))
+
+    def test_dryrun(self):
+        body = ('source_addr,destination_addr,uid,gid\n1003,27621,,\n'
+                ',27621,,\n,27622,u1,g1\n,3312,u1,g1\n')
+        response = self.client.post(
+            '/api/mtrouters/dryrun', body, content_type='text/csv')
+        lines = [json.loads(l) for l in
+                 b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(l['row'], l['order'], l['connector']) for l in lines[:-1]], [
+            (1, '30', 'smppc(smppc1)'), (2, '20', 'smppc(smppc0)'),
+            (3, '20', 'smppc(smppc0)'), (4, '10', 'smppc(smppc1)')])
+        self.assertEqual(lines[-1]['summary'], {
+            'rows': 4, 'connectors': {'smppc(smppc1)': 2, 'smppc(smppc0)': 2},
+            'unrouted': 0, 'undetermined': 0})
+        body = '{"connector": "smppc0"}\n\n{"connector": "smppc1"}\n'
+        summary = self.client.post(
+            '/api/morouters/dryrun?rows=false', body,
+            content_type='application/x-ndjson').json()['summary']
+        self.assertEqual(summary['rows'], 2)
+        self.assertEqual(sum(summary['connectors'].values()) + summary['unrouted'], 2)
+
+    def test_diff(self):
+        messages = [
+            {'destination_addr': '27621'}, {'source_addr': '1003', 'destination_addr': '555'},
+            {'destination_addr': '3312'}, {'uid': 'u1', 'gid': 'g1', 'destination_addr': '999'}]
+        routes = [
+            {'order': '20', 'type': 'StaticMTRoute', 'connectors': ['smppc(smppc1)'],
+             'filters': ['f2']},
+            {'order': '0', 'type': 'DefaultRoute', 'connectors': ['smppc(smppc0)'],
+             'filters': []}]
+        result = self.client.post('/api/mtrouters/diff', {
+            'routes': routes, 'messages': messages}, format='json').json()
+        self.assertEqual([c['row'] for c in result['changes']], [1, 2, 4])
+        self.assertEqual(result['changes'][0]['current']['order'], '20')
+        self.assertEqual(result['changes'][0]['proposed']['connector'], 'smppc(smppc1)')
+        self.assertEqual(result['connectors'], {
+            'smppc(smppc0)': {'current': 2, 'proposed': 3, 'delta': 1},
+            'smppc(smppc1)': {'current': 2, 'proposed': 1, 'delta': -1}})
+        #a filter change reaches the routes using it
+        traffic = SimpleUploadedFile(
+            'traffic.csv', b'uid,gid,destination_addr\nu1,g1,3312\nu1,g1,27621\n')
+        result = self.client.post('/api/mtrouters/diff?rows=false', {
+            'filters': json.dumps([{'fid': 'f2', 'description': '<DA (dst_addr=^3312)>'}]),
+            'traffic': traffic}).json()
+        self.assertEqual((result['rows'], result['changed']), (2, 2))
+        self.assertNotIn('changes', result)
+        for proposal in ({'routes': [{'order': '1'}]},
+                         {'routes': [dict(routes[0], filters=[{'a': 1}])]},
+                         {'routes': [dict(routes[0], filters='f2')]},
+                         {'filters': 5},
+                         {'routes': routes, 'messages': [5]},
+                         {'routes': routes, 'messages': [['27621']]}):
+            with self.subTest(proposal=proposal):
+                response = self.client.post('/api/mtrouters/diff', dict(
+                    {'messages': messages}, **proposal), format='json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_dryrun_invalid(self):
+        response = self.client.post(
+            '/api/mtrouters/dryrun?rows=false', '{"sender": "x"}',
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/mtrouters/dryrun', '{"uid": "u1"}\nnot json\n',
+            content_type='application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(json.loads(lines[-1]), {'error': 'Row 2: Invalid message: not json'})
+
+
+class StatsTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        stats._store = None
+
+    def test_ring(self):
+        ring = stats.Ring(3)
+        for when, value in ((1, 10), (2, 20), (3, 5), (4, 15)):
+            ring.append(when, value)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.last(), (4, 15))
+        self.assertEqual(ring.window(1.5, 4), [(2, 20), (3, 5), (4, 15)])
+        self.assertEqual(ring.window(10, 4), [(2, 20), (3, 5), (4, 15)])
+        #the counter was reset between 2 and 3
+        self.assertEqual(stats.increase(ring.window(10, 4)), 15)
+        self.assertEqual(stats.increase(ring.window(10, 4), counter=False), -5)
+
+    def test_sample(self):
+        telnet = connect()
+        self.addCleanup(disconnect, telnet)
+        now = time.time()
+        stats.sample(telnet, now - 61)
+        counters = self.server.jasmin.smppc_stats('smppc0')
+        counters['submit_sm_count'] = 30
+        counters['interceptor_count'] = 6
+        self.server.jasmin.user_stats('u1')[('HTTP Api', 'connects_count')] = 12
+        stats.sample(telnet, now - 1)
+        result = self.client.get('/api/stats/smppcs/smppc0?window=1m,1h').json()
+        submits = result['series']['submit_sm_count']
+        self.assertEqual(submits['value'], 30)
+        self.assertEqual(submits['windows']['1m']['delta'], 30)
+        self.assertAlmostEqual(submits['windows']['1m']['rate'], 0.5)
+        self.assertEqual(result['series']['interceptor_count']['windows']['1h']['delta'], 6)
+        self.assertEqual(result['info']['bound_at'], 'ND')
+        users = self.client.get('/api/stats/users?window=5m').json()
+        self.assertEqual([u['uid'] for u in users['stats']], ['u0', 'u1', 'u2', 'u3', 'u4'])
+        series = users['stats'][1]['series']
+        self.assertEqual(series['http.connects_count']['windows']['5m']['delta'], 12)
+        self.assertEqual(series['smpps.bound_connections']['windows']['5m']['rate'], None)
+        self.assertEqual(self.client.get('/api/stats/users/nobody').status_code, 404)
+        self.assertEqual(self.client.get('/api/stats/users?window=5x').status_code, 400)
+        #deleted users are forgotten
+        del self.server.jasmin.users['u4']
+        stats.sample(telnet)
+        self.assertEqual(self.client.get('/api/stats/users/u4').status_code, 404)
+
+    @override_settings(STATS_RING_SIZE=2)
+    def test_rounds_kept(self):
+        telnet = connect()
+        self.addCleanup(disconnect, telnet)
+        now = time.time()
+        for seconds in (30, 20, 10):
+            stats.sample(telnet, now - seconds)
+        self.assertEqual(
+            sorted(set(StatsSample.objects.values_list('time', flat=True))),
+            [now - 20, now - 10])
+        self.assertEqual(StatsSample.objects.filter(kind='user').count(), 10)
+        users = self.client.get('/api/stats/users').json()
+        self.assertEqual(users['sampled_at'], now - 10)
+        self.assertEqual(users['stats'][0]['series']['http.connects_count']
+                         ['windows']['1m']['span'], 10)
+
+
+class SubmitTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = FakeHTTPApiServer().start()
+        self.addCleanup(self.api.stop)
+        override = override_settings(
+            JASMIN_HTTP_URL=self.api.url, SUBMIT_CONCURRENCY=4)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_batch(self):
+        messages = [{'to': '2762%04d' % i, 'content': 'hello %d' % i} for i in range(40)]
+        messages[3] = {'to': '27620003'}
+        response = self.client.post('/api/messages', {
+            'username': 'foo', 'password': 'bar', 'from': 'ACME',
+            'messages': messages}, format='json').json()
+        self.assertEqual((response['sent'], response['failed']), (39, 1))
+        results = response['results']
+        self.assertEqual(results[3], {
+            'status': 'error', 'http_status': 400,
+            'error': 'Mandatory argument [content] is not found.'})
+        sent = {m['id']: m for m in self.api.messages}
+        self.assertEqual(sent[results[0]['id']]['to'], '27620000')
+        self.assertEqual(sent[results[39]['id']]['from'], 'ACME')
+        #kept alive and reused, at most one connection per worker
+        self.assertLessEqual(self.api.connections, 4)
+        self.client.post('/api/messages', {
+            'username': 'foo', 'password': 'bar', 'messages': messages}, format='json')
+        self.assertLessEqual(self.api.connections, 4)
+
+    def test_invalid(self):
+        response = self.client.post('/api/messages', {
+            'username': 'foo', 'password': 'wrong',
+            'messages': [{'to': '1', 'content': 'x'}]}, format='json').json()
+        self.assertEqual(response['results'][0]['http_status'], 403)
+        for batch in ({'username': 'foo', 'password': 'bar', 'messages': []},
+                      {'messages': [{'to': '1'}]},
+                      {'username': 'foo', 'password': 'bar',
+                       'messages': [{'to': '1', 'sender': 'x'}]}):
+            response = self.client.post('/api/messages', batch, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.messages, [])
+
+    def test_no_resend(self):
+        message = {'username': 'foo', 'password': 'bar', 'to': '1', 'content': 'x'}
+        self.assertEqual(submit.send(message)['status'], 'success')
+        #the reused connection is closed once the message was read
+        self.api.drop = 1
+        result = submit.send(message)
+        self.assertEqual((result['status'], result['http_status']), ('error', None))
+        self.assertEqual(len(self.api.messages), 2)
+        #an idle connection the server closed is replaced
+        self.api.idle_timeout = 0.1
+        self.assertEqual(submit.send(message)['status'], 'success')
+        time.sleep(0.3)
+        self.assertEqual(submit.send(message)['status'], 'success')
+        self.assertEqual((len(self.api.messages), self.api.connections), (4, 3))
+
+    @override_settings(JASMIN_HTTP_URL='http://127.0.0.1:1')
+    def test_unreachable(self):
+        result = self.client.post('/api/messages', {
+            'username': 'foo', 'password': 'bar',
+            'messages': [{'to': '1', 'content': 'x'}]}, format='json').json()
+        self.assertEqual(result['results'][0]['http_status'], None)
+
+
+@override_settings(PROBE_TIMEOUT=0.5, PROBE_TTL=60)
+class ProbeTests(FakeJcliTestCase):
+
+    def blackhole(self):
+        "URL of a socket accepting connections and never answering"
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(8)
+        self.addCleanup(sock.close)
+        return 'http://127.0.0.1:%d/mo' % sock.getsockname()[1]
+
+    def test_probe(self):
+        api = FakeHTTPApiServer().start()
+        self.addCleanup(api.stop)
+        self.server.jasmin.httpccs['http0']['url'] = api.url + '/mo'
+        self.server.jasmin.httpccs['http1']['url'] = 'http://127.0.0.1:1/mo'
+        for i in (2, 3):
+            self.client.post('/api/httpsconns', {
+                'cid': 'http%d' % i, 'url': self.blackhole(), 'method': 'GET'})
+        start = time.monotonic()
+        connectors = self.client.get('/api/httpsconns/probe').json()['connectors']
+        #the two unanswering hosts time out together
+        self.assertLess(time.monotonic() - start, 1.0)
+        results = {c['cid']: c for c in connectors}
+        self.assertEqual((results['http0']['reachable'], results['http0']['status']),
+                         (True, 501))
+        self.assertFalse(results['http1']['reachable'])
+        self.assertEqual(results['http2']['error'], 'Timed out')
+        #stored for every worker to reuse
+        self.assertEqual(ProbeResult.objects.count(), 4)
+        cached = self.client.get('/api/httpsconns/probe').json()['connectors']
+        self.assertEqual(cached, connectors)
+        refreshed = self.client.get('/api/httpsconns/probe?refresh=true').json()
+        self.assertGreater(refreshed['connectors'][0]['checked_at'],
+                           connectors[0]['checked_at'])
+
+    def test_host_timeout(self):
+        url = self.blackhole()
+        with override_settings(PROBE_TIMEOUTS={'127.0.0.1': 0.1}):
+            result = probe.probe([url], refresh=True)[url]
+        self.assertLess(result['latency_ms'], 400)
+        self.assertEqual(probe.probe(['ftp://x'])['ftp://x']['error'], 'Invalid URL')
+
+
+class BackendTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = FakeJcliServer(users=2, smppccs=1).start()
+        self.addCleanup(self.other.stop)
+        override = override_settings(JASMIN_BACKENDS={
+            'default': {}, 'other': {'port': self.other.port}})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(backends.close)
+
+    def test_pool(self):
+        opened = metrics.JCLI_SESSIONS_OPENED.get()
+        self.client.post('/api/groups', {'gid': 'new'})
+        backends._settling.join()
+        groups = self.client.get('/api/groups?source=jcli').json()['groups']
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(metrics.JCLI_SESSIONS_OPENED.get(), opened + 1)
+        #a failed request may leave jcli mid way, its session is closed
+        self.assertEqual(self.client.get('/api/users/nobody').status_code, 404)
+        backends._settling.join()
+        self.client.get('/api/groups?source=jcli')
+        self.assertEqual(metrics.JCLI_SESSIONS_OPENED.get(), opened + 2)
+
+    def test_select_backend(self):
+        users = self.client.get('/api/backends/other/users').json()['users']
+        self.assertEqual([u['uid'] for u in users], ['u0', 'u1'])
+        response = self.client.get('/api/users', HTTP_X_JASMIN_BACKEND='other')
+        self.assertEqual(len(response.json()['users']), 2)
+        #only the default backend is mirrored
+        self.assertIsNone(mirror.synced_at('users'))
+        self.assertEqual(len(self.client.get('/api/users').json()['users']), 5)
+        self.assertEqual(
+            self.client.get('/api/backends/nowhere/users').status_code, 404)
+
+    def test_cluster(self):
+        connectors = self.client.get('/api/cluster/smppsconns').json()
+        self.assertEqual(
+            [(c['backend'], c['cid']) for c in connectors['connectors']],
+            [('default', 'smppc0'), ('default', 'smppc1'), ('other', 'smppc0')])
+        self.assertEqual(connectors['errors'], [])
+        self.other.stop()
+        with override_settings(JASMIN_BACKENDS={
+                'default': {}, 'gone': {'port': self.other.port}}):
+            users = self.client.get('/api/cluster/users').json()
+        self.assertEqual(len(users['users']), 5)
+        self.assertEqual(users['errors'],
+                         [{'backend': 'gone', 'detail': 'Could not connect to jcli'}])
+
+    @override_settings(JCLI_MAX_SESSIONS=1, JCLI_POOL_SIZE=0)
+    def test_session_budget(self):
+        backend = backends.get('other')
+        telnet = connect(backend)
+        with self.assertRaises(TooManySessions):
+            budget.take(backend, 0)
+        #the budget is per backend
+        budget.take(backends.get('default'), 0).release()
+        disconnect(telnet)
+        budget.take(backend, 0).release()
+        #requests wait for a slot, then give up
+        with override_settings(TELNET_TIMEOUT=0.1):
+            slot = budget.take(backend)
+            response = self.client.get('/api/backends/other/users')
+            slot.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(
+            self.client.get('/api/backends/other/users').json()['users']), 2)
+
+    @override_settings(JCLI_MAX_SESSIONS=1)
+    def test_reclaim_budget(self):
+        self.addCleanup(budget.worker, None)
+        self.addCleanup(setattr, budget, '_held', None)
+        budget.setup(workers=2)
+        backend = backends.get('other')
+        pid = os.fork()
+        if not pid:
+            #a worker dying with its slot taken
+            budget.worker(1)
+            budget.take(backend, 0)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        with self.assertRaises(TooManySessions):
+            budget.take(backend, 0)
+        self.assertEqual(budget.reclaim(1), 1)
+        self.assertEqual(budget.reclaim(1), 0)
+        budget.worker(0)
+        slot = budget.take(backend, 0)
+        self.assertEqual(list(budget._held), [0, 1, 0, 0])
+        slot.release()
+        self.assertEqual(budget.reclaim(0), 0)
+
+
+class ReplicationTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.standby = FakeJcliServer(
+            users=3, groups=1, filters=4, mtroutes=2, moroutes=1).start()
+        self.addCleanup(self.standby.stop)
+        self.standby.jasmin.groups['old'] = {'enabled': True}
+        self.server.jasmin.users['u1']['credentials'][
+            ('mt_messaging_cred', 'authorization', 'smpps_send')] = 'False'
+        override = override_settings(JASMIN_BACKENDS={
+            'default': {}, 'standby': {'port': self.standby.port}})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(backends.close)
+
+    def snapshot(self, name):
+        return backends.run(backends.get(name), replication.snapshot)
+
+    def test_dry_run(self):
+        before = self.snapshot('standby')
+        report = self.client.post('/api/cluster/replicate', {
+            'dry_run': True, 'passwords': {'u3': 'secret'}}, format='json').json()
+        standby, = report['standbys']
+        commands = [o['command'] for o in standby['operations']]
+        self.assertIn('group -a', commands)
+        self.assertIn('group -r old', commands)
+        self.assertIn('user -u u1', commands)
+        self.assertLess(commands.index('filter -r f1'), commands.index('filter -a'))
+        added = [o for o in standby['operations'] if o['command'] == 'user -a']
+        self.assertEqual([o['keys']['password'] for o in added], ['***'])
+        self.assertEqual(standby['skipped'], [
+            {'module': 'user', 'id': 'u4', 'reason': 'Password not given'}])
+        self.assertEqual(self.snapshot('standby'), before)
+        self.assertEqual(self.standby.jasmin.persists, 0)
+
+    def test_replicate(self):
+        report = replication.replicate(passwords={'u3': 'a', 'u4': 'b'})
+        self.assertEqual(report['standbys'][0]['errors'], [])
+        self.assertEqual(self.snapshot('standby'), self.snapshot('default'))
+        self.assertEqual(self.standby.jasmin.persists, 1)
+        self.assertEqual(self.server.jasmin.persists, 0)
+        report = replication.replicate()
+        self.assertEqual(report['standbys'][0]['operations'], [])
+        self.assertEqual(
+            self.client.post('/api/cluster/replicate', {'standbys': ['nowhere']},
+                             format='json').status_code, 404)
+
+
+@override_settings(MIRROR_ENABLED=False)
+class AsyncViewTests(FakeJcliTestCase):
+
+    def basic(self, password='pw'):
+        credentials = base64.b64encode(('admin:%s' % password).encode()).decode()
+        return {'Authorization': 'Basic ' + credentials}
+
+    async def test_reads(self):
+        client = AsyncClient()
+        for path in ('/api/groups', '/api/users', '/api/users/u1',
+                     '/api/users?fields=uid,status&limit=2', '/api/filters',
+                     '/api/filters/f1', '/api/mtrouters', '/api/morouters/0'):
+            response = await client.get(path, headers=self.basic())
+            self.assertEqual(response.status_code, 200, path)
+            self.assertIn('jcli;dur=', response['Server-Timing'])
+            expected = await self.sync_get(path)
+            self.assertEqual(response.json(), expected, path)
+        #one async session served every read, one after the other
+        self.assertEqual(len(ajcli.pool(backends.get('default')).idle), 1)
+        response = await client.get('/api/users/nobody', headers=self.basic())
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'Unknown user: nobody'})
+        ajcli.close()
+
+    async def test_writes_and_auth(self):
+        client = AsyncClient()
+        response = await client.post(
+            '/api/groups', {'gid': 'g9'}, content_type='application/json',
+            headers=self.basic())
+        self.assertEqual(response.status_code, 201)
+        groups = (await client.get('/api/groups', headers=self.basic())).json()
+        self.assertIn({'name': 'g9', 'status': 'enabled'}, groups['groups'])
+        response = await client.get('/api/groups')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
+        response = await client.get('/api/users/u1', headers=self.basic('wrong'))
+        self.assertEqual(response.status_code, 401)
+        ajcli.close()
+
+    @sync_to_async
+    def sync_get(self, path):
+        return self.client.get(path).json()
+
+
+class WarmupTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(warmup._state.update, status='ready')
+
+    def test_ready_once_warm(self):
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+        opened = metrics.JCLI_SESSIONS_OPENED.get()
+        self.server.login_latency = 0.2
+        thread = warmup.start()
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'warming')
+        thread.join()
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sessions'], {'default': 2})
+        self.assertEqual(metrics.JCLI_SESSIONS_OPENED.get(), opened + 2)
+        #requests use the warm sessions
+        self.client.get('/api/groups?source=jcli')
+        self.assertEqual(metrics.JCLI_SESSIONS_OPENED.get(), opened + 2)
+
+    def test_preload(self):
+        warmup.run(preload=True)
+        self.assertEqual(warmup.state()['preloaded'], list(mirror.TABLES))
+        self.assertIsNotNone(mirror.synced_at('users'))
+        backends._settling.join()
+        self.server.stop()
+        #the pool is full already
+        warmup.start().join()
+        self.assertEqual(warmup.state()['sessions'], {'default': 2})
+        backends.close()
+        with self.assertLogs('rest_api.warmup', 'WARNING'):
+            warmup.start().join()
+        state = warmup.state()
+        self.assertEqual(state['status'], 'ready')
+        self.assertEqual(state['errors'], [{'stage': 'sessions', 'backend': 'default',
+                                            'detail': 'Could not connect to jcli'}])
+
+
+class WorkerTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(WORKERS_DIR=None)
+        override.enable()
+        self.addCleanup(override.disable)
+        workers.setup(directory.name)
+        self.addCleanup(setattr, workers, '_index', None)
+        workers._index = 0
+        self.addCleanup(warmup._state.update, status='ready')
+
+    def other(self, opened, in_flight, status='ready'):
+        "Dump the state of a worker 1 with these values"
+        snapshot = metrics.snapshot()
+        snapshot['jasmin_api_jcli_sessions_opened'] = {(): opened}
+        snapshot['jasmin_api_http_requests_in_flight'] = {(): in_flight}
+        workers._write(workers._worker_file(1), {
+            'index': 1, 'pid': 1, 'metrics': workers._encode(snapshot),
+            'warmup': dict(warmup.state(), status=status)})
+
+    def scraped(self, name):
+        for line in self.client.get('/metrics').content.decode().splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split()[1])
+
+    def test_metrics(self):
+        opened = metrics.JCLI_SESSIONS_OPENED.get()
+        in_flight = metrics.HTTP_REQUESTS_IN_FLIGHT.get()
+        self.other(5, 2)
+        self.assertEqual(
+            self.scraped('jasmin_api_jcli_sessions_opened_total'), opened + 5)
+        self.assertEqual(
+            self.scraped('jasmin_api_http_requests_in_flight'), in_flight + 2)
+        #a dead worker's counters are kept, its gauges dropped
+        workers.retire(1)
+        self.other(1, 1)
+        self.assertEqual(
+            self.scraped('jasmin_api_jcli_sessions_opened_total'), opened + 6)
+        self.assertEqual(
+            self.scraped('jasmin_api_http_requests_in_flight'), in_flight + 1)
+        workers.dump()
+        self.assertTrue(os.path.exists(workers._worker_file(0)))
+
+    def test_readiness(self):
+        self.other(0, 0, status='warming')
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['workers'], {'0': 'ready', '1': 'warming'})
+        self.other(0, 0)
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+
+
+class HealthTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        health._backends.clear()
+
+    def probe(self, path='/healthz'):
+        "The default backend as path reports it, checking no session opened"
+        opened = metrics.JCLI_SESSIONS_OPENED.get()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.JCLI_SESSIONS_OPENED.get(), opened)
+        return response.json()['backends']['default']
+
+    def test_backend_state(self):
+        self.assertEqual(self.probe()['state'], 'unknown')
+        self.client.get('/api/groups?source=jcli')
+        backends._settling.join()
+        backend = self.probe()
+        self.assertEqual(backend['state'], 'ok')
+        self.assertLessEqual(backend['last_contact'], time.time())
+        self.assertEqual(backend['sessions']['idle'], 1)
+        self.assertEqual(backend['sessions']['in_use'], 0)
+        self.server.stop()
+        backends.close()
+        self.client.get('/api/groups?source=jcli')
+        backend = self.probe('/readyz')
+        self.assertEqual(backend['state'], 'failing')
+        self.assertEqual(backend['failures'], 1)
+        self.assertEqual(backend['last_error'], 'Could not connect to jcli')
+        self.assertIsNotNone(backend['last_contact'])
+
+    def test_process(self):
+        process = self.client.get('/healthz').json()['process']
+        self.assertEqual(process['pid'], os.getpid())
+        self.assertGreater(process['threads'], 0)
+
+
+class SchemaTests(TestCase):
+
+    def setUp(self):
+        schema.clear()
+        self.addCleanup(schema.clear)
+
+    def test_etag(self):
+        response = self.client.get('/api/schema/')
+        self.assertEqual(response['Content-Type'], 'application/vnd.oai.openapi; charset=utf-8')
+        self.assertIn(b'/api/users', response.content)
+        etag = response['ETag']
+        response = self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/schema/?format=json', HTTP_IF_NONE_MATCH=etag)
+        self.assertIn('/api/users', response.json()['paths'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'schema.yml')
+            with override_settings(SCHEMA_FILE=path):
+                content = self.client.get('/api/schema/').content
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), content)
+                schema.clear()
+                with open(path, 'a') as f:
+                    f.write('x-built: true\n')
+                response = self.client.get('/api/schema/?format=json')
+        self.assertTrue(response.json()['x-built'])
+
+
+class RecordTests(FakeJcliTestCase):
+
+    def test_no_passwords(self):
+        self.server.jasmin.smppccs['smppc0']['password'] = 'smpp-pw'
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(JCLI_RECORD_DIR=directory):
+                self.client.post('/api/users', {
+                    'uid': 'new', 'gid': 'g1', 'username': 'newbie',
+                    'password': 'hunter22'}, format='json')
+                self.client.post('/api/users', 'uid=form&gid=g1&username=f&password=hunter23',
+                                 content_type='application/x-www-form-urlencoded')
+                self.client.get('/api/smppsconns/smppc0')
+            paths = sorted(glob.glob(os.path.join(directory, '*.json')))
+            self.assertEqual(len(paths), 3)
+            for path in paths:
+                with open(path) as f:
+                    recorded = f.read()
+                for secret in ('hunter22', 'hunter23', 'smpp-pw', self.server.password):
+                    self.assertNotIn(secret, recorded)
+            self.assertIn('password <redacted>', recorded)
+            #redacted transcripts still replay
+            self.server.jasmin.users.pop('new')
+            for path in paths:
+                expected, response = replay(self.client, path)
+                self.assertEqual(response.json(), expected['json'])
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILE_RING_SIZE=2)
+class ProfilingTests(FakeJcliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        User.objects.create_user('staff', password='staff-pw')
+
+    def get(self, path, username='admin', password='pw', **headers):
+        credentials = base64.b64encode(
+            ('%s:%s' % (username, password)).encode()).decode()
+        return APIClient().get(
+            path, HTTP_AUTHORIZATION='Basic ' + credentials, **headers)
+
+    def test_superuser_only(self):
+        response = self.get('/api/groups', 'staff', 'staff-pw', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(profiling.list_profiles(), [])
+        self.assertNotIn('X-Profile-Id', self.get('/api/groups'))
+        self.assertEqual(self.get('/profiles/', 'staff', 'staff-pw').status_code, 403)
+        #views outside the API see users logged in with a session
+        client = APIClient()
+        client.login(username='staff', password='staff-pw')
+        self.assertNotIn('X-Profile-Id', client.get('/healthz', HTTP_X_PROFILE='1'))
+        client.login(username='admin', password='pw')
+        self.assertIn('X-Profile-Id', client.get('/healthz', HTTP_X_PROFILE='1'))
+        #off by default
+        with override_settings(PROFILING_ENABLED=False):
+            response = self.get('/api/groups', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(len(profiling.list_profiles()), 1)
+
+    def test_ring(self):
+        names = [self.get('/api/groups', HTTP_X_PROFILE='1')['X-Profile-Id']
+                 for _ in range(3)]
+        profiles = self.get('/profiles/').json()['profiles']
+        self.assertEqual([p['name'] for p in profiles], names[:0:-1])
+        self.assertEqual((profiles[0]['method'], profiles[0]['path']),
+                         ('GET', '/api_groups'))
+        response = self.get('/profiles/' + names[2])
+        self.assertEqual(response.status_code, 200)
+        stats = marshal.loads(b''.join(response.streaming_content))
+        self.assertTrue(stats)
+        self.assertEqual(self.get('/profiles/' + names[0]).status_code, 404)
+        self.assertEqual(self.get('/profiles/%s' % names[2], 'staff', 'staff-pw')
+                         .status_code, 403)
+
+    def test_profile_path(self):
+        self.get('/api/groups', HTTP_X_PROFILE='1')
+        name = profiling.list_profiles()[0]['name']
+        self.assertEqual(profiling.profile_path(name),
+                         os.path.join(settings.PROFILE_DIR, name))
+        for name in ('../db.sqlite3', '1-1-GET-../../db.prof', '/etc/passwd',
+                     '1-1-GET-x.prof/..', name + '/'):
+            with self.subTest(name=name):
+                self.assertIsNone(profiling.profile_path(name))
+        self.assertEqual(self.get('/profiles/..%2F..%2Fmanage.py').status_code, 404)
+
+
+class ChangeTests(FakeJcliTestCase):
+
+    def test_since(self):
+        response = self.client.get('/api/users?since=0')
+        self.assertEqual(len(response.json()['created']), 5)
+        version = response.json()['version']
+        self.assertEqual(response['X-Config-Version'], str(version))
+        self.client.post('/api/users', {
+            'uid': 'new', 'gid': 'g1', 'username': 'newbie', 'password': 'secret'})
+        self.client.put('/api/users/u1/disable')
+        self.client.delete('/api/users/u2')
+        #changed in jcli directly, found by the refresh
+        del self.server.jasmin.users['u3']
+        changes = self.client.get(
+            '/api/users?since=%d&source=jcli' % version).json()
+        self.assertEqual([u['uid'] for u in changes['created']], ['new'])
+        self.assertEqual([(u['uid'], u['status']) for u in changes['updated']],
+                         [('u1', 'disabled')])
+        self.assertEqual(changes['deleted'], [{'uid': 'u2'}, {'uid': 'u3'}])
+        self.assertEqual(
+            self.client.get('/api/users?since=%d' % changes['version']).json(),
+            {'version': changes['version'], 'created': [], 'updated': [],
+             'deleted': []})
+
+    def test_created_then_deleted(self):
+        version = self.client.get('/api/mtrouters?since=0').json()['version']
+        self.client.post('/api/mtrouters', {
+            'type': 'StaticMTRoute', 'order': '100', 'rate': '0.5',
+            'smppconnectors': 'smppc1', 'filters': 'f2'})
+        self.client.delete('/api/mtrouters/100')
+        self.client.delete('/api/mtrouters/20')
+        changes = self.client.get('/api/mtrouters?since=%d' % version).json()
+        self.assertEqual(changes['created'], [])
+        self.assertEqual(changes['deleted'], [{'order': '20'}])
+
+    def test_invalid_since(self):
+        version = self.client.get('/api/groups?since=0').json()['version']
+        self.assertEqual(self.client.get('/api/groups?since=x').status_code, 400)
+        response = self.client.get('/api/groups?since=%d' % (version + 1))
+        self.assertEqual(response.status_code, 410)
+        with override_settings(MIRROR_CHANGELOG_SIZE=1):
+            self.client.post('/api/groups', {'gid': 'g8'})
+            self.client.post('/api/groups', {'gid': 'g9'})
+        response = self.client.get('/api/groups?since=%d' % version)
+        self.assertEqual(response.status_code, 410)
+
+
+@override_settings(MIRROR_ENABLED=False)
+class ReplayTests(TestCase):
+    """Replays the recorded jcli sessions in transcripts/ and checks each
+    request still gives the recorded response, always from jcli"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_transcripts(self):
+        paths = sorted(glob.glob(os.path.join(TRANSCRIPTS, '*.json')))
+        self.assertTrue(paths)
+        for path in paths:
+            with self.subTest(transcript=os.path.basename(path)):
+                expected, response = replay(self.client, path)
+                self.assertEqual(response.status_code, expected['status'])
+                self.assertEqual(response.json(), expected['json'])
+
+    def test_mismatch(self):
+        telnet = ReplaySpawn([['recv', 'jcli : '], ['send', 'user -l\n']])
+        telnet.expect(r'jcli : ')
+        with self.assertRaises(TranscriptMismatch):
+            telnet.sendline('group -l')
+
+    def test_split_cols(self):
+        lines = [
+            'user -l',
+            '#User id          Group id         Username         Balance MT SMS Throughput',
+            '#u0               g0               user0            ND      ND     ND/ND',
+            '',
+            'Total Users: 1',
+        ]
+        self.assertEqual(split_cols(lines[2:]), [
+            ['#u0', 'g0', 'user0', 'ND', 'ND', 'ND/ND']])
+
+
+class TelnetTests(FakeJcliTestCase):
+
+    def feed(self, negotiation, *chunks):
+        data, reply = b'', b''
+        for chunk in chunks:
+            d, r = negotiation.feed(chunk)
+            data += d
+            reply += r
+        return data, reply
+
+    def test_strips_and_answers(self):
+        data, reply = self.feed(
+            telnet.Negotiation(),
+            b'Pass\xff\xfb\x01word: \xff\xfd\x1f\xff\xfa\x1f\x00P\xff\xf0ok\xff\xff')
+        self.assertEqual(data, b'Password: ok\xff')
+        #DO ECHO, WONT NAWS
+        self.assertEqual(reply, b'\xff\xfd\x01\xff\xfc\x1f')
+
+    def test_split_chunks(self):
+        chunks = [b'ab\xff', b'\xfb', b'\x03cd\xff', b'\xff', b'e\xff\xfa\x18\xff', b'\xf0f']
+        self.assertEqual(self.feed(telnet.Negotiation(), *chunks),
+                         (b'abcd\xffef', b'\xff\xfd\x03'))
+
+    def test_agreed_once(self):
+        negotiation = telnet.Negotiation()
+        self.assertEqual(self.feed(negotiation, b'\xff\xfb\x01', b'\xff\xfb\x01'),
+                         (b'', b'\xff\xfd\x01'))
+        #WONT of an agreed option is acknowledged, of another one not
+        self.assertEqual(self.feed(negotiation, b'\xff\xfc\x01\xff\xfc\x03'),
+                         (b'', b'\xff\xfe\x01'))
+        self.assertEqual(self.feed(negotiation, b'\xff\xfb\x18'),
+                         (b'', b'\xff\xfe\x18'))
+
+    def test_socket_clients(self):
+        #the fake negotiates echo around the password, as jcli does
+        telnet = connect()
+        telnet.sendline('group -l')
+        telnet.expect(settings.STANDARD_PROMPT)
+        self.assertIn('Total Groups: 2', telnet.before)
+        disconnect(telnet)
+
+    async def test_async_session(self):
+        async with ajcli.session(backends.get('default')) as session:
+            self.assertIn('Total Groups: 2', await session.command('group -l'))
+        ajcli.close()
@@ -0,0 +1,96 @@
+"""Per request breakdown of where time is spent, reported as Server-Timing
+
+Timings are collected in a RequestTiming bound to the current request by
+ServerTimingMiddleware. Code outside a request (management commands, tests)
+records nothing.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('request_timing', default=None)
+
+#Order in which phases are reported
+PHASES = ('spawn', 'login', 'jcli', 'render')
+
+
+class RequestTiming:
+    "Accumulated phase durations for one request, in seconds"
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.round_trips = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_round_trip(self, command, seconds):
+        self.add('jcli', seconds)
+        self.round_trips.append((command, seconds))
+
+    def finish(self):
+        """Phase durations including total and app, the remainder spent
+        parsing jcli output and in Django itself"""
+        total = time.perf_counter() - self.start
+        result = {p: self.phases[p] for p in PHASES if p in self.phases}
+        result['app'] = max(total - sum(result.values()), 0.0)
+        result['total'] = total
+        return result
+
+    def header(self, phases):
+        "Server-Timing header value for phases returned by finish"
+        items = []
+        for phase, seconds in phases.items():
+            item = '%s;dur=%.3f' % (phase, seconds * 1000)
+            if phase == 'jcli':
+                item += ';desc="%d round trips"' % len(self.round_trips)
+            items.append(item)
+        return ', '.join(items)
+
+    def debug(self, phases):
+        "Detailed breakdown in milliseconds for the JSON debug block"
+        return {
+            'phases_ms': {p: round(s * 1000, 3) for p, s in phases.items()},
+            'jcli_round_trips': len(self.round_trips),
+            'jcli_commands': [
+                {'command': c, 'ms': round(s * 1000, 3)}
+                for c, s in self.round_trips
+            ],
+        }
+
+
+def begin():
+    "Start timing the current request, returns a token for end()"
+    return _current.set(RequestTiming())
+
+
+def end(token):
+    _current.reset(token)
+
+
+def current():
+    "RequestTiming of the current request or None"
+    return _current.get()
+
+
+def record(phase, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+def record_round_trip(command, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.add_round_trip(command, seconds)
+
+
+@contextmanager
+def measure(phase):
+    "Account the time spent in the block to phase"
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
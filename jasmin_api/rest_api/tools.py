@@ -1,7 +1,19 @@
+import base64
+import binascii
+import json
+
+from django import http
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from .exceptions import (CanNotModifyError, JasminSyntaxError,
                         JasminError, UnknownError)
+from . import timing
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
 INTERACTIVE_PROMPT = settings.INTERACTIVE_PROMPT
@@ -33,11 +45,128 @@ def set_ikeys(telnet, keys2vals):
     return
 
 
+def list_lines(telnet, command):
+    """Send a listing command and return its table lines, without the echoed
+    command, the header and the Total line.
+
+    Only the prompt is matched: a leading (.+) would be retried from every
+    position of the reply each time more of it arrives, which is quadratic
+    in the size of the listing.
+    """
+    telnet.sendline(command)
+    telnet.expect(r'\n' + STANDARD_PROMPT)
+    result = telnet.before.replace('\r', '').split('\n')
+    return result[2:-1]
+
+
+def iter_lines(telnet, command):
+    """Send a listing command and yield its lines as they arrive, without
+    the echoed command and the header. Lines that are not table rows, such
+    as the Total line, are left to the caller to skip."""
+    telnet.sendline(command)
+    seen = 0
+    while telnet.expect_exact(['\n', STANDARD_PROMPT]) == 0:
+        if seen >= 2:
+            yield telnet.before.rstrip('\r')
+        seen += 1
+
+
 def split_cols(lines):
     "split columns into lists, skipping blank and non-data lines"
     parsed = []
     for line in lines:
-        raw_split = line.split()
-        fields = [s for s in raw_split if (s and raw_split[0][0] == '#')]
-        parsed.append(fields)
+        fields = line.split()
+        if fields and fields[0][0] == '#':
+            parsed.append(fields)
     return parsed
+
+
+def encode_cursor(key):
+    "Opaque cursor for the page starting after key"
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(
+            cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeError, ValueError):
+        raise JasminSyntaxError('Invalid cursor: %s' % cursor)
+
+
+def paginate(rows, key, query_params):
+    """Apply ?limit= and ?cursor= to rows ordered by key
+
+    Returns (page, next cursor). The next cursor is None on the last page.
+    Without limit or cursor all rows are returned, in their original order.
+    """
+    limit = query_params.get('limit')
+    cursor = query_params.get('cursor')
+    if limit is None and cursor is None:
+        return rows, None
+    if limit is None:
+        limit = settings.MAX_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= settings.MAX_PAGE_SIZE:
+        raise JasminSyntaxError(
+            'limit must be between 1 and %d' % settings.MAX_PAGE_SIZE)
+    rows = sorted(rows, key=lambda r: r[key])
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        rows = [r for r in rows if r[key] > after]
+    page = rows[:limit]
+    if len(rows) > limit:
+        return page, encode_cursor(page[-1][key])
+    return page, None
+
+
+def requested_fields(query_params):
+    "Field names from ?fields=a,b,c, None when not given"
+    fields = query_params.get('fields')
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(',') if f.strip()]
+
+
+def project(obj, fields):
+    "Keep only the given top level keys of obj"
+    if fields is None:
+        return obj
+    return {f: obj[f] for f in fields if f in obj}
+
+
+def dumps(data):
+    """Encode data as JSON bytes, with orjson when FAST_JSON is set and it is
+    installed, else with the standard library"""
+    if orjson is not None and settings.FAST_JSON:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            #types orjson does not know, such as lazy translation strings
+            pass
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def ndjson_response(rows):
+    """Stream dicts as newline delimited JSON, one line per dict, encoding
+    each only when the client is ready for it"""
+    return http.StreamingHttpResponse(
+        (dumps(row) + b'\n' for row in rows),
+        content_type='application/x-ndjson')
+
+
+class JsonResponse(http.HttpResponse):
+    """Like django.http.JsonResponse, but encoding with dumps and accounting
+    encoding time to the request's render phase"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        with timing.measure('render'):
+            super().__init__(content=dumps(data), **kwargs)
@@ -5,3 +5,10 @@ from .mtrouter import MTRouterViewSet
 from .smppccm import SMPPCCMViewSet
 from .httpccm import HTTPCCMViewSet
 from .filters import FiltersViewSet
+from .stats import UserStatsViewSet, SMPPCStatsViewSet
+from .messages import MessagesViewSet
+from .cluster import ClusterViewSet
+from .metrics import metrics
+from .health import healthz, readyz
+from .profiles import ProfileListView, ProfileDownloadView
+from .docs import schema, swagger_ui, redoc
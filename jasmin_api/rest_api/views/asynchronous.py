@@ -0,0 +1,210 @@
+"""Async variants of the read actions of the viewsets, for the ASGI
+application (jasmin_api.asgi)
+
+dispatch resolves every API request against ROOT_URLCONF. A read in
+HANDLERS then runs here, over rest_api.ajcli, so that waiting on jcli holds
+no thread. Everything else is handed to the viewset itself: writes, reads
+answered from the mirror or with ?since=, and every request while jcli
+transcripts are recorded or replayed. The async variants answer exactly
+what the viewsets do, and refresh the mirror the same way.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import resolve
+from rest_framework.exceptions import (APIException, NotAuthenticated,
+                                       PermissionDenied)
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from rest_api import ajcli, backends, mirror
+from rest_api.exceptions import ObjectNotFoundError
+from rest_api.tools import JsonResponse, paginate, project, requested_fields
+
+from .filters import FiltersViewSet
+from .groups import GroupViewSet
+from .morouter import MORouterViewSet
+from .mtrouter import MTRouterViewSet
+from .users import LIST_FIELDS, UserViewSet
+
+
+def _mirror(request, function, *args):
+    "Run a mirror function for the backend of request"
+    with backends.using(request.backend.name):
+        return function(*args)
+
+
+async def _refresh(request, function, *args):
+    "Refresh the mirror with what a read found, when it follows the backend"
+    if settings.MIRROR_ENABLED and request.backend.name == settings.DEFAULT_BACKEND:
+        await sync_to_async(_mirror)(request, function, *args)
+
+
+async def group_list(request, jcli):
+    groups = GroupViewSet()._rows(await jcli.lines('group -l'))
+    await _refresh(request, mirror.replace_groups, groups)
+    return JsonResponse({'groups': groups})
+
+
+async def _user(jcli, uid):
+    "A user as UserViewSet.get_user reads it, None when unknown"
+    result = await jcli.command('user -s ' + uid)
+    if 'Unknown User:' in result or 'Usage: user' in result:
+        return None
+    return UserViewSet()._parse(result)
+
+
+async def user_list(request, jcli):
+    viewset = UserViewSet()
+    params = request.query_params
+    fields = requested_fields(params)
+    listed = viewset._rows(await jcli.lines('user -l'))
+    selected = viewset._select(listed, params)
+    selected, next_cursor = paginate(selected, 'uid', params)
+    if fields is not None and set(fields) <= set(LIST_FIELDS):
+        users = [project(u, fields) for u in selected]
+    else:
+        users = []
+        for u in selected:
+            user = await _user(jcli, u['uid'])
+            #skip users removed since user -l
+            if user:
+                user['status'] = u['status']
+                users.append(project(user, fields))
+        if fields is None and len(selected) == len(listed):
+            await _refresh(request, mirror.replace_users, users)
+    response = {'users': users}
+    if 'limit' in params or 'cursor' in params:
+        response['next'] = next_cursor
+    return JsonResponse(response)
+
+
+async def user_retrieve(request, jcli, uid):
+    user = await _user(jcli, uid)
+    if user is None:
+        raise ObjectNotFoundError('Unknown user: %s' % uid)
+    return JsonResponse({'user': user})
+
+
+async def _filters(request, jcli):
+    filters = [f for f in map(FiltersViewSet()._parse,
+                              await jcli.lines('filter -l')) if f]
+    await _refresh(request, mirror.replace_filters, filters)
+    return filters
+
+
+async def filter_list(request, jcli):
+    return JsonResponse({'filters': await _filters(request, jcli)})
+
+
+async def filter_retrieve(request, jcli, fid):
+    filters = await _filters(request, jcli)
+    return JsonResponse(
+        {'filter': next((f for f in filters if f['fid'] == fid), None)})
+
+
+async def _routes(request, jcli, router):
+    viewset = MTRouterViewSet() if router == 'mt' else MORouterViewSet()
+    routes = [r for r in map(viewset._parse,
+                             await jcli.lines('%srouter -l' % router)) if r]
+    await _refresh(request, mirror.replace_routes, router, routes)
+    return routes
+
+
+async def mtrouter_list(request, jcli):
+    return JsonResponse({'mtrouters': await _routes(request, jcli, 'mt')})
+
+
+async def mtrouter_retrieve(request, jcli, order):
+    routes = await _routes(request, jcli, 'mt')
+    return JsonResponse(
+        {'mtrouter': next((r for r in routes if r['order'] == order), None)})
+
+
+async def morouter_list(request, jcli):
+    return JsonResponse({'morouters': await _routes(request, jcli, 'mo')})
+
+
+async def morouter_retrieve(request, jcli, order):
+    routes = await _routes(request, jcli, 'mo')
+    return JsonResponse(
+        {'morouter': next((r for r in routes if r['order'] == order), None)})
+
+
+#(viewset, action): (async variant, mirror table)
+HANDLERS = {
+    (GroupViewSet, 'list'): (group_list, 'groups'),
+    (UserViewSet, 'list'): (user_list, 'users'),
+    (UserViewSet, 'retrieve'): (user_retrieve, 'users'),
+    (FiltersViewSet, 'list'): (filter_list, 'filters'),
+    (FiltersViewSet, 'retrieve'): (filter_retrieve, 'filters'),
+    (MTRouterViewSet, 'list'): (mtrouter_list, 'mtrouters'),
+    (MTRouterViewSet, 'retrieve'): (mtrouter_retrieve, 'mtrouters'),
+    (MORouterViewSet, 'list'): (morouter_list, 'morouters'),
+    (MORouterViewSet, 'retrieve'): (morouter_retrieve, 'morouters'),
+}
+
+
+def _handler(match, method):
+    "Async variant and mirror table of the action match resolved to, or None"
+    actions = getattr(match.func, 'actions', None) or {}
+    return HANDLERS.get(
+        (getattr(match.func, 'cls', None), actions.get(method.lower())))
+
+
+def _prepare(request, table):
+    """None when the viewset answers request without jcli, or must answer
+    it, else request authenticated as _authenticate does"""
+    if not ajcli.enabled() or 'since' in request.GET:
+        return None
+    if _mirror(request, mirror.use_mirror, request, table):
+        return None
+    return _authenticate(request)
+
+
+def _viewset(request, match):
+    with backends.using(request.backend.name):
+        return match.func(request, *match.args, **match.kwargs)
+
+
+def _authenticate(request):
+    """request as a DRF Request, authenticated and allowed by the default
+    authentication and permission classes. Raises the APIException DRF
+    would answer with"""
+    drf_request = Request(request, authenticators=[
+        a() for a in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    drf_request.user
+    for permission in api_settings.DEFAULT_PERMISSION_CLASSES:
+        if not permission().has_permission(drf_request, None):
+            if drf_request.successful_authenticator is None:
+                raise NotAuthenticated
+            raise PermissionDenied
+    return drf_request
+
+
+def _error(request, exc):
+    response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+    authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    if exc.status_code == 401 and authenticators:
+        response['WWW-Authenticate'] = authenticators[0]().authenticate_header(
+            request)
+    return response
+
+
+async def dispatch(request):
+    "Serve an API request with its async variant, else with its viewset"
+    match = resolve(request.path_info, settings.ROOT_URLCONF)
+    request.resolver_match = match
+    handler = _handler(match, request.method)
+    try:
+        drf_request = handler and await sync_to_async(_prepare)(
+            request, handler[1])
+        if drf_request is None:
+            return await sync_to_async(_viewset)(request, match)
+        async with ajcli.session(request.backend) as jcli:
+            return await handler[0](drf_request, jcli, *match.args, **match.kwargs)
+    except APIException as exc:
+        return _error(request, exc)
+
+
+#the viewsets check CSRF themselves, for session authentication only
+dispatch.csrf_exempt = True
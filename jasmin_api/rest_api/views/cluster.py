@@ -0,0 +1,119 @@
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.viewsets import ViewSet
+from drf_spectacular.utils import extend_schema
+
+from rest_api import backends, replication
+from rest_api.exceptions import JasminSyntaxError
+from rest_api.serializers import (
+    ClusterGroupListSerializer, ClusterUserListSerializer,
+    ClusterFilterListSerializer, ClusterMTRouterListSerializer,
+    ClusterMORouterListSerializer, ClusterSMPPCCMListSerializer,
+    ClusterHTTPCCMListSerializer, ReplicateSerializer,
+    ReplicationReportSerializer)
+from rest_api.tools import JsonResponse
+from rest_api.views.filters import FiltersViewSet
+from rest_api.views.groups import GroupViewSet
+from rest_api.views.httpccm import HTTPCCMViewSet
+from rest_api.views.morouter import MORouterViewSet
+from rest_api.views.mtrouter import MTRouterViewSet
+from rest_api.views.smppccm import SMPPCCMViewSet
+from rest_api.views.users import UserViewSet
+
+
+@extend_schema(tags=['Cluster'])
+class ClusterViewSet(ViewSet):
+    """Lists of every backend, read from jcli on all of them at once and
+    merged, each row with a backend column. Backends that could not be read
+    are listed under errors, the others are still returned. Also
+    replication of the configuration between backends."""
+
+    def _merge(self, key, read):
+        results, errors = backends.fan_out(read)
+        return JsonResponse({
+            key: [dict({'backend': name}, **row)
+                  for name, rows in sorted(results.items()) for row in rows],
+            'errors': [{'backend': name, 'detail': detail}
+                       for name, detail in sorted(errors.items())],
+        })
+
+    @extend_schema(responses=ClusterGroupListSerializer,
+                   description="Groups of every backend")
+    @action(detail=False, methods=['get'])
+    def groups(self, request):
+        "Groups of every backend"
+        return self._merge('groups', GroupViewSet()._list)
+
+    @extend_schema(responses=ClusterUserListSerializer,
+                   description="Users of every backend")
+    @action(detail=False, methods=['get'])
+    def users(self, request):
+        "Users of every backend, as user -l lists them"
+        return self._merge('users', UserViewSet()._list)
+
+    @extend_schema(responses=ClusterFilterListSerializer,
+                   description="Filters of every backend")
+    @action(detail=False, methods=['get'])
+    def filters(self, request):
+        "Filters of every backend"
+        return self._merge(
+            'filters', lambda telnet: FiltersViewSet()._list(telnet)['filters'])
+
+    @extend_schema(responses=ClusterMTRouterListSerializer,
+                   description="MT routes of every backend")
+    @action(detail=False, methods=['get'])
+    def mtrouters(self, request):
+        "MT routes of every backend"
+        return self._merge(
+            'mtrouters',
+            lambda telnet: MTRouterViewSet()._list(telnet)['mtrouters'])
+
+    @extend_schema(responses=ClusterMORouterListSerializer,
+                   description="MO routes of every backend")
+    @action(detail=False, methods=['get'])
+    def morouters(self, request):
+        "MO routes of every backend"
+        return self._merge(
+            'morouters',
+            lambda telnet: MORouterViewSet()._list(telnet)['morouters'])
+
+    @extend_schema(responses=ClusterSMPPCCMListSerializer,
+                   description="SMPP client connectors of every backend")
+    @action(detail=False, methods=['get'])
+    def smppsconns(self, request):
+        "SMPP client connectors of every backend, with their status"
+        return self._merge('connectors', SMPPCCMViewSet()._list)
+
+    @extend_schema(responses=ClusterHTTPCCMListSerializer,
+                   description="HTTP client connectors of every backend")
+    @action(detail=False, methods=['get'])
+    def httpsconns(self, request):
+        "HTTP client connectors of every backend"
+        return self._merge('connectors', HTTPCCMViewSet()._list)
+
+    @extend_schema(request=ReplicateSerializer,
+                   responses=ReplicationReportSerializer,
+                   description="Replicate the primary's configuration to standbys")
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def replicate(self, request):
+        """Make users, groups, filters and routes of standbys those of the
+        primary, applying only the operations needed, with one persist per
+        standby. dry_run only reports them. Users missing on a standby are
+        only added when their password is given.
+
+        HTTP codes indicate result as follows
+
+        - 200: see each standby's operations and errors
+        - 400: invalid request
+        - 404: unknown backend
+        """
+        data = request.data
+        if not isinstance(data, dict):
+            raise JasminSyntaxError('Expected a JSON object')
+        for key, kind in (('standbys', list), ('tables', list), ('passwords', dict)):
+            if not isinstance(data.get(key, kind()), kind):
+                raise JasminSyntaxError('Invalid %s' % key)
+        return JsonResponse(replication.replicate(
+            data.get('primary'), data.get('standbys'),
+            bool(data.get('dry_run')), data.get('passwords'),
+            data.get('tables') or replication.TABLES))
@@ -0,0 +1,63 @@
+"""OpenAPI schema and documentation pages
+
+drf_spectacular's views are built on their first request, so that loading
+the URLs does not import them. The schema is served from rest_api.schema
+with an ETag, and answered with a 304 when the client already has it.
+"""
+from django.http import HttpResponse
+
+from rest_api import schema as cache
+
+
+def _lazy(build):
+    "A view that calls build() for the actual view on its first request"
+    view = None
+
+    def lazy_view(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = build()
+        return view(request, *args, **kwargs)
+
+    lazy_view.csrf_exempt = True
+    return lazy_view
+
+
+def _schema_view():
+    from drf_spectacular.views import SpectacularAPIView
+
+    class SchemaView(SpectacularAPIView):
+
+        def _get_schema_response(self, request):
+            #translated schemas are left to drf_spectacular
+            if request.GET.get('lang'):
+                return super()._get_schema_response(request)
+            content, etag = cache.rendered(request.accepted_renderer)
+            if etag in request.headers.get('If-None-Match', ''):
+                response = HttpResponse(status=304)
+            else:
+                content_type = request.accepted_media_type
+                if request.accepted_renderer.charset:
+                    content_type += '; charset=' + request.accepted_renderer.charset
+                response = HttpResponse(content, content_type=content_type)
+                response['Content-Disposition'] = 'inline; filename="%s"' % (
+                    self._get_filename(request, None))
+            response['ETag'] = etag
+            return response
+
+    return SchemaView.as_view()
+
+
+def _swagger_view():
+    from drf_spectacular.views import SpectacularSwaggerView
+    return SpectacularSwaggerView.as_view(url_name='schema')
+
+
+def _redoc_view():
+    from drf_spectacular.views import SpectacularRedocView
+    return SpectacularRedocView.as_view(url_name='schema')
+
+
+schema = _lazy(_schema_view)
+swagger_ui = _lazy(_swagger_view)
+redoc = _lazy(_redoc_view)
@@ -1,7 +1,6 @@
 from collections import OrderedDict
 
 from django.conf import settings
-from django.http import JsonResponse
 from django.utils.datastructures import MultiValueDictKeyError
 
 from rest_framework.viewsets import ViewSet
@@ -9,13 +8,15 @@ from rest_framework.decorators import action
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
-from rest_api.tools import set_ikeys, split_cols
+from rest_api import mirror
+from rest_api.tools import (set_ikeys, split_cols, list_lines, iter_lines,
+                            ndjson_response, JsonResponse)
 from rest_api.exceptions import (JasminSyntaxError, JasminError,
                         UnknownError, MissingKeyError,
                         MutipleValuesRequiredKeyError, ObjectNotFoundError)
 from rest_api.serializers import (
-    FilterListSerializer, FilterDetailSerializer, 
-    FilterCreateSerializer, SimpleResponseSerializer
+    FilterSerializer, FilterListSerializer, FilterDetailSerializer, 
+    FilterCreateSerializer, FilterRoutesSerializer, SimpleResponseSerializer
 )
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
@@ -27,39 +28,58 @@ class FiltersViewSet(ViewSet):
     lookup_field = 'fid'
     serializer_class = FilterListSerializer
 
-    def _list(self, telnet):
-        "List Filters as python dict"
-        telnet.sendline('filter -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip().replace("\r", '').split("\n")
-        if len(result) < 3:
-            return {'filters': []}
-        results = [l.replace(', ', ',').replace('(!)', '')
-            for l in result[2:-2] if l]
-        filters = split_cols(results)
+    def _parse(self, line):
+        "One filter -l line as a dict, None if it is not a filter row"
+        cols = split_cols([line.replace(', ', ',').replace('(!)', '')])
+        if not cols:
+            return None
+        f = cols[0]
+        #Routes column is "MO MT", "MO" or "MT"
+        routes_end = 2
+        while routes_end < len(f) and f[routes_end] in ('MO', 'MT'):
+            routes_end += 1
         return {
-            'filters':
-                [
-                    {
-                        'fid': f[0].strip().lstrip('#'),
-                        'type': f[1],
-                        'routes': f[2] + ' ' + f[3],
-                        'description': ' '.join(f[4:])
-                    } for f in filters
-                ]
+            'fid': f[0].strip().lstrip('#'),
+            'type': f[1],
+            'routes': ' '.join(f[2:routes_end]),
+            'description': ' '.join(f[routes_end:])
         }
 
+    def _list(self, telnet):
+        "List Filters as python dict"
+        filters = [self._parse(l) for l in list_lines(telnet, 'filter -l')]
+        return {'filters': [f for f in filters if f]}
+
     @extend_schema(
+        parameters=[mirror.SINCE_PARAMETER],
         responses=FilterListSerializer,
         description="List all filters"
     )
     def list(self, request):
         "List Filters. No parameters"
-        return JsonResponse(self._list(request.telnet))
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'filters')
+        if mirror.use_mirror(request, 'filters'):
+            return mirror.annotate(
+                JsonResponse({'filters': mirror.filters()}), 'filters')
+        filters = self._list(request.telnet)
+        mirror.replace_filters(filters['filters'])
+        return JsonResponse(filters)
+
+    @extend_schema(
+        responses={(200, 'application/x-ndjson'): FilterSerializer},
+        description="Export all filters as newline delimited JSON"
+    )
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream Filters, one JSON object per line, as jcli lists them"""
+        filters = map(self._parse, iter_lines(request.telnet, 'filter -l'))
+        return ndjson_response(f for f in filters if f)
 
     def get_filter(self, telnet, fid):
         "Return data for one filter as Python dict"
         filters = self._list(telnet)['filters']
+        mirror.replace_filters(filters)
         try:
             return {'filter':
                 next((m for m in filters if m['fid'] == fid), None)
@@ -81,6 +101,9 @@ class FiltersViewSet(ViewSet):
     )
     def retrieve(self, request, fid):
         "Details for one Filter by fid (integer)"
+        if mirror.use_mirror(request, 'filters'):
+            return mirror.annotate(
+                JsonResponse({'filter': mirror.filter(fid)}), 'filters')
         return JsonResponse(self.get_filter(request.telnet, fid))
 
     @extend_schema(
@@ -147,6 +170,8 @@ class FiltersViewSet(ViewSet):
                 telnet.expect(r'.*' + STANDARD_PROMPT)
                 return JsonResponse({'filter': self.get_filter(telnet, fid)})
             else:
+                telnet.expect(r'.*' + STANDARD_PROMPT)
+                mirror.delete_filter(fid)
                 return JsonResponse({'fid': fid})
         elif matched_index == 1:
             raise UnknownError(detail='No filter:' +  fid)
@@ -161,7 +186,7 @@ class FiltersViewSet(ViewSet):
                 location=OpenApiParameter.PATH,
                 description='Filter identifier'
             )
-        ],
+        ] + mirror.DELETE_PARAMETERS,
         responses=SimpleResponseSerializer,
         description="Delete a filter"
     )
@@ -173,6 +198,38 @@ class FiltersViewSet(ViewSet):
         - 200: successful deletion
         - 404: nonexistent filter
         - 400: other error
+        - 409: still used, see dependents in the response
+
+        ?preview=true lists the dependents without deleting, ?force=true
+        deletes anyway
         """
+        preview = mirror.guard_delete(request, 'filter', fid)
+        if preview is not None:
+            return preview
         return self.simple_filter_action(
             request.telnet, 'r', fid, return_filter=False)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='fid',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.PATH,
+                description='Filter identifier'
+            )
+        ],
+        responses=FilterRoutesSerializer,
+        description="List the MT and MO routes using a filter"
+    )
+    @action(detail=True, methods=['get'])
+    def routes(self, request, fid):
+        """MT and MO routes using the filter, from the mirror
+
+        - 200: the routes, possibly none
+        - 404: nonexistent filter
+        """
+        mirror.fresh(request, 'filters', 'mtrouters', 'morouters')
+        routes = mirror.filter_routes(fid)
+        if routes is None:
+            raise ObjectNotFoundError('Unknown filter: %s' % fid)
+        return mirror.annotate(JsonResponse(routes), 'filters')
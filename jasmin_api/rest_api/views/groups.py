@@ -1,5 +1,4 @@
 from django.conf import settings
-from django.http import JsonResponse
 import logging
 
 from rest_framework.viewsets import ViewSet
@@ -9,9 +8,11 @@ from drf_spectacular.types import OpenApiTypes
 
 from rest_api.exceptions import MissingKeyError, ActionFailed, ObjectNotFoundError
 from rest_api.serializers import (
-    GroupListSerializer, GroupCreateSerializer, SimpleResponseSerializer
+    GroupListSerializer, GroupCreateSerializer, SimpleResponseSerializer,
+    UserListSerializer
 )
-from rest_api.tools import set_ikeys
+from rest_api import mirror
+from rest_api.tools import set_ikeys, list_lines, JsonResponse
 
 logger = logging.getLogger(__name__)
 
@@ -24,31 +25,35 @@ class GroupViewSet(ViewSet):
     lookup_field = 'gid'
     serializer_class = GroupListSerializer
 
+    def _rows(self, lines):
+        "Groups from group -l lines"
+        return [
+            {
+                'name': g.strip().lstrip('!#'), 'status': (
+                    'disabled' if g[1] == '!' else 'enabled'
+                )
+            } for g in lines if g.startswith('#')
+        ]
+
+    def _list(self, telnet):
+        "List groups as python list"
+        return self._rows(list_lines(telnet, 'group -l'))
+
     @extend_schema(
+        parameters=[mirror.SINCE_PARAMETER],
         responses=GroupListSerializer,
         description="List all groups"
     )
     def list(self, request):
         "List groups. No request parameters provided or required."
-        telnet = request.telnet
-        telnet.sendline('group -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip().replace("\r", '').split("\n")
-        if len(result) < 3:
-            return JsonResponse({'groups': []})
-        groups = result[2:-2]
-        return JsonResponse(
-            {
-                'groups':
-                    [
-                        {
-                            'name': g.strip().lstrip('!#'), 'status': (
-                                'disabled' if g[1] == '!' else 'enabled'
-                            )
-                        } for g in groups
-                    ]
-            }
-        )
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'groups')
+        if mirror.use_mirror(request, 'groups'):
+            return mirror.annotate(
+                JsonResponse({'groups': mirror.groups()}), 'groups')
+        groups = self._list(request.telnet)
+        mirror.replace_groups(groups)
+        return JsonResponse({'groups': groups})
 
     @extend_schema(
         request=GroupCreateSerializer,
@@ -71,6 +76,7 @@ class GroupViewSet(ViewSet):
         set_ikeys(telnet, {'gid': gid})
         telnet.sendline('persist\n')
         telnet.expect(r'.*' + STANDARD_PROMPT)
+        mirror.save_group(gid, 'enabled')
         return JsonResponse({'name': gid}, status=201)
 
     def simple_group_action(self, telnet, action, gid):
@@ -82,6 +88,10 @@ class GroupViewSet(ViewSet):
         ])
         if matched_index == 0:
             telnet.sendline('persist\n')
+            if action == 'r':
+                mirror.delete_group(gid)
+            else:
+                mirror.save_group(gid, 'enabled' if action == 'e' else 'disabled')
             return JsonResponse({'name': gid})
         elif matched_index == 1:
             raise ObjectNotFoundError('Unknown group: %s' % gid)
@@ -96,7 +106,7 @@ class GroupViewSet(ViewSet):
                 location=OpenApiParameter.PATH,
                 description='Group identifier'
             )
-        ],
+        ] + mirror.DELETE_PARAMETERS,
         responses=SimpleResponseSerializer,
         description="Delete a group"
     )
@@ -108,7 +118,14 @@ class GroupViewSet(ViewSet):
         - 200: successful deletion
         - 404: nonexistent group
         - 400: other error
+        - 409: still used, see dependents in the response
+
+        ?preview=true lists the dependents without deleting, ?force=true
+        deletes anyway
         """
+        preview = mirror.guard_delete(request, 'group', gid)
+        if preview is not None:
+            return preview
         return self.simple_group_action(request.telnet, 'r', gid)
 
     @extend_schema(
@@ -161,3 +178,28 @@ class GroupViewSet(ViewSet):
         - 400: other error
         """
         return self.simple_group_action(request.telnet, 'd', gid)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='gid',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.PATH,
+                description='Group identifier'
+            )
+        ],
+        responses=UserListSerializer,
+        description="List the users of a group"
+    )
+    @action(detail=True, methods=['get'])
+    def users(self, request, gid):
+        """Users of a group, from the mirror
+
+        - 200: the users, possibly none
+        - 404: nonexistent group
+        """
+        mirror.fresh(request, 'groups', 'users')
+        users = mirror.group_users(gid)
+        if users is None:
+            raise ObjectNotFoundError('Unknown group: %s' % gid)
+        return mirror.annotate(JsonResponse({'users': users}), 'users')
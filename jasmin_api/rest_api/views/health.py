@@ -0,0 +1,19 @@
+from rest_api import health, warmup, workers
+from rest_api.tools import JsonResponse
+
+
+def healthz(request):
+    """Liveness probe: 200 while the process answers, with its state and
+    that of jcli on every backend, as seen by the worker answering. Served
+    from process memory only, no jcli connection is made."""
+    return JsonResponse({'status': 'ok', 'process': health.process(),
+                         'backends': health.backends()})
+
+
+def readyz(request):
+    """Readiness probe: 200 once every run_cherrypy.py worker warmed up, 503
+    before. Served from process memory and the other workers' files only,
+    no jcli connection is made."""
+    state = workers.readiness() if workers.enabled() else warmup.state()
+    state['backends'] = health.backends()
+    return JsonResponse(state, status=200 if state['status'] == 'ready' else 503)
@@ -1,5 +1,4 @@
 from django.conf import settings
-from django.http import JsonResponse
 
 from rest_framework.viewsets import ViewSet
 from rest_framework.parsers import JSONParser
@@ -7,13 +6,15 @@ from rest_framework.decorators import action, parser_classes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
-from rest_api.tools import set_ikeys, split_cols
+from rest_api import mirror, probe
+from rest_api.tools import set_ikeys, split_cols, list_lines, JsonResponse
 from rest_api.exceptions import (
     JasminSyntaxError, JasminError, ActionFailed,
     ObjectNotFoundError, UnknownError, 
 )
 from rest_api.serializers import (
-    HTTPCCMListSerializer, HTTPCCMCreateSerializer, SimpleResponseSerializer
+    HTTPCCMListSerializer, HTTPCCMCreateSerializer, SimpleResponseSerializer,
+    HTTPCCMProbeSerializer
 )
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
@@ -48,12 +49,41 @@ class HTTPCCMViewSet(ViewSet):
         return httpccm
 
     def get_connector_list(self, telnet):
-        telnet.sendline('httpccm -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip().replace("\r", '').split("\n")
-        if len(result) < 3:
-            return []
-        return split_cols(result[2:-2])
+        return split_cols(list_lines(telnet, 'httpccm -l'))
+
+    def _list(self, telnet):
+        "Connectors with their details, as list returns them"
+        connectors = []
+        for raw_data in self.get_connector_list(telnet):
+            cid = raw_data[0][1:]
+            connector = self.get_httpccm(telnet, cid, True)
+            connector.update(
+                cid=cid,
+                type=raw_data[1],
+                method=raw_data[2],
+                url=raw_data[3]
+            )
+            connectors.append(connector)
+        return connectors
+
+    def _connector(self, telnet, cid):
+        "One connector with its details, as retrieve returns it"
+        connector = self.get_httpccm(telnet, cid, silent=False)
+        connector_list = self.get_connector_list(telnet)
+        list_data = next(
+            (raw_data for raw_data in connector_list if
+                raw_data[0] == '#' + cid),
+            None
+        )
+        if not list_data:
+            raise ObjectNotFoundError('Unknown connector: %s' % cid)
+        connector.update(
+            cid=cid,
+            type=list_data[1],
+            method=list_data[2],
+            url=list_data[3]
+        )
+        return connector
 
     def simple_httpccm_action(self, telnet, action, cid):
         telnet.sendline('httpccm -%s %s' % (action, cid))
@@ -64,6 +94,8 @@ class HTTPCCMViewSet(ViewSet):
         ])
         if matched_index == 0:
             telnet.sendline('persist\n')
+            telnet.expect(r'.*' + STANDARD_PROMPT)
+            mirror.delete_connector('http', cid)
             return JsonResponse({'name': cid})
         elif matched_index == 1:
             raise ObjectNotFoundError('Unknown HTTP Connector: %s' % cid)
@@ -71,6 +103,7 @@ class HTTPCCMViewSet(ViewSet):
             raise ActionFailed(telnet.match.group(1))
 
     @extend_schema(
+        parameters=[mirror.SINCE_PARAMETER],
         responses=HTTPCCMListSerializer,
         description="List all HTTP Client Connectors"
     )
@@ -81,20 +114,13 @@ class HTTPCCMViewSet(ViewSet):
         1. the "service" column is called "status"
         2. the cid is the full connector id of the form https(cid)
         """
-        telnet = request.telnet
-        connector_list = self.get_connector_list(telnet)
-        connectors = []
-        for raw_data in connector_list:
-            if raw_data[0][0] == '#':
-                cid = raw_data[0][1:]
-                connector = self.get_httpccm(telnet, cid, True)
-                connector.update(
-                    cid=cid,
-                    type=raw_data[1],
-                    method=raw_data[2],
-                    url=raw_data[3]
-                )
-                connectors.append(connector)
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'httpsconns')
+        if mirror.use_mirror(request, 'httpsconns'):
+            return mirror.annotate(JsonResponse(
+                {'connectors': mirror.connectors('http')}), 'httpsconns')
+        connectors = self._list(request.telnet)
+        mirror.replace_connectors('http', connectors)
         return JsonResponse({'connectors': connectors})
 
     @extend_schema(
@@ -112,23 +138,12 @@ class HTTPCCMViewSet(ViewSet):
     def retrieve(self, request, cid):
         """Retreive data for one connector
         Required parameter: cid (connector id)"""
-        telnet = request.telnet
-        connector = self.get_httpccm(telnet, cid, silent=False)
-        connector_list = self.get_connector_list(telnet)
-        list_data = next(
-            (raw_data for raw_data in connector_list if
-                raw_data[0] == '#' + cid),
-            None
-        )
-        if not list_data:
-            raise ObjectNotFoundError('Unknown connector: %s' % cid)
-        connector.update(
-                    cid=cid,
-                    type=list_data[1],
-                    method=list_data[2],
-                    url=list_data[3]
-                )
-        return JsonResponse({'connector': connector})
+        if mirror.use_mirror(request, 'httpsconns'):
+            connector = mirror.connector('http', cid)
+            if connector is not None:
+                return mirror.annotate(
+                    JsonResponse({'connector': connector}), 'httpsconns')
+        return JsonResponse({'connector': self._connector(request.telnet, cid)})
 
     @extend_schema(
         request=HTTPCCMCreateSerializer,
@@ -158,6 +173,9 @@ class HTTPCCMViewSet(ViewSet):
                 detail=" ".join(telnet.match.group(1).split()))
         telnet.sendline('persist\n')
         telnet.expect(r'.*' + STANDARD_PROMPT)
+        if mirror.enabled():
+            mirror.save_connector(
+                'http', self._connector(telnet, request.data['cid']))
         return JsonResponse({'cid': request.data['cid']})
 
     @extend_schema(
@@ -183,3 +201,32 @@ class HTTPCCMViewSet(ViewSet):
         - 400: other error
         """
         return self.simple_httpccm_action(request.telnet, 'r', cid)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='refresh',
+                type=OpenApiTypes.BOOL,
+                location=OpenApiParameter.QUERY,
+                description='true to probe again results still cached'
+            )
+        ],
+        responses=HTTPCCMProbeSerializer(many=True),
+        description="Check whether HTTP Client Connector base URLs are reachable"
+    )
+    @action(detail=False, methods=['get'])
+    def probe(self, request):
+        """Reachability of every HTTP Client Connector's base URL, probed
+        concurrently. Results younger than PROBE_TTL seconds, such as those
+        of the background prober, are reused unless ?refresh=true."""
+        if mirror.use_mirror(request, 'httpsconns'):
+            connectors = mirror.connectors('http')
+        else:
+            connectors = self._list(request.telnet)
+            mirror.replace_connectors('http', connectors)
+        results = probe.probe(
+            [c['url'] for c in connectors if c.get('url')],
+            refresh=request.query_params.get('refresh') == 'true')
+        return JsonResponse({'connectors': [
+            dict({'cid': c['cid'], 'url': c.get('url')}, **results[c['url']])
+            for c in connectors if c.get('url')]})
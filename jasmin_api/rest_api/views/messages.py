@@ -0,0 +1,33 @@
+from rest_framework.viewsets import ViewSet
+from rest_framework.parsers import JSONParser
+from drf_spectacular.utils import extend_schema
+
+from rest_api import submit
+from rest_api.serializers import SendBatchSerializer, SendBatchResultSerializer
+from rest_api.tools import JsonResponse
+
+
+@extend_schema(tags=['Messages'])
+class MessagesViewSet(ViewSet):
+    "Viewset for sending messages through Jasmin's HTTP API"
+    serializer_class = SendBatchSerializer
+    parser_classes = [JSONParser]
+
+    @extend_schema(
+        request=SendBatchSerializer,
+        responses=SendBatchResultSerializer,
+        description="Send a batch of messages"
+    )
+    def create(self, request):
+        """Send messages through Jasmin's HTTP API /send, concurrently over
+        pooled keep-alive connections. No jcli connection is made.
+
+        HTTP codes indicate result as follows
+
+        - 200: the batch was forwarded, see each message's result
+        - 400: invalid batch, nothing was sent
+        """
+        results = submit.submit(submit.messages_params(request.data))
+        sent = sum(1 for r in results if r['status'] == 'success')
+        return JsonResponse({
+            'sent': sent, 'failed': len(results) - sent, 'results': results})
@@ -0,0 +1,15 @@
+from django.http import HttpResponse
+
+from rest_api import metrics as registry, workers
+
+
+def metrics(request):
+    """Prometheus scrape endpoint. Served from process memory only, added up
+    with the other run_cherrypy.py workers' files, no jcli connection is
+    made."""
+    if workers.enabled():
+        content = workers.render_metrics()
+    else:
+        content = registry.render()
+    return HttpResponse(
+        content, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,7 +1,7 @@
+import json
 from collections import OrderedDict
 
 from django.conf import settings
-from django.http import JsonResponse
 from django.utils.datastructures import MultiValueDictKeyError
 
 from rest_framework.viewsets import ViewSet
@@ -9,13 +9,16 @@ from rest_framework.decorators import action
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
-from rest_api.tools import set_ikeys, split_cols
+from rest_api import mirror, routing
+from rest_api.tools import (set_ikeys, split_cols, list_lines, iter_lines,
+                            ndjson_response, JsonResponse)
 from rest_api.exceptions import (JasminSyntaxError, JasminError,
                         UnknownError, MissingKeyError,
                         MutipleValuesRequiredKeyError, ObjectNotFoundError)
 from rest_api.serializers import (
-    MORouterListSerializer, MORouterDetailSerializer, 
-    MORouterCreateSerializer, SimpleResponseSerializer
+    MORouterSerializer, MORouterListSerializer, MORouterDetailSerializer, 
+    MORouterCreateSerializer, SimpleResponseSerializer, DryRunRowSerializer,
+    RouteDiffSerializer, RouteDiffResultSerializer
 )
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
@@ -28,41 +31,55 @@ class MORouterViewSet(ViewSet):
     lookup_field = 'order'
     serializer_class = MORouterListSerializer
 
-    def _list(self, telnet):
-        "List MO router as python dict"
-        telnet.sendline('morouter -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip().replace("\r", '').split("\n")
-        if len(result) < 3:
-            return {'morouters': []}
-        results = [l.replace(', ', ',').replace('(!)', '')
-            for l in result[2:-2] if l]
-        routers = split_cols(results)
-        print(routers)
+    def _parse(self, line):
+        "One morouter -l line as a dict, None if it is not a route row"
+        cols = split_cols([line.replace(', ', ',').replace('(!)', '')])
+        if not cols:
+            return None
+        r = cols[0]
         return {
-            'morouters':
-                [
-                    {
-                        'order': r[0].strip().lstrip('#'),
-                        'type': r[1],
-                        'connectors': [c.strip() for c in r[2].split(',')],
-                        'filters': [c.strip() for c in ' '.join(r[3:]).split(',')
-                            ] if len(r) > 3 else []
-                    } for r in routers
-                ]
+            'order': r[0].strip().lstrip('#'),
+            'type': r[1],
+            'connectors': [c.strip() for c in r[2].split(',')],
+            'filters': [c.strip() for c in ' '.join(r[3:]).split(',')
+                ] if len(r) > 3 else []
         }
 
+    def _list(self, telnet):
+        "List MO router as python dict"
+        routers = [self._parse(l) for l in list_lines(telnet, 'morouter -l')]
+        return {'morouters': [r for r in routers if r]}
+
     @extend_schema(
+        parameters=[mirror.SINCE_PARAMETER],
         responses=MORouterListSerializer,
         description="List all MO routers"
     )
     def list(self, request):
         "List MO routers. No parameters"
-        return JsonResponse(self._list(request.telnet))
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'morouters')
+        if mirror.use_mirror(request, 'morouters'):
+            return mirror.annotate(JsonResponse(
+                {'morouters': mirror.routes('mo')}), 'morouters')
+        routers = self._list(request.telnet)
+        mirror.replace_routes('mo', routers['morouters'])
+        return JsonResponse(routers)
+
+    @extend_schema(
+        responses={(200, 'application/x-ndjson'): MORouterSerializer},
+        description="Export all MO routes as newline delimited JSON"
+    )
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream MO routes, one JSON object per line, as jcli lists them"""
+        routers = map(self._parse, iter_lines(request.telnet, 'morouter -l'))
+        return ndjson_response(r for r in routers if r)
 
     def get_router(self, telnet, order):
         "Return data for one morouter as Python dict"
         morouters = self._list(telnet)['morouters']
+        mirror.replace_routes('mo', morouters)
         try:
             return {'morouter':
                 next((m for m in morouters if m['order'] == order), None)
@@ -84,6 +101,9 @@ class MORouterViewSet(ViewSet):
     )
     def retrieve(self, request, order):
         "Details for one MORouter by order (integer)"
+        if mirror.use_mirror(request, 'morouters'):
+            return mirror.annotate(
+                JsonResponse({'morouter': mirror.route('mo', order)}), 'morouters')
         return JsonResponse(self.get_router(request.telnet, order))
 
 
@@ -99,6 +119,7 @@ class MORouterViewSet(ViewSet):
         telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
         telnet.sendline('persist\n')
         telnet.expect(r'.*' + STANDARD_PROMPT)
+        mirror.replace_routes('mo', [])
         return JsonResponse({'morouters': []})
 
     @extend_schema(
@@ -162,6 +183,8 @@ class MORouterViewSet(ViewSet):
                 telnet.expect(r'.*' + STANDARD_PROMPT)
                 return JsonResponse({'morouter': self.get_router(telnet, order)})
             else:
+                telnet.expect(r'.*' + STANDARD_PROMPT)
+                mirror.delete_route('mo', order)
                 return JsonResponse({'order': order})
         elif matched_index == 1:
             raise UnknownError(detail='No router:' +  order)
@@ -191,3 +214,81 @@ class MORouterViewSet(ViewSet):
         """
         return self.simple_morouter_action(
             request.telnet, 'r', order, return_moroute=False)
+
+    @extend_schema(
+        parameters=routing.DRY_RUN_PARAMETERS,
+        request=routing.DRY_RUN_REQUEST,
+        responses={(200, 'application/x-ndjson'): DryRunRowSerializer},
+        description="Route a file of MO messages without sending them"
+    )
+    @action(detail=False, methods=['post'])
+    def dryrun(self, request):
+        """Route every message of a CSV (text/csv, header row naming the
+        message fields) or newline delimited JSON body through the current
+        MO routing table. Streams one decision per row and then a summary
+        of message counts per connector; ?rows=false answers with the
+        summary only.
+        """
+        router = routing.current_router(request, 'mo')
+        messages = routing.read_messages(request.stream, request.content_type)
+        if request.query_params.get('rows') == 'false':
+            response = JsonResponse(
+                next(routing.dry_run(router, messages, rows=False)))
+        else:
+            response = ndjson_response(routing.dry_run(router, messages))
+        if mirror.enabled():
+            mirror.annotate(response, 'morouters')
+        return response
+
+    @extend_schema(
+        parameters=routing.DRY_RUN_PARAMETERS,
+        request=RouteDiffSerializer,
+        responses=RouteDiffResultSerializer,
+        description="Compare a proposed MO routing table with the current one"
+    )
+    @action(detail=False, methods=['post'])
+    def diff(self, request):
+        """Route sample traffic through the current MO routing table and
+        a proposed one, and report the messages changing connector and the
+        message count deltas per connector. ?rows=false leaves out the
+        changed rows.
+
+        The proposal is JSON with routes and/or filters and the traffic as
+        messages, or a multipart form with a traffic file (CSV or newline
+        delimited JSON) and routes and filters as JSON fields.
+        """
+        tables = routing.current_tables(request, 'mo')
+        if mirror.enabled():
+            current = routing.current_router(request, 'mo')
+        else:
+            current = routing.Router('mo', *tables)
+        data = request.data
+        traffic = request.FILES.get('traffic')
+        proposal = {}
+        for key in ('routes', 'filters'):
+            if key in data:
+                proposal[key] = data[key]
+                if isinstance(proposal[key], str):
+                    #form field
+                    try:
+                        proposal[key] = json.loads(data[key])
+                    except ValueError:
+                        raise JasminSyntaxError('%s must be JSON' % key)
+        proposed = routing.Router(
+            'mo', *routing.proposed_tables(*tables, proposal))
+        if traffic is not None:
+            messages = routing.read_messages(
+                traffic, 'text/csv' if traffic.name.endswith('.csv')
+                else traffic.content_type)
+        elif isinstance(data.get('messages'), list):
+            if not all(isinstance(m, dict) for m in data['messages']):
+                raise JasminSyntaxError('Messages must be objects')
+            messages = (routing.Message.from_data(m) for m in data['messages'])
+        else:
+            raise MissingKeyError('Missing messages or traffic file')
+        response = JsonResponse(routing.diff(
+            current, proposed, messages,
+            rows=request.query_params.get('rows') != 'false'))
+        if mirror.enabled():
+            mirror.annotate(response, 'morouters')
+        return response
@@ -1,7 +1,7 @@
+import json
 from collections import OrderedDict
 
 from django.conf import settings
-from django.http import JsonResponse
 from django.utils.datastructures import MultiValueDictKeyError
 
 from rest_framework.viewsets import ViewSet
@@ -9,13 +9,17 @@ from rest_framework.decorators import action
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
-from rest_api.tools import set_ikeys, split_cols
+from rest_api import mirror, routing
+from rest_api.tools import (set_ikeys, split_cols, list_lines, iter_lines,
+                            ndjson_response, JsonResponse)
 from rest_api.exceptions import (JasminSyntaxError, JasminError,
                         UnknownError, MissingKeyError,
                         MutipleValuesRequiredKeyError, ObjectNotFoundError)
 from rest_api.serializers import (
-    MTRouterListSerializer, MTRouterDetailSerializer,
-    MTRouterCreateSerializer, SimpleResponseSerializer
+    MTRouterSerializer, MTRouterListSerializer, MTRouterDetailSerializer,
+    MTRouterCreateSerializer, SimpleResponseSerializer, RouteSimulateSerializer,
+    MTRoutingDecisionSerializer, DryRunRowSerializer,
+    RouteDiffSerializer, RouteDiffResultSerializer
 )
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
@@ -27,41 +31,56 @@ class MTRouterViewSet(ViewSet):
     lookup_field = 'order'
     serializer_class = MTRouterListSerializer
 
-    def _list(self, telnet):
-        "List MT router as python dict"
-        telnet.sendline('mtrouter -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip().replace("\r", '').split("\n")
-        if len(result) < 3:
-            return {'mtrouters': []}
-        results = [l.replace(', ', ',').replace('(!)', '')
-            for l in result[2:-2] if l]
-        routers = split_cols(results)
+    def _parse(self, line):
+        "One mtrouter -l line as a dict, None if it is not a route row"
+        cols = split_cols([line.replace(', ', ',').replace('(!)', '')])
+        if not cols:
+            return None
+        r = cols[0]
         return {
-            'mtrouters':
-                [
-                    {
-                        'order': r[0].strip().lstrip('#'),
-                        'type': r[1],
-                        'rate': r[2],
-                        'connectors': [c.strip() for c in r[3].split(',')],
-                        'filters': [c.strip() for c in ' '.join(r[4:]).split(',')
-                            ] if len(r) > 3 else []
-                    } for r in routers
-                ]
+            'order': r[0].strip().lstrip('#'),
+            'type': r[1],
+            'rate': r[2],
+            'connectors': [c.strip() for c in r[3].split(',')],
+            'filters': [c.strip() for c in ' '.join(r[4:]).split(',')
+                ] if len(r) > 4 else []
         }
 
+    def _list(self, telnet):
+        "List MT router as python dict"
+        routers = [self._parse(l) for l in list_lines(telnet, 'mtrouter -l')]
+        return {'mtrouters': [r for r in routers if r]}
+
     @extend_schema(
+        parameters=[mirror.SINCE_PARAMETER],
         responses=MTRouterListSerializer,
         description="List all MT routers"
     )
     def list(self, request):
         "List MT Routers. No parameters"
-        return JsonResponse(self._list(request.telnet))
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'mtrouters')
+        if mirror.use_mirror(request, 'mtrouters'):
+            return mirror.annotate(JsonResponse(
+                {'mtrouters': mirror.routes('mt')}), 'mtrouters')
+        routers = self._list(request.telnet)
+        mirror.replace_routes('mt', routers['mtrouters'])
+        return JsonResponse(routers)
+
+    @extend_schema(
+        responses={(200, 'application/x-ndjson'): MTRouterSerializer},
+        description="Export all MT routes as newline delimited JSON"
+    )
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream MT routes, one JSON object per line, as jcli lists them"""
+        routers = map(self._parse, iter_lines(request.telnet, 'mtrouter -l'))
+        return ndjson_response(r for r in routers if r)
 
     def get_router(self, telnet, order):
         "Return data for one mtrouter as Python dict"
         routers = self._list(telnet)['mtrouters']
+        mirror.replace_routes('mt', routers)
         try:
             return {'mtrouter':
                 next((m for m in routers if m['order'] == order), None)
@@ -83,6 +102,9 @@ class MTRouterViewSet(ViewSet):
     )
     def retrieve(self, request, order):
         "Details for one MTRouter by order (integer)"
+        if mirror.use_mirror(request, 'mtrouters'):
+            return mirror.annotate(
+                JsonResponse({'mtrouter': mirror.route('mt', order)}), 'mtrouters')
         return JsonResponse(self.get_router(request.telnet, order))
 
 
@@ -98,6 +120,7 @@ class MTRouterViewSet(ViewSet):
         telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
         telnet.sendline('persist\n')
         telnet.expect(r'.*' + STANDARD_PROMPT)
+        mirror.replace_routes('mt', [])
         return JsonResponse({'mtrouters': []})
 
     @extend_schema(
@@ -162,6 +185,8 @@ class MTRouterViewSet(ViewSet):
                 telnet.expect(r'.*' + STANDARD_PROMPT)
                 return JsonResponse({'mtrouter': self.get_router(telnet, order)})
             else:
+                telnet.expect(r'.*' + STANDARD_PROMPT)
+                mirror.delete_route('mt', order)
                 return JsonResponse({'order': order})
         elif matched_index == 1:
             raise UnknownError(detail='No router:' +  order)
@@ -191,3 +216,110 @@ class MTRouterViewSet(ViewSet):
         """
         return self.simple_mtrouter_action(
             request.telnet, 'r', order, return_mtroute=False)
+
+    @extend_schema(
+        request=RouteSimulateSerializer,
+        responses=MTRoutingDecisionSerializer,
+        description="Find the route and connector MT messages would take"
+    )
+    @action(detail=False, methods=['post'])
+    def simulate(self, request):
+        """Route a message, or a list of them as messages, through the
+        current MT routing table, without sending anything
+
+        Message fields: uid, gid, source_addr, destination_addr, content,
+        tags and time (ISO 8601, default now). For a list the response is
+        {"results": [...]}, one decision per message.
+        """
+        router = routing.current_router(request, 'mt')
+        data = request.data
+        if isinstance(data, dict) and 'messages' in data:
+            if not isinstance(data['messages'], list):
+                raise JasminSyntaxError('messages must be a list')
+            response = JsonResponse({'results': [
+                router.decide(routing.Message.from_data(m))
+                for m in data['messages']]})
+        else:
+            response = JsonResponse(
+                router.decide(routing.Message.from_data(data)))
+        if mirror.enabled():
+            mirror.annotate(response, 'mtrouters')
+        return response
+
+    @extend_schema(
+        parameters=routing.DRY_RUN_PARAMETERS,
+        request=routing.DRY_RUN_REQUEST,
+        responses={(200, 'application/x-ndjson'): DryRunRowSerializer},
+        description="Route a file of MT messages without sending them"
+    )
+    @action(detail=False, methods=['post'])
+    def dryrun(self, request):
+        """Route every message of a CSV (text/csv, header row naming the
+        message fields) or newline delimited JSON body through the current
+        MT routing table. Streams one decision per row and then a summary
+        of message counts per connector; ?rows=false answers with the
+        summary only.
+        """
+        router = routing.current_router(request, 'mt')
+        messages = routing.read_messages(request.stream, request.content_type)
+        if request.query_params.get('rows') == 'false':
+            response = JsonResponse(
+                next(routing.dry_run(router, messages, rows=False)))
+        else:
+            response = ndjson_response(routing.dry_run(router, messages))
+        if mirror.enabled():
+            mirror.annotate(response, 'mtrouters')
+        return response
+
+    @extend_schema(
+        parameters=routing.DRY_RUN_PARAMETERS,
+        request=RouteDiffSerializer,
+        responses=RouteDiffResultSerializer,
+        description="Compare a proposed MT routing table with the current one"
+    )
+    @action(detail=False, methods=['post'])
+    def diff(self, request):
+        """Route sample traffic through the current MT routing table and
+        a proposed one, and report the messages changing connector and the
+        message count deltas per connector. ?rows=false leaves out the
+        changed rows.
+
+        The proposal is JSON with routes and/or filters and the traffic as
+        messages, or a multipart form with a traffic file (CSV or newline
+        delimited JSON) and routes and filters as JSON fields.
+        """
+        tables = routing.current_tables(request, 'mt')
+        if mirror.enabled():
+            current = routing.current_router(request, 'mt')
+        else:
+            current = routing.Router('mt', *tables)
+        data = request.data
+        traffic = request.FILES.get('traffic')
+        proposal = {}
+        for key in ('routes', 'filters'):
+            if key in data:
+                proposal[key] = data[key]
+                if isinstance(proposal[key], str):
+                    #form field
+                    try:
+                        proposal[key] = json.loads(data[key])
+                    except ValueError:
+                        raise JasminSyntaxError('%s must be JSON' % key)
+        proposed = routing.Router(
+            'mt', *routing.proposed_tables(*tables, proposal))
+        if traffic is not None:
+            messages = routing.read_messages(
+                traffic, 'text/csv' if traffic.name.endswith('.csv')
+                else traffic.content_type)
+        elif isinstance(data.get('messages'), list):
+            if not all(isinstance(m, dict) for m in data['messages']):
+                raise JasminSyntaxError('Messages must be objects')
+            messages = (routing.Message.from_data(m) for m in data['messages'])
+        else:
+            raise MissingKeyError('Missing messages or traffic file')
+        response = JsonResponse(routing.diff(
+            current, proposed, messages,
+            rows=request.query_params.get('rows') != 'false'))
+        if mirror.enabled():
+            mirror.annotate(response, 'mtrouters')
+        return response
@@ -0,0 +1,37 @@
+from django.http import FileResponse, JsonResponse
+
+from rest_framework.permissions import BasePermission
+from rest_framework.views import APIView
+from drf_spectacular.utils import extend_schema
+
+from rest_api import profiling
+from rest_api.exceptions import ObjectNotFoundError
+
+
+class IsSuperUser(BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+@extend_schema(exclude=True)
+class ProfileListView(APIView):
+    "Request profiles captured by ProfilingMiddleware, newest first"
+    permission_classes = (IsSuperUser,)
+
+    def get(self, request):
+        return JsonResponse({'profiles': profiling.list_profiles()})
+
+
+@extend_schema(exclude=True)
+class ProfileDownloadView(APIView):
+    """Download one profile as a cProfile dump, readable with pstats or
+    tools such as snakeviz"""
+    permission_classes = (IsSuperUser,)
+
+    def get(self, request, name):
+        path = profiling.profile_path(name)
+        if path is None:
+            raise ObjectNotFoundError('No profile: %s' % name)
+        return FileResponse(
+            open(path, 'rb'), as_attachment=True, filename=name,
+            content_type='application/octet-stream')
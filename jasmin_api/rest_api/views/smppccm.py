@@ -1,5 +1,4 @@
 from django.conf import settings
-from django.http import JsonResponse
 
 from rest_framework.viewsets import ViewSet
 from rest_framework.parsers import JSONParser
@@ -7,13 +6,15 @@ from rest_framework.decorators import action, parser_classes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
-from rest_api.tools import set_ikeys, split_cols
+from rest_api import mirror
+from rest_api.tools import set_ikeys, split_cols, list_lines, JsonResponse
 from rest_api.exceptions import (
     JasminSyntaxError, JasminError, ActionFailed,
     ObjectNotFoundError, UnknownError, 
 )
 from rest_api.serializers import (
-    SMPPCCMListSerializer, SMPPCCMCreateSerializer, SimpleResponseSerializer
+    SMPPCCMListSerializer, SMPPCCMCreateSerializer, SimpleResponseSerializer,
+    MTRouterListSerializer
 )
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
@@ -48,12 +49,43 @@ class SMPPCCMViewSet(ViewSet):
         return smppccm
 
     def get_connector_list(self, telnet):
-        telnet.sendline('smppccm -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip().replace("\r", '').split("\n")
-        if len(result) < 3:
-            return []
-        return split_cols(result[2:-2])
+        return split_cols(list_lines(telnet, 'smppccm -l'))
+
+    def _list(self, telnet):
+        "Connectors with their details and status, as list returns them"
+        connectors = []
+        for raw_data in self.get_connector_list(telnet):
+            cid = raw_data[0][1:]
+            connector = self.get_smppccm(telnet, cid, True)
+            connector.update(
+                cid=cid,
+                status=raw_data[1],
+                session=raw_data[2],
+                starts=raw_data[3],
+                stops=raw_data[4]
+            )
+            connectors.append(connector)
+        return connectors
+
+    def _connector(self, telnet, cid):
+        "One connector with its details and status, as retrieve returns it"
+        connector = self.get_smppccm(telnet, cid, silent=False)
+        connector_list = self.get_connector_list(telnet)
+        list_data = next(
+            (raw_data for raw_data in connector_list if
+                raw_data[0] == '#' + cid),
+            None
+        )
+        if not list_data:
+            raise ObjectNotFoundError('Unknown connector: %s' % cid)
+        connector.update(
+            cid=cid,
+            status=list_data[1],
+            session=list_data[2],
+            starts=list_data[3],
+            stops=list_data[4]
+        )
+        return connector
 
     def simple_smppccm_action(self, telnet, action, cid):
         telnet.sendline('smppccm -%s %s' % (action, cid))
@@ -64,6 +96,11 @@ class SMPPCCMViewSet(ViewSet):
         ])
         if matched_index == 0:
             telnet.sendline('persist\n')
+            telnet.expect(r'.*' + STANDARD_PROMPT)
+            if action == 'r':
+                mirror.delete_connector('smpp', cid)
+            elif mirror.enabled():
+                mirror.save_connector('smpp', self._connector(telnet, cid))
             return JsonResponse({'name': cid})
         elif matched_index == 1:
             raise ObjectNotFoundError('Unknown SMPP Connector: %s' % cid)
@@ -71,6 +108,7 @@ class SMPPCCMViewSet(ViewSet):
             raise ActionFailed(telnet.match.group(1))
 
     @extend_schema(
+        parameters=[mirror.SINCE_PARAMETER],
         responses=SMPPCCMListSerializer,
         description="List all SMPP Client Connectors"
     )
@@ -81,21 +119,13 @@ class SMPPCCMViewSet(ViewSet):
         1. the "service" column is called "status"
         2. the cid is the full connector id of the form smpps(cid)
         """
-        telnet = request.telnet
-        connector_list = self.get_connector_list(telnet)
-        connectors = []
-        for raw_data in connector_list:
-            if raw_data[0][0] == '#':
-                cid = raw_data[0][1:]
-                connector = self.get_smppccm(telnet, cid, True)
-                connector.update(
-                    cid=cid,
-                    status=raw_data[1],
-                    session=raw_data[2],
-                    starts=raw_data[3],
-                    stops=raw_data[4]
-                )
-                connectors.append(connector)
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'smppsconns')
+        if mirror.use_mirror(request, 'smppsconns'):
+            return mirror.annotate(JsonResponse(
+                {'connectors': mirror.connectors('smpp')}), 'smppsconns')
+        connectors = self._list(request.telnet)
+        mirror.replace_connectors('smpp', connectors)
         return JsonResponse({'connectors': connectors})
 
     @extend_schema(
@@ -113,22 +143,12 @@ class SMPPCCMViewSet(ViewSet):
     def retrieve(self, request, cid):
         """Retreive data for one connector
         Required parameter: cid (connector id)"""
-        telnet = request.telnet
-        connector = self.get_smppccm(telnet, cid, silent=False)
-        connector_list = self.get_connector_list(telnet)
-        list_data = next(
-            (raw_data for raw_data in connector_list if
-                raw_data[0] == '#' + cid),
-            None
-        )
-        connector.update(
-            cid=cid,
-            status=list_data[1],
-            session=list_data[2],
-            starts=list_data[3],
-            stops=list_data[4]
-        )
-        return JsonResponse({'connector': connector})
+        if mirror.use_mirror(request, 'smppsconns'):
+            connector = mirror.connector('smpp', cid)
+            if connector is not None:
+                return mirror.annotate(
+                    JsonResponse({'connector': connector}), 'smppsconns')
+        return JsonResponse({'connector': self._connector(request.telnet, cid)})
 
     @extend_schema(
         request=SMPPCCMCreateSerializer,
@@ -159,6 +179,9 @@ class SMPPCCMViewSet(ViewSet):
         telnet.sendline('ok')
         telnet.sendline('persist\n')
         telnet.expect(r'.*' + STANDARD_PROMPT)
+        if mirror.enabled():
+            mirror.save_connector(
+                'smpp', self._connector(telnet, request.data['cid']))
         return JsonResponse({'cid': request.data['cid']})
 
     @extend_schema(
@@ -169,7 +192,7 @@ class SMPPCCMViewSet(ViewSet):
                 location=OpenApiParameter.PATH,
                 description='Connector identifier'
             )
-        ],
+        ] + mirror.DELETE_PARAMETERS,
         responses=SimpleResponseSerializer,
         description="Delete an SMPP connector"
     )
@@ -182,7 +205,14 @@ class SMPPCCMViewSet(ViewSet):
         - 200: successful deletion
         - 404: nonexistent group
         - 400: other error
+        - 409: still used, see dependents in the response
+
+        ?preview=true lists the dependents without deleting, ?force=true
+        deletes anyway
         """
+        preview = mirror.guard_delete(request, 'smppcc', cid)
+        if preview is not None:
+            return preview
         return self.simple_smppccm_action(request.telnet, 'r', cid)
 
     @extend_schema(
@@ -246,7 +276,8 @@ class SMPPCCMViewSet(ViewSet):
         telnet.sendline('persist\n')
         #Not sure why this needs to be repeated, just as with user
         telnet.expect(r'.*' + STANDARD_PROMPT)
-
+        if mirror.enabled():
+            mirror.save_connector('smpp', self._connector(telnet, cid))
         return JsonResponse(
             {'connector': self.get_smppccm(telnet, cid, silent=False)})
 
@@ -301,3 +332,28 @@ class SMPPCCMViewSet(ViewSet):
         - 400: other error - this includes failure to stop because it is stopped.
         """
         return self.simple_smppccm_action(request.telnet, '0', cid)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='cid',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.PATH,
+                description='Connector identifier'
+            )
+        ],
+        responses=MTRouterListSerializer,
+        description="List the MT routes sending to an SMPP connector"
+    )
+    @action(detail=True, methods=['get'])
+    def routes(self, request, cid):
+        """MT routes sending to the connector, from the mirror
+
+        - 200: the routes, possibly none
+        - 404: nonexistent connector
+        """
+        mirror.fresh(request, 'smppsconns', 'mtrouters')
+        routes = mirror.connector_routes('smpp', cid)
+        if routes is None:
+            raise ObjectNotFoundError('Unknown connector: %s' % cid)
+        return mirror.annotate(JsonResponse({'mtrouters': routes}), 'mtrouters')
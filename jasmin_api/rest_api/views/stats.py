@@ -0,0 +1,111 @@
+from rest_framework.viewsets import ViewSet
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from drf_spectacular.types import OpenApiTypes
+
+from rest_api import stats
+from rest_api.exceptions import ObjectNotFoundError
+from rest_api.serializers import StatsSerializer, StatsListSerializer
+from rest_api.tools import JsonResponse
+
+WINDOW_PARAMETER = OpenApiParameter(
+    name='window', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+    description='Comma separated windows such as 30s, 5m or 1h, default 1m,5m,1h')
+
+
+class StatsViewSet(ViewSet):
+    """Stats sampled from jcli in the background, see rest_api.stats. They
+    are served from the database, no jcli connection is made."""
+    kind = None
+    id_key = None
+
+    def list(self, request):
+        store = stats.store()
+        windows = stats.parse_windows(request.query_params.get('window'))
+        rows = [dict({self.id_key: oid}, **result)
+                for oid, result in store.query_all(self.kind, windows)]
+        return JsonResponse({'sampled_at': store.sampled_at, 'stats': rows})
+
+    def _retrieve(self, request, oid):
+        windows = stats.parse_windows(request.query_params.get('window'))
+        result = stats.store().query(self.kind, oid, windows)
+        if result is None:
+            raise ObjectNotFoundError('No stats for: %s' % oid)
+        return JsonResponse(dict({self.id_key: oid}, **result))
+
+
+@extend_schema(tags=['Stats'])
+class UserStatsViewSet(StatsViewSet):
+    "Traffic stats of users"
+    lookup_field = 'uid'
+    serializer_class = StatsListSerializer
+    kind = 'user'
+    id_key = 'uid'
+
+    @extend_schema(
+        parameters=[WINDOW_PARAMETER],
+        responses=StatsListSerializer,
+        description="Stats of all users"
+    )
+    def list(self, request):
+        "Stats of every sampled user"
+        return super().list(request)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='uid',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.PATH,
+                description='User identifier'
+            ),
+            WINDOW_PARAMETER,
+        ],
+        responses=StatsSerializer,
+        description="Stats of a user"
+    )
+    def retrieve(self, request, uid):
+        """Stats of a user
+
+        - 200: the stats
+        - 404: user not sampled (yet)
+        """
+        return self._retrieve(request, uid)
+
+
+@extend_schema(tags=['Stats'])
+class SMPPCStatsViewSet(StatsViewSet):
+    "Traffic stats of SMPP client connectors"
+    lookup_field = 'cid'
+    serializer_class = StatsListSerializer
+    kind = 'smppc'
+    id_key = 'cid'
+
+    @extend_schema(
+        parameters=[WINDOW_PARAMETER],
+        responses=StatsListSerializer,
+        description="Stats of all SMPP client connectors"
+    )
+    def list(self, request):
+        "Stats of every sampled connector"
+        return super().list(request)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='cid',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.PATH,
+                description='Connector identifier'
+            ),
+            WINDOW_PARAMETER,
+        ],
+        responses=StatsSerializer,
+        description="Stats of an SMPP client connector"
+    )
+    def retrieve(self, request, cid):
+        """Stats of an SMPP client connector
+
+        - 200: the stats
+        - 404: connector not sampled (yet)
+        """
+        return self._retrieve(request, cid)
@@ -1,5 +1,4 @@
 from django.conf import settings
-from django.http import JsonResponse
 
 from rest_framework.viewsets import ViewSet
 from rest_framework.parsers import JSONParser
@@ -7,18 +6,46 @@ from rest_framework.decorators import action, parser_classes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
-from rest_api.tools import set_ikeys
+from rest_api import mirror
+from rest_api.tools import (set_ikeys, split_cols, list_lines, paginate, project,
+                            requested_fields, ndjson_response, JsonResponse)
 from rest_api.exceptions import (JasminSyntaxError, JasminError,
                         UnknownError, MissingKeyError,
                         ObjectNotFoundError)
 from rest_api.serializers import (
-    UserListSerializer, UserDetailSerializer, UserCreateSerializer,
+    UserSerializer, UserListSerializer, UserDetailSerializer, UserCreateSerializer,
     UserUpdateSerializer, SimpleResponseSerializer
 )
 
 STANDARD_PROMPT = settings.STANDARD_PROMPT
 INTERACTIVE_PROMPT = settings.INTERACTIVE_PROMPT
 
+#Fields user -l gives; listing only these needs no user -s per user
+LIST_FIELDS = ('uid', 'gid', 'username', 'status')
+
+LIST_PARAMETERS = [
+    OpenApiParameter(
+        name='gid', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+        description='Only users in this group'),
+    OpenApiParameter(
+        name='status', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+        enum=['enabled', 'disabled'], description='Only users with this status'),
+    OpenApiParameter(
+        name='q', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+        description='Only users whose uid or username contains this'),
+    OpenApiParameter(
+        name='fields', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+        description='Comma separated fields to return. uid, gid, '
+                    'username and status alone are much faster'),
+    OpenApiParameter(
+        name='limit', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+        description='Page size. Pages are ordered by uid'),
+    OpenApiParameter(
+        name='cursor', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+        description='The next value of the previous page'),
+    mirror.SINCE_PARAMETER,
+]
+
 @extend_schema(tags=['Users'])
 class UserViewSet(ViewSet):
     "ViewSet for managing *Jasmin* users (*not* Django auth users)"
@@ -39,7 +66,10 @@ class UserViewSet(ViewSet):
                 return
             else:
                 raise ObjectNotFoundError('Unknown user: %s' % uid)
-        result = telnet.match.group(1)
+        return self._parse(telnet.match.group(1))
+
+    def _parse(self, result):
+        "A user from what jcli answers to user -s, echoed command included"
         user = {}
         for line in [l for l in result.splitlines() if l][1:]:
             d = [x for x in line.split() if x]
@@ -71,38 +101,114 @@ class UserViewSet(ViewSet):
     )
     def retrieve(self, request, uid):
         "Retrieve data for one user"
+        if mirror.use_mirror(request, 'users'):
+            user = mirror.user(uid)
+            if user is not None:
+                return mirror.annotate(JsonResponse({'user': user}), 'users')
         return JsonResponse({'user': self.get_user(request.telnet, uid)})
 
+    def _list(self, telnet):
+        "Users as listed by user -l, with the LIST_FIELDS only"
+        return self._rows(list_lines(telnet, 'user -l'))
+
+    def _rows(self, lines):
+        "Users from user -l lines"
+        users = []
+        for u in split_cols(lines):
+            uid = u[0][1:]
+            status = 'enabled'
+            #Disabled users are listed as #!uid
+            if uid.startswith('!'):
+                uid, status = uid[1:], 'disabled'
+            users.append({
+                'uid': uid, 'gid': u[1], 'username': u[2], 'status': status})
+        return users
+
     @extend_schema(
+        parameters=LIST_PARAMETERS,
         responses=UserListSerializer,
         description="List all users"
     )
     def list(self, request):
-        "List users. No parameters"
+        """List users
+
+        Optional filters gid, status and q (substring of uid or username),
+        fields to return only some fields, limit and cursor to page through
+        the users. When paging the response has a next cursor, null on the
+        last page.
+        """
+        if 'since' in request.query_params:
+            return mirror.delta(request, 'users')
+        params = request.query_params
+        fields = requested_fields(params)
+        from_mirror = mirror.use_mirror(request, 'users')
+        if from_mirror:
+            self._check_status(params)
+            users = mirror.users(
+                params.get('gid'), params.get('status'), params.get('q'))
+            users, next_cursor = paginate(users, 'uid', params)
+            users = [project(u, fields) for u in users]
+        else:
+            telnet = request.telnet
+            listed = self._list(telnet)
+            selected = self._select(listed, params)
+            selected, next_cursor = paginate(selected, 'uid', params)
+            users = list(self._details(telnet, selected, fields))
+            if fields is None and len(selected) == len(listed):
+                #every user was fetched in full
+                mirror.replace_users(users)
+        response = {'users': users}
+        if 'limit' in params or 'cursor' in params:
+            response['next'] = next_cursor
+        response = JsonResponse(response)
+        return mirror.annotate(response, 'users') if from_mirror else response
+
+    @extend_schema(
+        parameters=LIST_PARAMETERS[:4],
+        responses={(200, 'application/x-ndjson'): UserSerializer},
+        description="Export users as newline delimited JSON"
+    )
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream users, one JSON object per line. Takes the same gid,
+        status, q and fields parameters as list. Each user is fetched from
+        jcli only when the client is ready for it."""
         telnet = request.telnet
-        telnet.sendline('user -l')
-        telnet.expect([r'(.+)\n' + STANDARD_PROMPT])
-        result = telnet.match.group(0).strip()
-        if len(result) < 3:
-            return JsonResponse({'users': []})
-
-        results = [l for l in result.splitlines() if l]
-        annotated_uids = [u.split(None, 1)[0][1:] for u in results[2:-2]]
-        users = []
-        for auid in annotated_uids:
-            if auid[0] == '!':
-                udata = self.get_user(telnet, auid[1:], True)
-                udata['status'] = 'disabled'
-            else:
-                udata = self.get_user(telnet, auid, True)
-                udata['status'] = 'enabled'
-            users.append(udata)
-        return JsonResponse(
-            {
-                #return users skipping None (== nonexistent user)
-                'users': [u for u in users if u]
-            }
-        )
+        params = request.query_params
+        users = self._select(self._list(telnet), params)
+        return ndjson_response(
+            self._details(telnet, users, requested_fields(params)))
+
+    def _check_status(self, params):
+        if params.get('status') not in (None, '', 'enabled', 'disabled'):
+            raise JasminSyntaxError('status must be enabled or disabled')
+
+    def _select(self, users, params):
+        "Users from _list matching the gid, status and q parameters"
+        self._check_status(params)
+        if params.get('gid'):
+            users = [u for u in users if u['gid'] == params['gid']]
+        if params.get('status'):
+            users = [u for u in users if u['status'] == params['status']]
+        if params.get('q'):
+            q = params['q'].lower()
+            users = [u for u in users
+                     if q in u['uid'].lower() or q in u['username'].lower()]
+        return users
+
+    def _details(self, telnet, users, fields):
+        """Yield users from _list with the requested fields, running user -s
+        only when fields asks for more than LIST_FIELDS"""
+        if fields is not None and set(fields) <= set(LIST_FIELDS):
+            for u in users:
+                yield project(u, fields)
+            return
+        for u in users:
+            udata = self.get_user(telnet, u['uid'], True)
+            #skip users removed since user -l
+            if udata:
+                udata['status'] = u['status']
+                yield project(udata, fields)
 
     @extend_schema(
         request=UserCreateSerializer,
@@ -131,7 +237,9 @@ class UserViewSet(ViewSet):
         )
         telnet.sendline('persist\n')
         telnet.expect(r'.*' + STANDARD_PROMPT)
-        return JsonResponse({'user': self.get_user(telnet, uid)})
+        user = self.get_user(telnet, uid)
+        mirror.save_user(user, 'enabled')
+        return JsonResponse({'user': user})
 
     @extend_schema(
         parameters=[
@@ -195,7 +303,9 @@ class UserViewSet(ViewSet):
         telnet.sendline('persist\n')
         #Not sure why this needs to be repeated
         telnet.expect(r'.*' + STANDARD_PROMPT)
-        return JsonResponse({'user': self.get_user(telnet, uid)})
+        user = self.get_user(telnet, uid)
+        mirror.save_user(user)
+        return JsonResponse({'user': user})
 
     def simple_user_action(self, telnet, action, uid, return_user=True):
         telnet.sendline('user -%s %s' % (action, uid))
@@ -208,8 +318,11 @@ class UserViewSet(ViewSet):
             telnet.sendline('persist\n')
             if return_user:
                 telnet.expect(r'.*' + STANDARD_PROMPT)
-                return JsonResponse({'user': self.get_user(telnet, uid)})
+                user = self.get_user(telnet, uid)
+                mirror.save_user(user, {'e': 'enabled', 'd': 'disabled'}.get(action))
+                return JsonResponse({'user': user})
             else:
+                mirror.delete_user(uid)
                 return JsonResponse({'uid': uid})
         elif matched_index == 1:
             raise UnknownError(detail='No user:' +  uid)
@@ -0,0 +1,86 @@
+"""Startup phase of run_cherrypy.py, before a process reports ready
+
+start() logs WARMUP_SESSIONS jcli sessions in to every backend and keeps
+them idle in its pool (JCLI_POOL_SIZE at most), then, when asked to
+preload, refreshes the whole mirror from jcli over one of them. The first
+requests after a restart then neither log in nor wait on jcli for users,
+connectors or routes. Meanwhile state() reports 'warming', which /readyz
+answers with a 503. Failures are logged and reported, but the process
+still becomes ready: it serves the same, only slower. A process that never
+warms up, under runserver or ASGI, is ready from the start.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import APIException
+
+from . import backends, mirror
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state = {'status': 'ready', 'sessions': {}, 'preloaded': [], 'errors': [],
+          'seconds': None}
+
+
+def state():
+    "Copy of the warm-up state, as /readyz reports it"
+    with _lock:
+        return dict(_state, sessions=dict(_state['sessions']),
+                    preloaded=list(_state['preloaded']),
+                    errors=list(_state['errors']))
+
+
+def _detail(error):
+    if isinstance(error, APIException):
+        return str(error.detail)
+    return str(error) or error.__class__.__name__
+
+
+def _failed(stage, name, error):
+    logger.warning('Warm-up %s of backend %s failed: %s',
+                   stage, name, _detail(error))
+    with _lock:
+        _state['errors'].append(
+            {'stage': stage, 'backend': name, 'detail': _detail(error)})
+
+
+def run(preload=False):
+    "Warm up every backend's pool, then preload the mirror if asked"
+    start = time.monotonic()
+    for name, backend in sorted(backends.registry().items()):
+        try:
+            idle = backend.pool.warm(settings.WARMUP_SESSIONS)
+        except Exception as e:
+            _failed('sessions', name, e)
+            idle = backend.pool.idle.qsize()
+        with _lock:
+            _state['sessions'][name] = idle
+    if preload:
+        name = settings.DEFAULT_BACKEND
+        try:
+            backends.run(backends.get(name), mirror.refresh)
+            with _lock:
+                _state['preloaded'] = list(mirror.TABLES)
+        except Exception as e:
+            _failed('preload', name, e)
+        finally:
+            close_old_connections()
+    with _lock:
+        _state['seconds'] = round(time.monotonic() - start, 3)
+        _state['status'] = 'ready'
+    logger.info('Warmed up in %.2fs', _state['seconds'])
+
+
+def start(preload=False):
+    "Report 'warming' and run() in a daemon thread"
+    with _lock:
+        _state.update(status='warming', sessions={}, preloaded=[], errors=[],
+                      seconds=None)
+    thread = threading.Thread(
+        target=run, args=(preload,), name='warmup', daemon=True)
+    thread.start()
+    return thread
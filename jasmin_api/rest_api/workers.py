@@ -0,0 +1,148 @@
+"""State the workers of run_cherrypy.py share, so that any of them answers
+/metrics and /readyz for all
+
+With WORKERS_DIR set, each worker writes its metrics and warm-up state to
+worker-<index>.json there every DUMP_INTERVAL seconds, and the worker
+serving /metrics adds up those of every worker, its own read live. When a
+worker dies the runner retire()s its file: its counters and histograms are
+added to retired.json, so that totals do not go down when it is replaced,
+and its gauges are dropped. Values are as recent as the last dump, and a
+dead worker's increments since its last one are lost.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics, warmup
+
+logger = logging.getLogger(__name__)
+
+DUMP_INTERVAL = 1
+RETIRED = 'retired.json'
+
+#index of this worker, None when not sharing
+_index = None
+
+
+def _path(name):
+    return os.path.join(settings.WORKERS_DIR, name)
+
+
+def _worker_file(index):
+    return _path('worker-%d.json' % index)
+
+
+def _encode(snapshot):
+    return {name: [[list(key), value] for key, value in values.items()]
+            for name, values in snapshot.items()}
+
+
+def _decode(data):
+    return {name: {tuple(key): value for key, value in values}
+            for name, values in data.items()}
+
+
+def _write(path, data):
+    temporary = '%s.%d' % (path, os.getpid())
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def enabled():
+    return _index is not None and bool(settings.WORKERS_DIR)
+
+
+def dump():
+    "Write this worker's metrics and warm-up state"
+    _write(_worker_file(_index), {
+        'index': _index, 'pid': os.getpid(),
+        'metrics': _encode(metrics.snapshot()),
+        'warmup': warmup.state()})
+
+
+def share(index):
+    "Dump the state of worker index every DUMP_INTERVAL seconds"
+    global _index
+    _index = index
+
+    def run():
+        while True:
+            try:
+                dump()
+            except Exception:
+                logger.exception('Sharing the state of worker %d failed', index)
+            time.sleep(DUMP_INTERVAL)
+
+    thread = threading.Thread(target=run, name='worker-state', daemon=True)
+    thread.start()
+    return thread
+
+
+def others():
+    "{index: state} of the other workers, as last dumped"
+    states = {}
+    for path in glob.glob(_path('worker-*.json')):
+        state = _read(path)
+        if state is not None and state['index'] != _index:
+            states[state['index']] = state
+    return states
+
+
+def render_metrics():
+    "Metrics of every worker, and of the retired ones, added up"
+    snapshots = [metrics.snapshot()]
+    snapshots += [_decode(s['metrics']) for s in others().values()]
+    retired = _read(_path(RETIRED))
+    if retired is not None:
+        snapshots.append(_decode(retired))
+    return metrics.render(metrics.merge(snapshots))
+
+
+def readiness():
+    """This worker's warm-up state, with the status of every worker under
+    workers. It is only ready once they all are"""
+    state = warmup.state()
+    workers = {_index: state['status']}
+    workers.update(
+        (index, other['warmup']['status']) for index, other in others().items())
+    state['workers'] = {str(i): status for i, status in sorted(workers.items())}
+    if any(status != 'ready' for status in workers.values()):
+        state['status'] = 'warming'
+    return state
+
+
+def setup(directory):
+    "Use directory for the workers about to be forked, left from none before"
+    settings.WORKERS_DIR = directory
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(_path('worker-*.json')) + [_path(RETIRED)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def retire(index):
+    """Add the counters and histograms of dead worker index to those of
+    retired workers, and forget its state"""
+    state = _read(_worker_file(index))
+    if state is None:
+        return
+    snapshots = [_decode(state['metrics'])]
+    retired = _read(_path(RETIRED))
+    if retired is not None:
+        snapshots.append(_decode(retired))
+    _write(_path(RETIRED), _encode(metrics.merge(snapshots, gauges=False)))
+    os.remove(_worker_file(index))
@@ -1,18 +1,219 @@
 #!/usr/bin/env python
+"""Serve the API with CherryPy
 
-from jasmin_api.wsgi import application
+The SERVER_* settings configure the server, and the options below override
+them. With more than one worker process, the listening socket is bound
+here, IPv4 or IPv6, and inherited by the forked workers, which all accept
+on it: the kernel spreads connections over them, each serving from its own
+pool of threads. This process restarts workers that die. All workers share the
+JCLI_MAX_SESSIONS budget of jcli sessions per backend.
 
-import cherrypy
+Each worker first warms up, see rest_api.warmup: it logs in jcli sessions
+ahead of the first requests, and /readyz answers 503 until it is done. The
+first worker also preloads the mirror then, and keeps it synced. It alone
+samples jcli stats and probes HTTP connectors, into the database every
+worker reads them from.
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
 
-cherrypy.tree.graft(application, "/")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "jasmin_api.settings")
 
-server = cherrypy._cpserver.Server()
+from django.conf import settings
 
-server.socket_host = "0.0.0.0"
-server.socket_port = 8000
-server.thread_pool = 10
+logger = logging.getLogger('run_cherrypy')
 
-server.subscribe()
+#the socket listen() bound, for the workers forked next
+_listener = None
 
-cherrypy.engine.start()
-cherrypy.engine.block()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=settings.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=settings.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=settings.SERVER_WORKERS,
+                        help='Worker processes, 0 for one per CPU')
+    parser.add_argument('--threads', type=int, default=settings.SERVER_THREADS,
+                        help='Threads per worker')
+    parser.add_argument('--socket-queue-size', type=int,
+                        default=settings.SERVER_SOCKET_QUEUE_SIZE,
+                        help='Listen backlog')
+    parser.add_argument('--socket-timeout', type=float,
+                        default=settings.SERVER_SOCKET_TIMEOUT,
+                        help='Seconds a connection may stay idle')
+    parser.add_argument('--keep-alive', action=argparse.BooleanOptionalAction,
+                        default=settings.SERVER_KEEP_ALIVE,
+                        help='Keep HTTP/1.1 connections open between requests')
+    parser.add_argument('--keep-alive-connections', type=int,
+                        default=settings.SERVER_KEEP_ALIVE_CONNECTIONS,
+                        help='Idle keep-alive connections kept open per worker')
+    parser.add_argument('--max-sessions', type=int,
+                        default=settings.JCLI_MAX_SESSIONS,
+                        help='jcli sessions all workers may open to a '
+                             'backend, 0 for no cap')
+    parser.add_argument('--warmup-sessions', type=int,
+                        default=settings.WARMUP_SESSIONS,
+                        help='jcli sessions each worker opens to every '
+                             'backend before it is ready')
+    parser.add_argument('--preload', action=argparse.BooleanOptionalAction,
+                        default=settings.WARMUP_PRELOAD,
+                        help='Refresh the mirror before being ready')
+    options = parser.parse_args()
+    if options.workers <= 0:
+        options.workers = os.cpu_count() or 1
+    return options
+
+
+def listen(options):
+    "Bind the socket the workers share"
+    global _listener
+    family, kind, proto, _, address = socket.getaddrinfo(
+        options.host, options.port, type=socket.SOCK_STREAM,
+        flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, kind, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(options.socket_queue_size)
+    _listener = sock
+
+
+def adopt(httpserver):
+    """Have the cheroot httpserver accept on the socket listen() bound
+    rather than binding its own"""
+    def bind(family, type, proto=0):
+        httpserver.socket = _listener.dup()
+        httpserver.bind_addr = httpserver.socket.getsockname()[:2]
+    httpserver.bind = bind
+
+
+def serve(options, index):
+    "Run worker index until the engine exits"
+    import cherrypy
+    from jasmin_api.wsgi import application
+    from rest_api import mirror, probe, stats, warmup, workers
+
+    cherrypy.tree.graft(application, "/")
+    cherrypy.server.unsubscribe()
+
+    server = cherrypy._cpserver.Server()
+    server.socket_host = options.host
+    server.socket_port = options.port
+    server.thread_pool = options.threads
+    server.socket_queue_size = options.socket_queue_size
+    server.socket_timeout = options.socket_timeout
+    server.protocol_version = 'HTTP/1.1' if options.keep_alive else 'HTTP/1.0'
+    server.httpserver, _ = server.httpserver_from_self()
+    server.httpserver.keep_alive_conn_limit = options.keep_alive_connections
+    if _listener is not None:
+        adopt(server.httpserver)
+    server.subscribe()
+
+    preload = index == 0 and options.preload and settings.MIRROR_ENABLED
+    warmup.start(preload)
+    if options.workers > 1:
+        workers.share(index)
+
+    if (index == 0 and settings.MIRROR_ENABLED
+            and settings.MIRROR_SYNC_INTERVAL > 0):
+        #a preload is the first sync
+        mirror.start_sync_thread(
+            settings.MIRROR_SYNC_INTERVAL,
+            delay=settings.MIRROR_SYNC_INTERVAL if preload else 0)
+
+    #samples are stored for every worker to serve
+    if index == 0 and settings.STATS_INTERVAL > 0:
+        stats.start_sampler(settings.STATS_INTERVAL)
+
+    if index == 0 and settings.PROBE_INTERVAL > 0:
+        probe.start_prober(settings.PROBE_INTERVAL)
+
+    if options.workers > 1:
+        #a worker re-executing itself would leave the supervisor
+        cherrypy.engine.autoreload.unsubscribe()
+        cherrypy.engine.signals.subscribe()
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+
+def fork(options, index):
+    "Start worker index in a child process, returns its pid"
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    from rest_api import budget
+    budget.worker(index)
+    code = 0
+    try:
+        serve(options, index)
+    except BaseException:
+        logger.exception('Worker %d failed', index)
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def supervise(options):
+    """Fork the workers, restart those that die, giving back their jcli
+    sessions budget, stop them on SIGTERM/SIGINT"""
+    from rest_api import budget, workers
+    children = {fork(options, i): i for i in range(options.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.error('Worker %d exited with status %d, restarting it',
+                     index, status)
+        reclaimed = budget.reclaim(index)
+        if reclaimed:
+            logger.warning('Reclaimed %d jcli sessions of worker %d',
+                           reclaimed, index)
+        workers.retire(index)
+        time.sleep(1)
+        children[fork(options, index)] = index
+
+
+def main():
+    options = parse_args()
+    settings.JCLI_MAX_SESSIONS = options.max_sessions
+    settings.WARMUP_SESSIONS = options.warmup_sessions
+    if options.workers == 1:
+        serve(options, 0)
+        return
+    listen(options)
+    import django
+    django.setup()
+    from rest_api import budget, workers
+    budget.setup(options.workers)
+    temporary = not settings.WORKERS_DIR
+    workers.setup(settings.WORKERS_DIR or tempfile.mkdtemp(prefix='jasmin-api-'))
+    try:
+        supervise(options)
+    finally:
+        if temporary:
+            shutil.rmtree(settings.WORKERS_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()